@@ -0,0 +1,64 @@
+'''How long ``import oidcat`` takes, using ``python -X importtime``.
+
+This catches regressions where something slow (like ``requests``) sneaks back into
+the package import. It prints the slowest modules and exits with an error if any of
+``--forbid`` got imported.
+
+.. code-block:: bash
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --stmt "from oidcat import Token" --top 20
+
+'''
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def importtime(stmt='import oidcat'):
+    '''Run ``stmt`` in a fresh interpreter and parse the ``-X importtime`` output.
+
+    Returns:
+        times (dict): ``{module: (self_us, cumulative_us, toplevel)}``
+    '''
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', stmt],
+        cwd=ROOT, capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line.split(':', 1)[1].split('|')
+        times[name.strip()] = int(self_us), int(cumulative), name[1:2] != ' '
+    return times
+
+
+def total_time(times, baseline):
+    '''The time spent on the top-level imports that the interpreter doesn't do anyway.'''
+    return sum(cumulative for name, (_, cumulative, top) in times.items() if top and name not in baseline)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stmt', default='import oidcat')
+    parser.add_argument('-n', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--forbid', nargs='*', default=['requests', 'urllib3', 'asyncio', 'httpx', 'jwt'])
+    args = parser.parse_args()
+
+    baseline = importtime('pass')
+    runs = [importtime(args.stmt) for _ in range(args.n)]
+    total = statistics.median(total_time(run, baseline) for run in runs)
+    print('{!r}: {:.2f} ms (median of {})'.format(args.stmt, total / 1e3, args.n))
+
+    last = {k: v for k, v in runs[-1].items() if k not in baseline}
+    print('\nslowest modules (cumulative):')
+    for name, (self_us, cumulative, _) in sorted(last.items(), key=lambda x: -x[1][1])[:args.top]:
+        print('  {:<40} {:8.2f} ms'.format(name, cumulative / 1e3))
+
+    forbidden = [m for m in args.forbid if m in last]
+    if forbidden:
+        sys.exit('\n{!r} imported: {}'.format(args.stmt, ', '.join(forbidden)))
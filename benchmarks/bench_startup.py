@@ -0,0 +1,104 @@
+'''How long it takes to get from nothing to a usable ``oidcat.Session``.
+
+This runs a fake auth server on localhost that takes ``--latency`` seconds to answer
+each request (to look like a real, remote auth server) and compares:
+
+- ``import oidcat`` (in a fresh interpreter)
+- ``Session(...)`` with a cold discovery cache, a warm discovery cache, and ``lazy=True``
+
+.. code-block:: bash
+
+    python benchmarks/bench_startup.py --latency 0.05
+
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+os.environ.setdefault('OIDCAT_CACHE_DIR', tempfile.mkdtemp())
+import oidcat
+
+LATENCY = 0.05
+
+
+class FakeAuthServer(BaseHTTPRequestHandler):
+    def do_GET(self):  # .well-known
+        base = 'http://{}:{}'.format(*self.server.server_address)
+        self._send({'issuer': base, 'token_endpoint': base + '/token',
+                    'end_session_endpoint': base + '/logout'})
+
+    def do_POST(self):  # token endpoint
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        now = time.time()
+        token = lambda ttl: oidcat.token.jwt_encode(
+            {'alg': 'none'}, {'iat': now, 'exp': now + ttl, 'scope': 'profile'}, 'x')
+        self._send({'access_token': token(300), 'refresh_token': token(1800)})
+
+    def _send(self, data):
+        time.sleep(LATENCY)
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+def time_import(n=5):
+    '''Time ``import oidcat`` in a fresh interpreter.'''
+    code = 'import time; t = time.perf_counter(); import oidcat; print(time.perf_counter() - t)'
+    return [float(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)) for _ in range(n)]
+
+
+def time_session(url, n=5, clear_cache=False, **kw):
+    times = []
+    for _ in range(n):
+        if clear_cache:
+            oidcat.discovery.default_cache().clear()
+        start = time.perf_counter()
+        sess = oidcat.Session(url, 'user', 'pass', **kw)
+        times.append(time.perf_counter() - start)
+        sess.close()
+    return times
+
+
+def time_first_token(url):
+    '''With lazy, the discovery and login happen on the first request instead.'''
+    sess = oidcat.Session(url, 'user', 'pass', lazy=True)
+    start = time.perf_counter()
+    sess.require_login()
+    return time.perf_counter() - start
+
+
+def report(name, times):
+    print('{:<36} {:8.2f} ms (min {:.2f})'.format(name, statistics.median(times) * 1e3, min(times) * 1e3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=LATENCY)
+    parser.add_argument('-n', type=int, default=5)
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAuthServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/.well-known/openid-configuration'.format(*server.server_address)
+
+    report('import oidcat', time_import(args.n))
+    report('Session() - cold discovery', time_session(url, args.n, clear_cache=True))
+    report('Session() - warm discovery', time_session(url, args.n))
+    report('Session(lazy=True)', time_session(url, args.n, lazy=True))
+    report('Session(lazy=True).require_login()', [time_first_token(url) for _ in range(args.n)])
+    server.shutdown()
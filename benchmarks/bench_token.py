@@ -0,0 +1,50 @@
+'''Compare eager vs lazy token construction and time role checks.
+
+.. code-block:: bash
+
+    python benchmarks/bench_token.py
+
+'''
+import os
+import sys
+import time
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import oidcat
+
+# a token shaped like a typical keycloak access token
+TOKEN = oidcat.token.jwt_encode({'alg': 'RS256', 'typ': 'JWT', 'kid': 'abc'}, {
+    'exp': time.time() + 300, 'iat': time.time(), 'iss': 'https://auth.myproject.com/auth/realms/master',
+    'aud': 'account', 'sub': '5059cfcd-a4aa-4b7e-8514-c292c6d87dec', 'typ': 'Bearer', 'azp': 'my-client',
+    'realm_access': {'roles': ['offline_access', 'uma_authorization'] + ['group-{}'.format(i) for i in range(20)]},
+    'resource_access': {'account': {'roles': ['manage-account', 'view-profile']}},
+    'scope': 'email profile', 'preferred_username': 'someone', 'email': 'someone@myproject.com',
+}, 'x' * 342)
+
+
+def bench(name, stmt, number=20000):
+    t = min(timeit.repeat(stmt, number=number, repeat=5)) / number
+    print('{:<40} {:8.2f} us'.format(name, t * 1e6))
+
+
+if __name__ == '__main__':
+    Token = oidcat.Token
+    bench('eager: Token(s)', lambda: Token(TOKEN))
+    bench('lazy:  Token(s)', lambda: Token(TOKEN, lazy=True))
+    bench('eager: str(Token(s))', lambda: str(Token(TOKEN)))
+    bench('lazy:  str(Token(s))', lambda: str(Token(TOKEN, lazy=True)))
+    bench('eager: Token(s)["sub"]', lambda: Token(TOKEN)['sub'])
+    bench('lazy:  Token(s)["sub"]', lambda: Token(TOKEN, lazy=True)['sub'])
+    t = Token(TOKEN)
+    bench('decoded: token["sub"]', lambda: t['sub'], number=200000)
+
+    # role checks (with a user in a lot of groups)
+    many = Token(oidcat.token.mod_token(TOKEN, realm_access={
+        'roles': ['group-{}'.format(i) for i in range(300)]}))
+    bench('has_role(3 roles)', lambda: many.has_role('admin', 'editor', 'group-299'), number=200000)
+    bench('has_role(realm=..., client_id=...)', lambda: many.has_role(
+        realm='group-5', client_id='account'), number=200000)
+    bench('check_roles(3 roles)', lambda: many.check_roles('admin', 'editor', 'group-299'), number=200000)
+    patterns = ['data-{}-*'.format(i) for i in range(24)] + ['group-29?']
+    bench('has_role(25 patterns)', lambda: many.has_role(*patterns), number=200000)
+    bench('has_role(25 patterns) - no match', lambda: many.has_role(*patterns[:-1]), number=200000)
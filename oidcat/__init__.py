@@ -5,5 +5,37 @@ role = Role()
 env = Env()
 from . import token
 from .token import *
-from .core import *
 # from .server import *
+
+# These are loaded on first access (PEP 562) so that ``import oidcat`` and
+# ``from oidcat import Token`` don't have to import requests (which is slow).
+_LAZY_ATTRS = {
+    'Session': 'core', 'Access': 'core', 'response_json': 'core',
+    'WellKnown': 'well_known',
+}
+# keep ``from oidcat import *`` exporting the lazy attributes too
+__all__ = [
+    'RequestError', 'AuthenticationError', 'Unauthorized', 'AuthServerUnavailable',
+    'safe_format', 'exc2response', 'util', 'Role', 'Env', 'role', 'env', 'token',
+    *token.__all__, *_LAZY_ATTRS,
+]
+_LAZY_MODULES = {
+    'core', 'well_known', 'cache', 'validation', 'pool', 'breaker', 'discovery',
+    'store', 'middleware', 'policy', 'aio', 'server', 'cli',
+}
+
+
+def __getattr__(name):
+    import importlib
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module('.' + _LAZY_ATTRS[name], __name__), name)
+    elif name in _LAZY_MODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS) | _LAZY_MODULES)
@@ -0,0 +1,330 @@
+'''Asyncio versions of ``Session`` and ``Access``, built on ``httpx``.
+
+Requires ``httpx`` (``pip install oidcat[async]``).
+
+.. code-block:: python
+
+    import oidcat.aio
+
+    async def main():
+        async with oidcat.aio.AsyncSession(
+                'auth.myserver.com', 'myusername', 'mysecretpassword',
+                client_id='my-client-id') as sess:
+            resp = await sess.get('https://api.myserver.com/protected/endpoint')
+            resp.raise_for_status()
+            print(resp.json())
+
+            # to make a request without a token
+            resp = await sess.get('https://otherserver.com/public', auth=None)
+
+'''
+import asyncio
+import httpx
+from .token import Token
+from .well_known import WellKnown, KeyStore, check_error, IDEMPOTENT, _unverified_kid
+from . import util, RequestError, AuthenticationError
+
+__all__ = ['AsyncSession', 'AsyncAccess', 'AsyncWellKnown', 'AsyncKeyStore']
+
+
+class AsyncSession(httpx.AsyncClient):
+    def __init__(self, auth_url, username=None, password=None,
+                 client_id='admin-cli', client_secret=None,
+                 inject_token=True, client_kw=None, **kw):
+        '''An ``httpx.AsyncClient`` that implicitly handles OAuth2 authentication.
+        This is the asyncio equivalent of ``oidcat.Session``.
+
+        Arguments:
+            *a: See ``AsyncAccess`` for information on arguments.
+            inject_token (bool): whether to use tokens on all requests by default.
+                To disable it for a single request, pass ``auth=None``.
+            client_kw (dict): extra arguments for ``httpx.AsyncClient``.
+            **kw: See ``AsyncAccess`` for information on arguments.
+        '''
+        self.access = AsyncAccess(auth_url, username, password, client_id, client_secret, **kw)
+        super().__init__(auth=BearerAuth(self.access) if inject_token else None, **(client_kw or {}))
+
+    def __repr__(self):
+        return '<{}({!r})>'.format(self.__class__.__qualname__, self.access)
+
+    async def login(self, *a, **kw):
+        '''Login to the authorization server and get an access token.'''
+        return await self.access.login(*a, **kw)
+
+    async def logout(self, *a, **kw):
+        '''Logout of the authorization server.'''
+        return await self.access.logout(*a, **kw)
+
+    async def require_login(self, *a, **kw):
+        '''If not logged in, log back in.'''
+        return await self.access.require(*a, **kw)
+
+    async def aclose(self):
+        await self.access.aclose()
+        await super().aclose()
+
+
+class BearerAuth(httpx.Auth):
+    '''An ``httpx`` auth flow that adds the current access token to each request.'''
+    def __init__(self, access):
+        self.access = access
+
+    async def async_auth_flow(self, request):
+        token = await self.access.require()
+        request.headers['Authorization'] = 'Bearer {}'.format(token)
+        yield request
+
+
+class AsyncAccess:
+    def __init__(self, url, username=None, password=None,
+                 client_id='admin-cli', client_secret=None,
+                 token=None, refresh_token=None,
+                 refresh_buffer=8, refresh_token_buffer=20,
+                 offline=None, discard_credentials=False,
+                 sess=None, _wk=None):
+        '''Controls access, making sure you always have a valid token. This is the
+        asyncio equivalent of ``oidcat.Access``.
+
+        Unlike ``Access``, this doesn't do anything over the network until it needs
+        to, so the well-known configuration is fetched and the user is logged in on
+        the first call to ``require()`` (or ``login()``).
+
+        Concurrent calls to ``require()`` share a single token refresh.
+
+        Arguments:
+            url (str): The url for your authentication server.
+            sess (httpx.AsyncClient): the client used to talk to the auth server.
+                By default, a new one is created.
+            _wk (dict, WellKnown): an existing well-known configuration.
+            See ``oidcat.Access`` for the other arguments. ``ask`` and ``store`` aren't supported.
+        '''
+        self.url = url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_buffer = refresh_buffer
+        self.refresh_token_buffer = refresh_token_buffer
+        self._own_sess = sess is None
+        self.sess = httpx.AsyncClient() if sess is None else sess
+        self.well_known = self._as_well_known(_wk) if _wk is not None else None
+
+        # this makes sure that concurrent tasks don't all refresh at the same time.
+        self.login_lock = asyncio.Lock()
+
+        # tokens
+        self.token = Token.astoken(token, refresh_buffer)
+        self.refresh_token = Token.astoken(refresh_token, refresh_token_buffer, lazy=True)
+        self.offline = (
+            'offline_access' in self.refresh_token.get('scope', '')
+        ) if offline is None else offline
+
+        # credentials
+        self._discard_credentials = discard_credentials
+        self.username = username
+        self.password = None if discard_credentials else password
+
+    def __repr__(self):
+        return '{}(username={!r}, client={!r}, valid={}, refresh_valid={})'.format(
+            self.__class__.__name__, self.username, self.client_id,
+            bool(self.token), bool(self.refresh_token))
+
+    def __str__(self):
+        '''Get the token as a string.'''
+        return str(self.token)
+
+    def __bool__(self):
+        '''Evaluates True if the token is valid.'''
+        return bool(self.token)
+
+    def _as_well_known(self, data):
+        return AsyncWellKnown(
+            data, client_id=self.client_id, client_secret=self.client_secret, sess=self.sess,
+            refresh_buffer=self.refresh_buffer, refresh_token_buffer=self.refresh_token_buffer)
+
+    async def discover(self):
+        '''Get the well-known configuration for the auth server (if we don't have it already).'''
+        if self.well_known is None:
+            self.well_known = self._as_well_known(
+                await AsyncWellKnown.fetch(self.url, sess=self.sess))
+        return self.well_known
+
+    async def require(self):
+        '''Retrieve the token, and refresh if it is expired. This is safe to call from concurrent tasks.'''
+        if not self.token:
+            async with self.login_lock:
+                if not self.token:
+                    await self.login()
+        return self.token
+
+    async def login(self, username=None, password=None, offline=None):
+        '''Login from your authentication provider and acquire a token.
+        See ``oidcat.Access.login``.'''
+        wk = await self.discover()
+        offline = self.offline if offline is None else offline
+
+        # first check if we can use a refresh token
+        logged_in = False  # in case the refresh token fails
+        if self.refresh_token:
+            try:
+                self.token, self.refresh_token = await wk.refresh_token(
+                    self.refresh_token, offline=offline)
+                logged_in = bool(self.token)
+            except RequestError as e:
+                if '(invalid_grant)' not in str(e):
+                    raise
+                pass  # invalid refresh token - just move on
+
+        if not logged_in:  # that didn't work, let's try with username/password
+            username = username or self.username
+            password = password or self.password
+            if not username:
+                raise AuthenticationError('No username provided for login at {}'.format(
+                    wk['token_endpoint']))
+
+            if not self._discard_credentials:
+                self.username, self.password = username, password
+
+            self.token, self.refresh_token = await wk.get_token(
+                username, password, offline=offline)
+
+    async def logout(self):
+        '''Logout from your authentication provider.'''
+        wk = await self.discover()
+        await wk.end_session(self.token, self.refresh_token)
+        self.token = self.refresh_token = None
+        self.username = self.password = None
+
+    async def user_info(self):
+        '''Get user info from your authentication provider.'''
+        return await (await self.discover()).userinfo(await self.require())
+
+    async def token_info(self):
+        '''Get token info from your authentication provider.'''
+        return await (await self.discover()).tokeninfo(await self.require())
+
+    async def aclose(self):
+        '''Close the auth server client (if we created it).'''
+        if self._own_sess:
+            await self.sess.aclose()
+
+
+class AsyncWellKnown(WellKnown):
+    '''The asyncio equivalent of ``oidcat.WellKnown``. The network methods are coroutines.
+
+    Because ``__init__`` can't be awaited, you either need to pass the well-known configuration
+    as a dict or use:
+
+    .. code-block:: python
+
+        wk = oidcat.aio.AsyncWellKnown(await AsyncWellKnown.fetch('auth.myproject.com'), sess=client)
+    '''
+    def __init__(self, url, *a, sess=None, **kw):
+        if not isinstance(url, dict):
+            raise TypeError('{} needs the well-known data, use: await {}.fetch(url)'.format(
+                self.__class__.__name__, self.__class__.__name__))
+        super().__init__(url, *a, sess=sess, **kw)
+        self.key_store = AsyncKeyStore(self, self.key_store.ttl, self.key_store.refetch_interval)
+
+    @staticmethod
+    async def fetch(url, realm=None, secure=True, sess=None):
+        '''Get the well-known configuration for an auth server.
+
+        Returns:
+            data (dict): the well-known configuration.
+        '''
+        url = util.well_known_url(url, realm=realm, secure=secure)
+        if sess is None:
+            async with httpx.AsyncClient() as sess:
+                resp = await sess.get(url)
+        else:
+            resp = await sess.get(url)
+        return check_error(resp.json(), '.well-known')
+
+    async def jwks(self):
+        '''Get the JSON Web Key certificates. Queries ``wk['jwks_uri']``.'''
+        return (await self._arequest('jwks', 'get', dict(url=self['jwks_uri']))).json()['keys']
+
+    async def verify_token(self, token, audience=None, leeway=0, algorithms=None):
+        '''The async version of ``WellKnown.verify_token``.'''
+        token = str(token)
+        kid = _unverified_kid(token)
+        return self._verify_token(token, kid, await self.key_store.get(kid), audience, leeway, algorithms)
+
+    async def userinfo(self, token):
+        '''Get user info from the token string.'''
+        return check_error((await self._arequest(
+            'userinfo', 'post', self._userinfo_request(token))).json(), 'user info')
+
+    async def tokeninfo(self, token):
+        '''Get token info from the token string.'''
+        return check_error((await self._arequest(
+            'tokeninfo', 'post', self._tokeninfo_request(token))).json(), 'token info')
+
+    async def get_token(self, username, password=None, offline=False, scope=None):
+        '''Login to get the token.'''
+        return self._tokens(check_error((await self._arequest('token', 'post', self._get_token_request(
+            username, password, offline=offline, scope=scope))).json(), 'access token'))
+
+    async def refresh_token(self, refresh_token, offline=False, scope=None):
+        '''Refresh the token.'''
+        return self._tokens(check_error((await self._arequest('refresh', 'post', self._refresh_token_request(
+            refresh_token, offline=offline, scope=scope))).json(), 'refreshed access token'))
+
+    async def end_session(self, token, refresh_token=None):
+        '''Logout.'''
+        await self._arequest('end_session', 'post', self._end_session_request(token, refresh_token))
+
+    async def _arequest(self, endpoint, method, kw):
+        '''The async version of ``WellKnown._request``.'''
+        kw = dict(kw, timeout=self._timeout(endpoint))
+        attempts = 1 + (self.retries if endpoint in IDEMPOTENT else 0)
+        for i in range(attempts):
+            self.breaker.check()
+            try:
+                resp = await getattr(self.sess, method)(**kw)
+            except httpx.TransportError:
+                self.breaker.failure()
+                if i + 1 >= attempts:
+                    raise
+            except BaseException:  # e.g. the task was cancelled
+                self.breaker.release()  # don't hold on to the half-open trial slot
+                raise
+            else:
+                if resp.status_code < 500:
+                    self.breaker.success()
+                    return resp
+                self.breaker.failure()
+                if i + 1 >= attempts:
+                    return resp
+            await asyncio.sleep(self._backoff(i))
+
+
+class AsyncKeyStore(KeyStore):
+    '''The asyncio version of ``oidcat.well_known.KeyStore``, used by ``AsyncWellKnown``
+    (where ``jwks()`` is a coroutine). ``get`` and ``refresh`` are coroutines.'''
+    def __init__(self, well_known, ttl=300, refetch_interval=30):
+        super().__init__(well_known, ttl, refetch_interval)
+        self._lock = asyncio.Lock()
+
+    async def get(self, kid):
+        '''Get the parsed public key (a ``jwt.PyJWK``) for a key ID, or None.'''
+        if self.age() > self.ttl:
+            await self.refresh(self.ttl)
+        key = self.keys.get(kid)
+        if key is None:  # maybe the keys were rotated
+            await self.refresh(self.refetch_interval)
+            key = self.keys.get(kid)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key
+
+    async def refresh(self, min_age=0):
+        '''Fetch the keys from the auth server (if they're older than ``min_age``).'''
+        async with self._lock:
+            if self.age() < min_age:
+                return
+            self._set_keys(await self.well_known.jwks())
+
+    def clear(self):
+        '''Forget all of the keys.'''
+        self.keys, self.fetched_at = {}, None
@@ -0,0 +1,132 @@
+'''Keeps a struggling auth server from taking everything else down with it.
+
+If the auth server is down or hanging, every request that needs it will wait for its
+timeout (and retries), which quickly uses up all of your worker threads. A circuit
+breaker notices the failures and makes further calls fail immediately for a little
+while, before letting a single trial call through to see if it has recovered.
+
+.. code-block:: python
+
+    breaker = oidcat.breaker.CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    breaker.check()  # raises oidcat.AuthServerUnavailable if the circuit is open
+    try:
+        resp = do_request()
+    except requests.ConnectionError:
+        breaker.failure()
+        raise
+    except BaseException:  # not the auth server's fault (e.g. cancelled)
+        breaker.release()
+        raise
+    breaker.success()
+
+Every ``WellKnown`` has one of these as ``wk.breaker``.
+
+'''
+import time
+import random
+import threading
+from . import AuthServerUnavailable
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, name='auth server'):
+        '''Fail fast after repeated failures.
+
+        Arguments:
+            failure_threshold (int): the number of consecutive failures before we stop trying.
+                Set to 0 to disable.
+            reset_timeout (float): how many seconds to wait before letting a trial call through.
+            name (str): what we're protecting (used in error messages).
+        '''
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trips = self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        '''Can we make a call right now? Once the reset timeout has passed, this
+        lets a single trial call through.'''
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        '''Make sure we can make a call.
+
+        Raises:
+            oidcat.AuthServerUnavailable if the circuit is open.
+        '''
+        if not self.allow():
+            raise AuthServerUnavailable(
+                'The {} has failed {} times in a row. Not trying again for {:.0f}s.'.format(
+                    self.name, self.failures,
+                    max(self.reset_timeout - (time.monotonic() - (self.opened_at or 0)), 0)))
+
+    def success(self):
+        '''Record a successful call. This closes the circuit.'''
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        '''Record a failed call. This opens the circuit once we hit the threshold
+        (or immediately, if it was a trial call).'''
+        with self._lock:
+            self.failures += 1
+            if self.failure_threshold and (self._trial or self.failures >= self.failure_threshold):
+                if self.opened_at is None or self._trial:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+    def release(self):
+        '''Give back the trial slot without recording a success or a failure (e.g. the call
+        was cancelled or failed before it reached the auth server). Otherwise a call that
+        neither succeeds nor fails would leave the circuit half-open forever.'''
+        with self._lock:
+            self._trial = False
+
+    def reset(self):
+        '''Close the circuit.'''
+        self.success()
+
+    def stats(self):
+        '''Get the breaker state and counters.'''
+        return {'state': self.state, 'failures': self.failures, 'trips': self.trips, 'rejected': self.rejected}
+
+
+def backoff(attempt, base=0.1, cap=2):
+    '''How long to sleep before retrying, using exponential backoff with "full jitter"
+    so that a bunch of clients that failed together don't all retry together.
+
+    Arguments:
+        attempt (int): the number of attempts that have failed so far (starting at 0).
+        base (float): the backoff for the first retry, in seconds.
+        cap (float): the maximum backoff, in seconds.
+    '''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,331 @@
+'''Caches used to avoid re-validating the same tokens over and over.
+
+.. code-block:: python
+
+    cache = oidcat.cache.LRUCache(maxsize=1024, ttl=60)
+    cache.set(key, value, expires=token['exp'])  # expires at whichever comes first
+    value = cache.get(key)  # None if missing or expired
+
+Anything with ``get(key)`` and ``set(key, value, ttl=None, expires=None)`` methods can
+be used as a cache backend, e.g. ``SqliteCache`` can be used to share a cache between
+processes (like gunicorn workers).
+
+'''
+import time
+import functools
+import hashlib
+import threading
+import collections
+
+
+def token_key(token):
+    '''Get a cache key for a token. The token is hashed so that we don't keep
+    the bearer tokens themselves lying around in the cache.'''
+    return hashlib.sha256(str(token).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        '''A thread-safe, size-bounded, least-recently-used cache where each entry can expire.
+
+        Arguments:
+            maxsize (int): the maximum number of entries. The least recently used entries
+                are evicted first.
+            ttl (float, None): the default number of seconds that an entry lives for.
+                If None, entries only expire if an expiration is given to ``set``.
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        '''Get a value from the cache.
+
+        Arguments:
+            key (hashable): the cache key.
+            default (any): the value to return if the key is missing or expired.
+            count (bool): whether to count this as a hit/miss.
+        '''
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += count
+                return default
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                self.misses += count
+                return default
+            self._data.move_to_end(key)
+            self.hits += count
+            return value
+
+    def set(self, key, value, ttl=None, expires=None):
+        '''Add a value to the cache.
+
+        Arguments:
+            key (hashable): the cache key.
+            value (any): the value.
+            ttl (float, None): the number of seconds that the entry lives for. By default, uses ``self.ttl``.
+            expires (float, None): a timestamp that the entry must not outlive (e.g. a token's ``exp``).
+                The entry will expire at whichever comes first, ``ttl`` or ``expires``.
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None:
+            expires = min(time.time() + ttl, expires or float('inf'))
+        if not self.maxsize or (expires is not None and expires <= time.time()):
+            return
+        with self._lock:
+            self._data[key] = value, expires
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        '''Remove a value from the cache.'''
+        with self._lock:
+            value, _ = self._data.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        '''Remove everything from the cache.'''
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        '''Get the cache hit/miss counters.'''
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': hit_ratio(self.hits, self.misses),
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+class SqliteCache:
+    def __init__(self, fname, tablename='oidcat', ttl=None):
+        '''A cache stored in a sqlite file so that it can be shared between processes
+        on the same machine. Requires ``sqlitedict``.
+
+        Unlike ``LRUCache``, this isn't size-bounded, but expired entries are removed
+        when they're accessed, or all at once using ``purge()``.
+
+        Arguments:
+            fname (str): the sqlite database file.
+            tablename (str): the table to use.
+            ttl (float, None): the default number of seconds that an entry lives for.
+        '''
+        import sqlitedict
+        self.fname = fname
+        self.ttl = ttl
+        self._data = sqlitedict.SqliteDict(fname, tablename=tablename, autocommit=True)
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.fname)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        '''Get a value from the cache. See ``LRUCache.get``.'''
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            self.misses += count
+            return default
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self.misses += count
+            return default
+        self.hits += count
+        return value
+
+    def set(self, key, value, ttl=None, expires=None):
+        '''Add a value to the cache. See ``LRUCache.set``.'''
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None:
+            expires = min(time.time() + ttl, expires or float('inf'))
+        if expires is not None and expires <= time.time():
+            return
+        self._data[key] = value, expires
+
+    def pop(self, key, default=None):
+        '''Remove a value from the cache.'''
+        value, _ = self._data.pop(key, (default, None))
+        return value
+
+    def purge(self):
+        '''Remove all of the expired entries.'''
+        now = time.time()
+        for key, (_, expires) in list(self._data.items()):
+            if expires is not None and expires <= now:
+                self._data.pop(key, None)
+
+    def clear(self):
+        '''Remove everything from the cache.'''
+        self._data.clear()
+
+    def stats(self):
+        '''Get the cache hit/miss counters.'''
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': hit_ratio(self.hits, self.misses),
+                'size': len(self._data)}
+
+
+class SingleFlight:
+    '''Makes sure that concurrent calls for the same key only run once. The first thread
+    runs the function and the other threads wait for it and share its result (or error).
+
+    This prevents a burst of requests with the same new token from each querying the auth server.
+
+    .. code-block:: python
+
+        flight = SingleFlight()
+        info = flight.do(token_key(token), wk.tokeninfo, token)
+    '''
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = self.shared = 0
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    def do(self, key, func, *a, **kw):
+        '''Call ``func(*a, **kw)``, unless there's already a call in progress for ``key``,
+        in which case, wait for it and return its result.'''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*a, **kw)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        '''Get the number of calls that were made and the number that were shared.'''
+        return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+
+class AsyncSingleFlight:
+    '''The asyncio version of ``SingleFlight``. Concurrent tasks (on the same event loop)
+    awaiting the same key share a single call.
+
+    .. code-block:: python
+
+        flight = AsyncSingleFlight()
+        info = await flight.do(token_key(token), wk.tokeninfo, token)
+    '''
+    def __init__(self):
+        self._calls = {}
+        self.calls = self.shared = 0
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    async def do(self, key, func, *a, **kw):
+        '''Await ``func(*a, **kw)``, unless there's already a call in progress for ``key``,
+        in which case, wait for it and return its result.
+
+        The call runs in its own task, so if the task that started it is cancelled (e.g. its
+        client disconnected), the other tasks waiting on it still get the result.'''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        key = id(loop), key  # futures can't be shared between loops
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = self._calls[key] = asyncio.ensure_future(func(*a, **kw))
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # don't warn if nobody was left waiting for it
+
+    def stats(self):
+        '''Get the number of calls that were made and the number that were shared.'''
+        return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = self.error = None
+
+
+class LatencyStats:
+    '''Keeps track of how long something takes (e.g. a request to the auth server).
+
+    .. code-block:: python
+
+        latency = LatencyStats()
+        start = time.perf_counter()
+        do_something()
+        latency.add(time.perf_counter() - start)
+        print(latency.stats())  # {'count': 1, 'mean': 0.012, 'max': 0.012, 'last': 0.012}
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = self.max = self.last = 0.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    def add(self, seconds):
+        '''Record a measurement.'''
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            self.max = max(self.max, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def stats(self):
+        '''Get the latency summary (in seconds).'''
+        return {'count': self.count, 'mean': self.mean, 'max': self.max, 'last': self.last}
+
+
+def hit_ratio(hits, misses):
+    '''The fraction of cache lookups that were hits.'''
+    return hits / (hits + misses) if hits + misses else 0.
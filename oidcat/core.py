@@ -33,11 +33,14 @@ Whereas with ``requests``, you'd see:
 '''
 import os
 import json
+import time
 import threading
 import requests
 # from requests.auth import HTTPBasicAuth
 from .token import Token
 from .well_known import WellKnown
+from .cache import LatencyStats
+from .store import TokenStore
 from . import util, RequestError, AuthenticationError
 
 # __all__ = ['Session', 'Access']
@@ -134,6 +137,11 @@ class Session(requests.Session):
         '''If not logged in, log back in.'''
         return self.access.require(*a, **kw)
 
+    def close(self):
+        '''Close the session and stop refreshing tokens in the background.'''
+        self.access.stop_refresher()
+        super().close()
+
 
 class _Qs:
     # BASE_HOST = 'What is the base domain of your server (e.g. myapp.com - (assumed services: auth.myapp.com, api.myapp.com))?'
@@ -153,6 +161,9 @@ class Access:
                  refresh_buffer=8, refresh_token_buffer=20,
                  login=None, offline=None, ask=False,
                  store=False, discard_credentials=False,
+                 background_refresh=False, refresh_fraction=0.75, refresh_retry=5,
+                 stale_while_revalidate=False, stale_deadline=1,
+                 lazy=False, prefetch=False, shared_store=None,
                  sess=None, _wk=None):
         '''Controls access, making sure you always have a valid token.
 
@@ -208,6 +219,23 @@ class Access:
                 it means that you will only have automatic access for the lifetime of the
                 refresh token. In order to maintain access you would have to call
                 ``self.login(username, password)`` to renew the refresh token before it expires.
+            background_refresh (bool): should we refresh the tokens in a background thread before they
+                expire? This way, requests never have to wait for the token endpoint. See ``start_refresher``.
+            refresh_fraction (float): how far into the token's lifetime we should refresh it in the background.
+            refresh_retry (float): how many seconds to wait before trying again after a background refresh fails.
+            stale_while_revalidate (bool): once the token is within ``refresh_buffer`` of expiring,
+                should ``require()`` keep handing out the old token while it is refreshed in a
+                background thread? This keeps requests from blocking when the auth server is slow.
+                If a refresh fails, the next one isn't started for ``refresh_retry`` seconds.
+            stale_deadline (float): with ``stale_while_revalidate``, once the token has less than
+                this many seconds left, ``require()`` blocks until the token is refreshed.
+            lazy (bool): don't talk to the auth server until we need to. The well-known configuration
+                is fetched the first time ``well_known`` is used and we login on the first ``require()``.
+                This makes creating a (e.g. module-level) ``Session`` free.
+            prefetch (bool): with ``lazy``, start discovery and login in a background thread right away
+                so that it's (probably) done by the time the first request needs a token.
+            shared_store (str, TokenStore, None): a file to share tokens between processes. When the token
+                expires, one process refreshes it and the others pick it up from the file. See ``oidcat.store``.
         '''
         self.sess = sess or requests
         self.client_id = client_id
@@ -217,9 +245,20 @@ class Access:
         # don't both try to re-login at the same time.
         self.login_lock = threading.Lock()
 
+        # background refresh
+        self.refresh_fraction = refresh_fraction
+        self.refresh_retry = refresh_retry
+        self.refresh_latency = LatencyStats()
+        self.refresh_failures = 0
+        self.refresh_error = None
+        self._refresh_failed_at = None  # time.monotonic() of the last failed stale refresh
+        self._refresher = self._refresher_stop = None
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_deadline = stale_deadline
+
         # (maybe) load saved info from file
         self.store = os.path.expanduser(store) if store else store
-        with util.saveddict(self.store) as cfg:
+        with util.saveddict(self.store, lock=True) as cfg:
             # see if we have the url stored somewhere
             _wk = _wk or cfg.get('well_known') or url or cfg.get('previous_url')
             if not _wk and ask:
@@ -227,12 +266,16 @@ class Access:
             if url:
                 cfg['previous_url'] = url
             # read cached well-known from config
-            self.well_known = cfg['well_known'] = WellKnown(
-                _wk or url,
+            self._wk_source = _wk or url
+            self._wk_kw = dict(
                 client_id=client_id,
                 client_secret=client_secret,
                 refresh_buffer=refresh_buffer,
                 refresh_token_buffer=refresh_token_buffer)
+            self._well_known = None
+            self._discover_lock = threading.Lock()
+            if not lazy:
+                self.well_known = cfg['well_known'] = WellKnown(self._wk_source, **self._wk_kw)
 
             # read tokens from config
             if token is None and refresh_token is None:
@@ -240,12 +283,19 @@ class Access:
                 refresh_token = cfg.get('refresh_token') or None
 
         # tokens
+        self.refresh_buffer = refresh_buffer
+        self.refresh_token_buffer = refresh_token_buffer
         self.token = Token.astoken(token, refresh_buffer)
         self.refresh_token = Token.astoken(refresh_token, refresh_token_buffer)
         self.offline = (
             'offline_access' in self.refresh_token.get('scope', '')
         ) if offline is None else offline
 
+        # tokens shared with other processes
+        self.shared_store = TokenStore(shared_store) if isinstance(shared_store, str) else shared_store
+        if self.shared_store is not None:
+            self._load_shared()
+
         # credentials
         self.ask = ask
         self._discard_credentials = discard_credentials
@@ -256,8 +306,17 @@ class Access:
         # login
         if login is None:  # by default, handle login depending on inputs
             login = token is None or self.refresh_token is not None
+        # with lazy, we hold onto the credentials until the first require()
+        self._deferred_login = None
         if login and not self.token and username and password:
-            self.login(username, password)
+            if lazy:
+                self._deferred_login = username, password
+            else:
+                self.login(username, password)
+        if background_refresh:
+            self.start_refresher()
+        if lazy and prefetch:
+            threading.Thread(target=self._prefetch, name='oidcat-prefetch', daemon=True).start()
 
     def __repr__(self):
         '''Get a comprehensive view of the contents of the Access object.'''
@@ -281,6 +340,30 @@ class Access:
         '''Evaluates True if the token is valid.'''
         return bool(self.token)
 
+    @property
+    def well_known(self):
+        '''The auth server's well-known configuration. With ``lazy=True``, it is fetched on first use.'''
+        if self._well_known is None:
+            with self._discover_lock:
+                if self._well_known is None:
+                    self._well_known = WellKnown(self._wk_source, **self._wk_kw)
+                    if self.store:
+                        with util.saveddict(self.store, lock=True) as cfg:
+                            cfg['well_known'] = self._well_known
+        return self._well_known
+
+    @well_known.setter
+    def well_known(self, well_known):
+        self._well_known = well_known
+
+    def _prefetch(self):
+        '''Discover and login in the background (see ``lazy`` and ``prefetch``).'''
+        try:
+            self.require()
+        except Exception as e:  # require() will try again (and raise) when it's actually needed
+            self.refresh_failures += 1
+            self.refresh_error = e
+
     def require(self):
         '''Retrieve the token, and refresh if it is expired. This is thread safe !'''
         if not self.token:
@@ -293,11 +376,138 @@ class Access:
             #       < timeof(lock) / dt_call
             # which should almost always be true, because short login tokens
             # are forking awful.
+            if self.shared_store is not None and self._load_shared_unless_busy():
+                return self.token  # another process refreshed it
+            token = self.token
+            if (self.stale_while_revalidate and token is not None and
+                    token.seconds_left > self.stale_deadline):
+                # the token still works, so use it while we get a new one
+                self._refresh_in_background()
+                return token
             with self.login_lock:
                 if not self.token:
-                    self.login()
+                    self._login(*(self._deferred_login or ()))
+                    self._deferred_login = None
         return self.token
 
+    def _login(self, *a, **kw):
+        '''Login, but if we're sharing tokens with other processes, make sure that only
+        one of them logs in at a time and that we use the new token if someone else did.'''
+        if self.shared_store is None:
+            return self.login(*a, **kw)
+        with self.shared_store.lock():
+            if not self._load_shared():
+                self.login(*a, **kw)
+
+    def _load_shared_unless_busy(self):
+        '''Load the shared tokens while holding ``login_lock`` so that we don't race a refresh in
+        another thread. If someone is already refreshing, leave it to them (they check the store too).'''
+        if not self.login_lock.acquire(blocking=False):
+            return False
+        try:
+            return self._load_shared()
+        finally:
+            self.login_lock.release()
+
+    def _load_shared(self):
+        '''Use the tokens from the shared store if they're different from ours and still valid.
+
+        Returns:
+            loaded (bool): whether we got new tokens.
+        '''
+        token, refresh_token = self.shared_store.load()
+        if not token or self.token is not None and token == self.token.token:
+            return False
+        token = Token(token, self.refresh_buffer)
+        if not token:
+            return False
+        self.token = token
+        self.refresh_token = Token.astoken(refresh_token, self.refresh_token_buffer, lazy=True)
+        return True
+
+    def start_refresher(self):
+        '''Start refreshing the tokens in a background thread.
+
+        The access token is refreshed once it has used up ``refresh_fraction`` of its lifetime and
+        the refresh token (e.g. an offline token) is renewed before it gets within
+        ``refresh_token_buffer`` of expiring. This means that ``require()`` should never have to
+        wait for the token endpoint.
+
+        Failures are retried every ``refresh_retry`` seconds and are recorded in
+        ``refresh_failures`` and ``refresh_error``. ``refresh_latency`` records how long the
+        refreshes took.
+        '''
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresher_stop = threading.Event()
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, args=(self._refresher_stop,),
+            name='oidcat-refresh', daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self, timeout=None):
+        '''Stop refreshing tokens in the background.'''
+        if self._refresher is None:
+            return
+        self._refresher_stop.set()
+        if self._refresher is not threading.current_thread():
+            self._refresher.join(timeout)
+        self._refresher = None
+
+    def _refresh_loop(self, stop):
+        while not stop.is_set():
+            wait = self._next_refresh()
+            if stop.wait(self.refresh_retry if wait is None else wait):
+                break
+            if wait is None:  # nothing to refresh yet
+                continue
+            start = time.perf_counter()
+            try:
+                with self.login_lock:
+                    self._login()
+                self.refresh_latency.add(time.perf_counter() - start)
+            except Exception as e:
+                self.refresh_failures += 1
+                self.refresh_error = e
+                stop.wait(self.refresh_retry)
+
+    def _refresh_in_background(self):
+        '''Refresh the token in another thread, unless a refresh is already happening
+        or the last one failed less than ``refresh_retry`` seconds ago.'''
+        failed_at = self._refresh_failed_at
+        if failed_at is not None and time.monotonic() - failed_at < self.refresh_retry:
+            return
+        if not self.login_lock.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._refresh_locked, name='oidcat-refresh-stale', daemon=True).start()
+        except BaseException:
+            self.login_lock.release()
+            raise
+
+    def _refresh_locked(self):
+        '''Refresh the token. ``login_lock`` must already be acquired and will be released.'''
+        start = time.perf_counter()
+        try:
+            if not self.token:
+                self._login()
+                self.refresh_latency.add(time.perf_counter() - start)
+            self._refresh_failed_at = None
+        except Exception as e:
+            self.refresh_failures += 1
+            self.refresh_error = e
+            self._refresh_failed_at = time.monotonic()
+        finally:
+            self.login_lock.release()
+
+    def _next_refresh(self):
+        '''How many seconds until we should refresh the tokens in the background.'''
+        times = [
+            _refresh_time(t, self.refresh_fraction)
+            for t in (self.token, self.refresh_token) if t is not None and t.token]
+        times = [t for t in times if t is not None]
+        return max(min(times) - time.time(), 0) if times else None
+
     def login(self, username=None, password=None, ask=None, offline=None):
         '''Login from your authentication provider and acquire a token.
 
@@ -343,24 +553,29 @@ class Access:
                 username, password, offline=offline)
 
         if self.store:
-            with util.saveddict(self.store) as cfg:
+            with util.saveddict(self.store, lock=True) as cfg:
                 cfg['token'] = str(self.token)
                 cfg['refresh_token'] = str(self.refresh_token)
+        if self.shared_store is not None:
+            self.shared_store.save(self.token, self.refresh_token)
 
     def logout(self):
         '''Logout from your authentication provider.'''
+        self.stop_refresher()
         self.well_known.end_session(self.token, self.refresh_token)
         self.token = self.refresh_token = None
         self.username = self.password = None
+        if self.shared_store is not None:
+            self.shared_store.clear()
         if self.store:
-            with util.saveddict(self.store) as cfg:
+            with util.saveddict(self.store, lock=True) as cfg:
                 cfg['token'] = cfg['refresh_token'] = None
                 cfg['username'] = cfg['password'] = None  # making sure
 
     def configure(self, clear=False, **kw):
         '''Update the saved information stored on disk.'''
         if self.store:
-            with util.saveddict(self.store) as cfg:
+            with util.saveddict(self.store, lock=True) as cfg:
                 if clear:
                     cfg.clear()
                 cfg.update(kw)
@@ -375,6 +590,15 @@ class Access:
 
 
 
+def _refresh_time(token, fraction):
+    '''When a token should be refreshed: ``fraction`` of the way through its lifetime,
+    but before it enters its buffer.'''
+    if not token._exp:
+        return None
+    iat = token.get('iat') or time.time()
+    return min(iat + (token._exp - iat) * fraction, token._deadline)
+
+
 def response_json(resp):
     '''Get the json response from the object, and raise if it's an error.
     It also detects 502 Bad Gateway errors which are returned by nginx
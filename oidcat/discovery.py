@@ -0,0 +1,229 @@
+'''A persistent cache for the auth server's ``.well-known/openid-configuration``.
+
+The well-known configuration almost never changes, but without a cache, every new
+``WellKnown`` (i.e. every CLI call, every worker that starts up) has to fetch it before it
+can do anything else. By default, it's only cached in memory (for the process). To share it
+between processes, opt in to keeping it on disk by setting ``$OIDCAT_CACHE_DIR`` or passing
+``discovery=True`` (``~/.cache/oidcat/well-known.json``). Then:
+
+- while it's fresh, we don't touch the network at all. It's fresh for the ``max-age`` the
+  auth server sent in ``Cache-Control``, or for ``ttl`` seconds if it didn't send one.
+- once it's stale, we do a conditional GET (``If-None-Match``/``If-Modified-Since``) so
+  that if it hasn't changed, the server just says ``304 Not Modified``.
+- if the auth server can't be reached (or returns a 5xx), we use the stale copy rather than failing.
+
+.. code-block:: python
+
+    wk = oidcat.WellKnown('auth.myproject.com')  # uses the default cache (in memory)
+    wk = oidcat.WellKnown('auth.myproject.com', discovery=True)  # cache it on disk
+    wk = oidcat.WellKnown('auth.myproject.com', discovery=False)  # always fetch
+
+    cache = oidcat.discovery.DiscoveryCache('/var/cache/myapp/well-known.json', ttl=600)
+    wk = oidcat.WellKnown('auth.myproject.com', discovery=cache)
+
+'''
+import os
+import json
+import time
+import warnings
+import threading
+from .util import HOMEDIR
+
+__all__ = ['DiscoveryCache', 'default_cache', 'disk_cache', 'get_cache', 'CACHE_DIR']
+
+CACHE_DIR = os.getenv('OIDCAT_CACHE_DIR') or os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(HOMEDIR, '.cache'), 'oidcat')
+
+
+class DiscoveryCache:
+    def __init__(self, fname=None, ttl=3600, max_ttl=86400):
+        '''Cache well-known configurations in a JSON file.
+
+        Arguments:
+            fname (str, None): the cache file. If None, the cache is only kept in memory.
+            ttl (float): how many seconds an entry is fresh for if the auth server doesn't
+                send a ``Cache-Control: max-age``.
+            max_ttl (float): the most we'll trust the auth server's ``max-age``.
+        '''
+        self.fname = fname and os.path.expanduser(fname)
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self._data = None
+        self._lock = threading.Lock()
+        self._warned = False
+        self.hits = self.revalidated = self.fetches = self.stale = 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.fname)
+
+    def get(self, url, fetch):
+        '''Get the well-known configuration for a url.
+
+        Arguments:
+            url (str): the full well-known url.
+            fetch (callable): ``fetch(headers)`` makes the GET request with the given
+                (conditional) headers and returns the response.
+
+        Returns:
+            data (dict): the well-known configuration.
+        '''
+        entry = self._entries().get(url)
+        if entry is None or entry['expires'] <= time.time():
+            entry = self._load().get(url) or entry  # maybe another process refreshed it
+        if entry is not None and entry['expires'] > time.time():
+            self.hits += 1
+            return entry['data']
+
+        try:
+            resp = fetch(_conditional_headers(entry))
+        except Exception:
+            if entry is None:
+                raise
+            self.stale += 1  # we can't reach the auth server, but we've got an old copy
+            return entry['data']
+
+        if resp.status_code >= 500 and entry is not None:
+            self.stale += 1  # the auth server is having a bad day, but we've got an old copy
+            return entry['data']
+        if resp.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            data = entry['data']
+        else:
+            self.fetches += 1
+            data = resp.json()
+            if resp.status_code >= 400 or 'error' in data:
+                return data  # don't cache errors
+        self._store(url, data, getattr(resp, 'headers', None) or {}, entry)
+        return data
+
+    def pop(self, url):
+        '''Forget a url.'''
+        with self._lock:
+            data = self._read()
+            data.pop(url, None)
+            self._data = data
+            self._write(data)
+
+    def clear(self):
+        '''Forget everything.'''
+        with self._lock:
+            self._data = {}
+            self._write({})
+
+    def stats(self):
+        '''Get the cache counters.'''
+        return {'hits': self.hits, 'revalidated': self.revalidated,
+                'fetches': self.fetches, 'stale': self.stale}
+
+    def _entries(self):
+        if self._data is None:
+            self._load()
+        return self._data
+
+    def _load(self):
+        with self._lock:
+            self._data = self._read()
+            return self._data
+
+    def _store(self, url, data, headers, old=None):
+        cache_control = _cache_control(headers.get('Cache-Control') or headers.get('cache-control'))
+        if 'no-store' in cache_control:
+            return
+        ttl = self.ttl
+        if 'no-cache' in cache_control:
+            ttl = 0
+        elif 'max-age' in cache_control:
+            ttl = min(cache_control['max-age'], self.max_ttl)
+        old = old or {}
+        entry = {
+            'data': data, 'expires': time.time() + ttl,
+            'etag': headers.get('ETag') or headers.get('etag') or old.get('etag'),
+            'last_modified': (
+                headers.get('Last-Modified') or headers.get('last-modified') or old.get('last_modified')),
+        }
+        with self._lock:
+            entries = self._read()
+            entries[url] = entry
+            self._data = entries
+            self._write(entries)
+
+    def _read(self):
+        if not self.fname:
+            return dict(self._data or {})
+        try:
+            with open(self.fname, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict(self._data or {})
+
+    def _write(self, entries):
+        if not self.fname:
+            return
+        try:  # write + rename so that other processes never see a partial file
+            os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+            tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.fname)
+        except OSError as e:  # e.g. a read-only filesystem - just keep it in memory
+            if not self._warned:
+                self._warned = True
+                warnings.warn('Could not write the discovery cache {!r}, keeping it in memory: {}'.format(
+                    self.fname, e), RuntimeWarning)
+
+
+def _conditional_headers(entry):
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def _cache_control(value):
+    '''Parse a Cache-Control header. e.g. ``'public, max-age=60'`` => ``{'public': True, 'max-age': 60}``'''
+    directives = {}
+    for part in (value or '').split(','):
+        k, _, v = part.strip().partition('=')
+        if not k:
+            continue
+        k = k.lower()
+        if k == 'max-age':
+            try:
+                directives[k] = max(int(v.strip('"')), 0)
+            except ValueError:
+                continue
+        else:
+            directives[k] = v or True
+    return directives
+
+
+_default = _disk = None
+
+def default_cache():
+    '''The cache used by ``WellKnown`` and ``util.get_well_known`` by default. It's kept in
+    memory, unless ``$OIDCAT_CACHE_DIR`` is set, in which case it's the on-disk cache.'''
+    global _default
+    if _default is None:
+        _default = disk_cache() if os.getenv('OIDCAT_CACHE_DIR') else DiscoveryCache()
+    return _default
+
+
+def disk_cache():
+    '''The cache in ``CACHE_DIR/well-known.json`` (i.e. ``discovery=True``).'''
+    global _disk
+    if _disk is None:
+        _disk = DiscoveryCache(os.path.join(os.getenv('OIDCAT_CACHE_DIR') or CACHE_DIR, 'well-known.json'))
+    return _disk
+
+
+def get_cache(discovery=None):
+    '''Get the cache for a ``discovery`` argument (see ``WellKnown``): None for the default
+    cache, True for the on-disk cache, or a ``DiscoveryCache``. False means no cache (None).'''
+    if discovery is False:
+        return None
+    if discovery is True:
+        return disk_cache()
+    return default_cache() if discovery is None else discovery
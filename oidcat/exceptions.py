@@ -1,5 +1,4 @@
 import sys
-import traceback
 
 
 class _SafeDict(dict):
@@ -64,8 +63,16 @@ class Unauthorized(AuthenticationError):
     headers = {'WWW-Authenticate': 'Bearer'}
     traceback_in_response = False
 
+class AuthServerUnavailable(RequestError):
+    '''The auth server is failing so we're not going to bother it for a little while.
+    See ``oidcat.breaker.CircuitBreaker``.'''
+    status_code = 503
+    default_message = 'The auth server is unavailable'
+    traceback_in_response = False
+
 
 def exc2response(exc, asresponse=False, include_tb=None, show_tb=True):
+    import traceback
     # build error payload
     payload = {
         'error': True,
@@ -0,0 +1,221 @@
+'''WSGI and ASGI middleware that validate bearer tokens before they reach your app.
+
+These don't depend on flask, so you can put them in front of any WSGI/ASGI service.
+
+.. code-block:: python
+
+    wk = oidcat.WellKnown('auth.myproject.com', 'my-client', 'my-secret')
+    validator = oidcat.validation.TokenValidator(wk, local=True)
+
+    # WSGI (flask, django, ...)
+    app.wsgi_app = oidcat.middleware.WSGIMiddleware(app.wsgi_app, validator)
+
+    # ASGI (starlette, fastapi, quart, ...)
+    app = oidcat.middleware.ASGIMiddleware(app, validator)
+
+The token is taken from (in order) the ``Authorization: Bearer ...`` header, an
+``access_token`` query parameter, or an ``access_token`` urlencoded form field. Change
+the order (or drop sources) using ``sources=('header', 'query', 'form')``. The form is
+only read for small (``max_form_size``) ``application/x-www-form-urlencoded`` bodies with
+a ``Content-Length`` - never for uploads or streaming bodies - so a request without a token
+is rejected before we read its body.
+
+Inside your app, the token is available as ``environ['oidcat.token']`` (WSGI) or
+``scope['oidcat.token']`` (ASGI). If the token is missing or invalid, it is an empty
+``Token`` and the reason is in ``'oidcat.validity'``. Pass ``required=True`` to respond
+with a ``401`` instead of calling the app.
+
+'''
+import io
+import json
+from urllib.parse import parse_qs
+from . import Unauthorized, exc2response
+from .token import Token
+
+__all__ = ['WSGIMiddleware', 'ASGIMiddleware']
+
+TOKEN_KEY = 'oidcat.token'
+TOKEN_INFO_KEY = 'oidcat.token_info'
+VALIDITY_KEY = 'oidcat.validity'
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+TOKEN_SOURCES = ('header', 'query', 'form')
+MAX_FORM_SIZE = 64 * 1024
+
+
+class _Middleware:
+    def __init__(self, app, validator, scopes=None, required=False,
+                 sources=TOKEN_SOURCES, max_form_size=MAX_FORM_SIZE):
+        '''Validate the bearer token of each request before passing it to the app.
+
+        Arguments:
+            app (callable): the app to wrap.
+            validator (oidcat.validation.TokenValidator): validates the tokens.
+            scopes (list, str, None): the scopes that tokens must have.
+            required (bool): whether to respond with a 401 when the token is missing or invalid.
+                Otherwise, the request is passed along and your app can decide.
+            sources (list): where to look for the token, in order: ``'header'``, ``'query'``, ``'form'``.
+            max_form_size (int): the largest urlencoded body that we'll read to look for a token.
+        '''
+        self.app = app
+        self.validator = validator
+        self.scopes = scopes
+        self.required = required
+        self.sources = check_sources(sources, TOKEN_SOURCES)
+        self.max_form_size = max_form_size
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(self.__class__.__name__, self.app, self.validator)
+
+    def _attach(self, env, token, validity, token_info):
+        '''Put the results in the environ/scope.'''
+        env[TOKEN_KEY] = (
+            Token(token, lazy=True) if validity is True else
+            Token(valid=Unauthorized(str(validity))))
+        env[TOKEN_INFO_KEY] = token_info
+        env[VALIDITY_KEY] = validity
+
+    def _error_response(self, validity):
+        payload, status, headers = exc2response(Unauthorized(str(validity)), show_tb=False)
+        body = json.dumps(payload).encode('utf-8')
+        headers = dict(headers, **{'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+        return status, list(headers.items()), body
+
+
+class WSGIMiddleware(_Middleware):
+    '''Validates the bearer token of each request before passing it to a WSGI app.
+    See the module docs.'''
+    def __call__(self, environ, start_response):
+        token = _wsgi_token(environ, self.sources, self.max_form_size)
+        validity, token_info = self.validator.validate(token, self.scopes)
+        self._attach(environ, token, validity, token_info)
+        if validity is not True and self.required:
+            status, headers, body = self._error_response(validity)
+            start_response('{} Unauthorized'.format(status), headers)
+            return [body]
+        return self.app(environ, start_response)
+
+
+class ASGIMiddleware(_Middleware):
+    '''Validates the bearer token of each request before passing it to an ASGI app.
+    Introspection is awaited, so it doesn't block the event loop. See the module docs.'''
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.app(scope, self._closing_on_shutdown(receive), send)
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+
+        token, receive = await _asgi_token(scope, receive, self.sources, self.max_form_size)
+        validity, token_info = await self.validator.avalidate(token, self.scopes)
+        scope = dict(scope)
+        self._attach(scope, token, validity, token_info)
+        if validity is not True and self.required:
+            if scope['type'] == 'websocket':  # closing before accepting means a 403
+                return await send({'type': 'websocket.close', 'code': 1008})
+            status, headers, body = self._error_response(validity)
+            await send({'type': 'http.response.start', 'status': status, 'headers': [
+                (k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+            return await send({'type': 'http.response.body', 'body': body})
+        return await self.app(scope, receive, send)
+
+    def _closing_on_shutdown(self, receive):
+        '''Close the validator's introspection client when the server shuts down.'''
+        async def inner():
+            message = await receive()
+            if message['type'] == 'lifespan.shutdown':
+                await self.validator.aclose()
+            return message
+        return inner
+
+
+def check_sources(sources, available):
+    '''Make sure that the token sources are known.'''
+    sources = tuple(sources)
+    unknown = set(sources) - set(available)
+    if unknown:
+        raise ValueError('Unknown token sources {}. Available: {}'.format(sorted(unknown), list(available)))
+    return sources
+
+
+def readable_form(content_type, content_length, max_size=MAX_FORM_SIZE):
+    '''Whether it's safe to read the body to look for an ``access_token`` form field - i.e.
+    it's a small urlencoded form with a known length (not an upload or a streaming body).'''
+    if (content_type or '').split(';', 1)[0].strip().lower() != FORM_CONTENT_TYPE:
+        return False
+    try:
+        return 0 < int(content_length) <= max_size
+    except (TypeError, ValueError):
+        return False
+
+
+def _bearer(auth):
+    '''Get the token from an Authorization header.'''
+    return auth.split(None, 1)[1].strip() if auth and auth.startswith('Bearer ') else None
+
+
+def _form_token(content_type, body):
+    if content_type.split(';', 1)[0].strip().lower() != FORM_CONTENT_TYPE:
+        return None
+    return _query_token(body.decode('latin-1'))
+
+
+def _query_token(query):
+    return (parse_qs(query).get('access_token') or [None])[0] if query else None
+
+
+def _wsgi_token(environ, sources=TOKEN_SOURCES, max_form_size=MAX_FORM_SIZE):
+    '''Get the token from a WSGI environ. If we need to read the form, the body is
+    put back so that the app can still read it.'''
+    for source in sources:
+        if source == 'header':
+            token = _bearer(environ.get('HTTP_AUTHORIZATION'))
+        elif source == 'query':
+            token = _query_token(environ.get('QUERY_STRING'))
+        elif readable_form(environ.get('CONTENT_TYPE'), environ.get('CONTENT_LENGTH'), max_form_size):
+            body = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            environ['wsgi.input'] = io.BytesIO(body)
+            token = _form_token(environ['CONTENT_TYPE'], body)
+        else:
+            token = None
+        if token:
+            return token
+
+
+async def _asgi_token(scope, receive, sources=TOKEN_SOURCES, max_form_size=MAX_FORM_SIZE):
+    '''Get the token from an ASGI scope. If we need to read the form, the body is
+    replayed to the app.
+
+    Returns:
+        token (str, None): the token.
+        receive (callable): the receive function to pass to the app.
+    '''
+    headers = {k.lower(): v for k, v in scope.get('headers') or ()}
+    for source in sources:
+        if source == 'header':
+            token = _bearer(headers.get(b'authorization', b'').decode('latin-1'))
+        elif source == 'query':
+            token = _query_token(scope.get('query_string', b'').decode('latin-1'))
+        elif scope['type'] == 'http' and readable_form(
+                headers.get(b'content-type', b'').decode('latin-1'),
+                headers.get(b'content-length', b'').decode('latin-1'), max_form_size):
+            body, receive = await _buffer_body(receive)
+            token = _form_token(headers[b'content-type'].decode('latin-1'), body)
+        else:
+            token = None
+        if token:
+            return token, receive
+    return None, receive
+
+
+async def _buffer_body(receive):
+    '''Read the whole request body and return a receive function that replays it.'''
+    messages = []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message['type'] != 'http.request' or not message.get('more_body'):
+            break
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.request')
+
+    async def replay():
+        return messages.pop(0) if messages else await receive()
+    return body, replay
@@ -0,0 +1,223 @@
+'''Compiled authorization policies.
+
+A ``Policy`` is everything a token needs to have to get through a door - roles,
+scopes, audience and any custom checks. It's built once (e.g. when you decorate a
+route) so checking a token on each request is just a few set lookups.
+
+.. code-block:: python
+
+    from oidcat.policy import Policy
+
+    admin = Policy('admin', 'superuser', scopes='profile')
+    editor = Policy(realm_roles=['write', 'publish'], require=all)
+    reader = Policy('data-read-*')  # glob patterns work too
+
+    admin.evaluate(token)  # True or a string saying why not
+    admin.check(token)     # raises oidcat.Unauthorized
+
+Protected flask routes (``oidc.accept_token``, ``oidc.protect_roles`` and
+``oidcat.server.protection``) are added to ``oidcat.policy.registry`` so you can
+see your app's authorization surface in one place:
+
+.. code-block:: python
+
+    print(oidcat.policy.registry.report(app))
+    # GET        /           index  (unprotected)
+    # GET, POST  /admin      admin  roles=any of ['admin', 'superuser'] scopes=['profile']
+    # GET        /data/<id>  data   roles=any of ['read-data']
+
+'''
+import sys
+from . import util
+from .exceptions import Unauthorized
+from .token import compile_roles
+
+__all__ = ['Policy', 'PolicyRegistry', 'registry']
+
+_EMPTY = frozenset()
+
+
+class Policy:
+    def __init__(self, *roles, realm_roles=None, client_roles=None, scopes=None, audience=None,
+                 client_id=True, require=any, checks=None, name=None):
+        '''The requirements for a token to be accepted.
+
+        Arguments:
+            *roles (str, list): realm or client roles to look for.
+            realm_roles (str, list, None): realm roles to look for.
+            client_roles (str, list, None): client roles to look for.
+            scopes (str, list, None): scopes that the token must have (all of them).
+            audience (str, list, None): the token's ``aud`` must include one of these.
+            client_id (str, list, bool, None): the client(s) to take client roles from. If True, it uses
+                the ``client_id`` passed to ``evaluate`` (e.g. the server's client). If None, it uses
+                all clients. If False, client roles are ignored.
+            require (callable): ``any`` if the token needs at least one role from each group
+                (``roles``, ``realm_roles``, ``client_roles``), or ``all`` if it needs every role.
+                Any other function will get a list of booleans for each role in the group.
+            checks (list[callable]): additional checks. Each receives the Token and returns a bool.
+            name (str, None): a name for the policy (shown in reports).
+        '''
+        self.roles = _compile(roles)
+        self.realm_roles = _compile(realm_roles)
+        self.client_roles = _compile(client_roles)
+        # (matcher, use realm roles, use client roles)
+        self._groups = tuple((compile_roles(roles), realm, client) for roles, realm, client in (
+            (self.roles, True, True), (self.realm_roles, True, False), (self.client_roles, False, True)) if roles)
+        self.scopes = frozenset(util.aslist(scopes, split=' '))
+        self.audience = frozenset(util.aslist(audience))
+        self.client_id = client_id
+        self.require = require
+        self.checks = tuple(util.aslist(checks))
+        self.name = name
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.describe())
+
+    def describe(self):
+        '''A short description of the policy, e.g. ``roles=any of ['admin'] scopes=['profile']``.'''
+        req = getattr(self.require, '__name__', str(self.require))
+        parts = ['{}={} of {}'.format(k, req, list(v)) for k, v in (
+            ('roles', self.roles), ('realm_roles', self.realm_roles), ('client_roles', self.client_roles)) if v]
+        if self.scopes:
+            parts.append('scopes={}'.format(sorted(self.scopes)))
+        if self.audience:
+            parts.append('audience={}'.format(sorted(self.audience)))
+        if self.client_id is not True:
+            parts.append('client_id={!r}'.format(self.client_id))
+        if self.checks:
+            parts.append('checks={}'.format([getattr(c, '__name__', repr(c)) for c in self.checks]))
+        return ' '.join(parts) or 'any valid token'
+
+    def as_dict(self):
+        '''The policy as a json-friendly dict.'''
+        return {
+            'name': self.name, 'roles': list(self.roles), 'realm_roles': list(self.realm_roles),
+            'client_roles': list(self.client_roles), 'scopes': sorted(self.scopes),
+            'audience': sorted(self.audience), 'client_id': self.client_id,
+            'require': getattr(self.require, '__name__', str(self.require)),
+            'checks': [getattr(c, '__name__', repr(c)) for c in self.checks],
+        }
+
+    def evaluate(self, token, client_id=None, scopes=True):
+        '''Check a token against the policy. This doesn't check if the token is valid/expired.
+
+        Arguments:
+            token (Token): the token.
+            client_id (str, None): the client to take client roles from if the policy's
+                ``client_id`` is True. If None, all clients are used.
+            scopes (bool): whether to check the scopes (e.g. False if the token validator already did).
+
+        Returns:
+            validity (bool, str): True if the token passes, otherwise a string describing why not.
+        '''
+        if scopes and self.scopes and not self.scopes.issubset((token.get('scope') or '').split(' ')):
+            return 'Token does not have required scopes'
+        if self.audience and self.audience.isdisjoint(util.aslist(token.get('aud'))):
+            return 'Refused token because of invalid audience'
+
+        if self._groups:
+            client_id = client_id if self.client_id is True else self.client_id
+            realm = token.realm_roles
+            client = token.client_roles(client_id) if client_id is not False else _EMPTY
+            for matcher, use_realm, use_client in self._groups:
+                available = (realm, client) if use_realm and use_client else (realm,) if use_realm else (client,)
+                if not self._has_roles(matcher, available):
+                    return 'Insufficient privileges. unable to: {}'.format(
+                        [r for r in matcher.targets if not any(matcher.has(r, a) for a in available)])
+
+        if self.checks and not all(check(token) for check in self.checks):
+            return 'Insufficient privileges.'
+        return True
+
+    def check(self, token, client_id=None, scopes=True):
+        '''Like ``evaluate``, but raises ``oidcat.Unauthorized`` if the token doesn't pass.
+
+        Returns:
+            token (Token): the token.
+        '''
+        validity = self.evaluate(token, client_id, scopes)
+        if validity is not True:
+            raise Unauthorized(validity)
+        return token
+
+    def _has_roles(self, matcher, available):
+        require = self.require
+        if require is any:
+            for a in available:
+                if matcher.any(a):
+                    return True
+            return False
+        if require is all:
+            for r in matcher.targets:
+                for a in available:
+                    if matcher.has(r, a):
+                        break
+                else:
+                    return False
+            return True
+        return require([any(matcher.has(r, a) for a in available) for r in matcher.targets])
+
+
+def _compile(roles):
+    '''Flatten roles into a tuple of interned strings (so lookups in the token's role index are quick).'''
+    return tuple(dict.fromkeys(
+        sys.intern(r) for rs in util.aslist(roles) for r in util.aslist(rs)))
+
+
+class PolicyRegistry:
+    '''Keeps track of which view functions are protected by what.'''
+    def __init__(self):
+        self.policies = {}
+
+    def __repr__(self):
+        return '{}({} views)'.format(self.__class__.__name__, len(self.policies))
+
+    def __len__(self):
+        return len(self.policies)
+
+    def __iter__(self):
+        return iter(self.policies.items())
+
+    def register(self, view, policy):
+        '''Record that ``view`` is protected by ``policy`` (a ``Policy`` or anything with a useful repr).'''
+        self.policies[view] = policy
+        return view
+
+    def get(self, view):
+        '''Get the policy for a view function (following ``functools.wraps`` wrappers).'''
+        while view is not None:
+            if view in self.policies:
+                return self.policies[view]
+            view = getattr(view, '__wrapped__', None)
+
+    def routes(self, app):
+        '''List every route in a flask app and its policy.
+
+        Returns:
+            routes (list): ``(rule, methods, endpoint, policy)`` tuples. ``policy`` is None for unprotected routes.
+        '''
+        return [
+            (rule.rule, sorted((rule.methods or set()) - {'HEAD', 'OPTIONS'}), rule.endpoint,
+             self.get(app.view_functions.get(rule.endpoint)))
+            for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule)]
+
+    def report(self, app, unprotected=True):
+        '''A table of the app's routes and what protects them.
+
+        Arguments:
+            app (flask.Flask): the app.
+            unprotected (bool): whether to include routes that don't have a policy.
+        '''
+        rows = [
+            (', '.join(methods), rule, endpoint, (
+                policy.describe() if isinstance(policy, Policy) else
+                repr(policy) if policy is not None else '(unprotected)'))
+            for rule, methods, endpoint, policy in self.routes(app)
+            if unprotected or policy is not None]
+        widths = [max([len(r[i]) for r in rows] or [0]) for i in range(3)]
+        return '\n'.join(
+            '  '.join(c.ljust(w) for c, w in zip(row[:3], widths)) + '  ' + row[3]
+            for row in rows)
+
+
+registry = PolicyRegistry()
@@ -0,0 +1,95 @@
+'''Pooled HTTP sessions for talking to the auth server.
+
+Using ``requests.get``/``requests.post`` directly opens a new connection (and does a
+new TLS handshake) for every call. That's fine for a script that logs in once, but on
+a server that introspects a token on every request, it adds up fast. So by default,
+``WellKnown`` and ``util.get_well_known`` share a single pooled, keep-alive session.
+
+.. code-block:: python
+
+    # change the shared session settings (e.g. for a server with 32 worker threads)
+    oidcat.pool.configure(pool_maxsize=32, timeout=5, max_retries=2)
+
+    # or give a WellKnown its own pool
+    wk = oidcat.WellKnown('auth.myproject.com', sess=oidcat.pool.PooledSession(pool_maxsize=4))
+
+The shared session doesn't keep cookies (it talks to unrelated auth servers) and a forked
+process (e.g. a gunicorn worker with ``--preload``) gets a new one instead of sharing the
+parent's open connections.
+
+'''
+import os
+import threading
+import http.cookiejar
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ['PooledSession', 'shared_session', 'configure']
+
+
+class PooledSession(requests.Session):
+    def __init__(self, pool_connections=4, pool_maxsize=16, max_retries=0,
+                 timeout=None, keep_alive=True, cookies=True):
+        '''A ``requests.Session`` with a tuned connection pool and a default timeout.
+
+        Arguments:
+            pool_connections (int): the number of hosts to keep connection pools for.
+            pool_maxsize (int): the maximum number of connections kept open per host. Set this
+                to around the number of threads that talk to the auth server at the same time.
+            max_retries (int, urllib3.util.Retry): how many times to retry failed connections.
+            timeout (float, tuple, None): the default ``(connect, read)`` timeout for each request.
+                This can still be overridden per request.
+            keep_alive (bool): whether to keep connections open between requests.
+            cookies (bool): whether to keep cookies that the servers set.
+        '''
+        super().__init__()
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            max_retries=max_retries)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        if not cookies:
+            self.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    def request(self, *a, **kw):
+        if self.timeout is not None:
+            kw.setdefault('timeout', self.timeout)
+        return super().request(*a, **kw)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_session():
+    '''Get the pooled session that's shared by default between all ``WellKnown`` objects.'''
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = PooledSession(cookies=False)
+    return _shared
+
+
+def configure(**kw):
+    '''Replace the shared session with a new one. Takes the same arguments as ``PooledSession``.
+
+    Objects that already grabbed the old session keep using it, so call this at startup.
+    '''
+    global _shared
+    kw.setdefault('cookies', False)
+    with _shared_lock:
+        _shared = PooledSession(**kw)
+    return _shared
+
+
+def _after_fork():
+    '''Don't share the parent's connections (or its lock) with a forked child.'''
+    global _shared, _shared_lock
+    _shared, _shared_lock = None, threading.Lock()
+
+if hasattr(os, 'register_at_fork'):  # not on windows
+    os.register_at_fork(after_in_child=_after_fork)
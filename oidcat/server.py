@@ -12,6 +12,27 @@ Connecting to Flask App
     oidc = oidcat.server.OIDC(app)
 
 
+Async Views
+-----------
+
+``accept_token``, ``protect_roles`` and ``protection`` also work on ``async def`` views
+(``pip install flask[async] oidcat[async]``). Flask runs each async view in its own event loop,
+so token introspection uses the pooled (keep-alive) session in a thread rather than opening a new
+``httpx`` connection for every request.
+
+.. code-block:: python
+
+    @app.route('/data')
+    @oidc.accept_token(role='read-data')
+    async def data():
+        ...
+
+    @app.route('/other')
+    async def other():
+        token = await oidc.valid_token_async('read-data')
+        ...
+
+
 Protecting Routes Using Roles
 -----------------------------
 
@@ -90,7 +111,10 @@ permissions!
 
 '''
 import os
+import copy
+import asyncio
 import json
+import inspect
 import functools
 import flask
 from flask import request, current_app, g
@@ -98,9 +122,18 @@ import flask_oidc
 import oidcat
 from . import util, Unauthorized, RequestError, exc2response
 from .token import Token
+from .well_known import WellKnown, TIMEOUTS
+from .validation import TokenValidator, check_scopes
+from .cache import SqliteCache, LRUCache, token_key
+from .pool import PooledSession
+from .breaker import CircuitBreaker
+from .policy import Policy, registry
+from .middleware import check_sources, readable_form
 
 log = flask_oidc.logger
 
+TOKEN_SOURCES = ('header', 'query', 'form', 'session')
+
 
 class OpenIDConnect(flask_oidc.OpenIDConnect):
     @functools.wraps(flask_oidc.OpenIDConnect.__init__)
@@ -109,89 +142,188 @@ class OpenIDConnect(flask_oidc.OpenIDConnect):
             import sqlitedict
             credentials_store = sqlitedict.SqliteDict(
                 credentials_store, autocommit=True)
+        self._well_known = self._validator = self._tokens = None
         super().__init__(app, credentials_store, *a, **kw)
 
 
     def init_app(self, app):
         super().init_app(app)
         app.config.setdefault('OIDC_OAUTH2_PROVIDER', 'keycloak')
+        # verify token signatures locally using the auth server's JWKS
+        app.config.setdefault('OIDC_LOCAL_VALIDATION', False)
+        # if local validation fails, should we ask the introspection endpoint?
+        app.config.setdefault('OIDC_INTROSPECTION_FALLBACK', True)
+        app.config.setdefault('OIDC_VALIDATION_LEEWAY', 0)
+        # how many verified (and decoded) tokens to remember (shared across requests)
+        app.config.setdefault('OIDC_TOKEN_CACHE_SIZE', 1024)
+        # how long to remember rejected tokens (in seconds)
+        app.config.setdefault('OIDC_TOKEN_NEGATIVE_CACHE_TTL', 0)
+        # how long to remember introspection results (in seconds). This delays
+        # noticing revoked tokens by up to this much.
+        app.config.setdefault('OIDC_INTROSPECTION_CACHE_TTL', 0)
+        # a sqlite filename (to share between workers) or a cache object
+        app.config.setdefault('OIDC_INTROSPECTION_CACHE', None)
+        # the connection pool used to talk to the auth server. The pool size should be
+        # around the number of worker threads so that connections are reused.
+        app.config.setdefault('OIDC_HTTP_POOL_SIZE', 16)
+        # a timeout for all auth server requests, or a dict of per-endpoint timeouts (see WellKnown)
+        app.config.setdefault('OIDC_HTTP_TIMEOUT', None)
+        # retries (with jittered backoff) for introspection/userinfo/jwks requests
+        app.config.setdefault('OIDC_HTTP_MAX_RETRIES', 2)
+        # after this many consecutive failures, stop calling the auth server for a bit
+        app.config.setdefault('OIDC_CIRCUIT_BREAKER_THRESHOLD', 5)
+        app.config.setdefault('OIDC_CIRCUIT_BREAKER_RESET', 30)
+        # during an auth server outage, keep accepting tokens introspected within this many seconds
+        app.config.setdefault('OIDC_INTROSPECTION_STALE_IF_ERROR', 0)
+        # where to look for the token (in order). 'form' is only read for small urlencoded
+        # bodies, so an upload without a token is rejected before we read any of it.
+        app.config.setdefault('OIDC_TOKEN_SOURCES', TOKEN_SOURCES)
+        app.config.setdefault('OIDC_TOKEN_MAX_FORM_SIZE', 64 * 1024)
         app.errorhandler(RequestError)(exc2response)
 
+    @property
+    def well_known(self):
+        '''The well-known configuration for the auth server.'''
+        if self._well_known is None:
+            cfg = current_app.config
+            self._well_known = WellKnown(
+                util.asurl(self.client_secrets['issuer'], '.well-known/openid-configuration'),
+                client_id=self.client_secrets['client_id'],
+                client_secret=self.client_secrets.get('client_secret'),
+                sess=PooledSession(pool_maxsize=cfg['OIDC_HTTP_POOL_SIZE']),
+                retries=cfg['OIDC_HTTP_MAX_RETRIES'],
+                breaker=CircuitBreaker(
+                    cfg['OIDC_CIRCUIT_BREAKER_THRESHOLD'], cfg['OIDC_CIRCUIT_BREAKER_RESET']),
+                **_timeout_kw(cfg['OIDC_HTTP_TIMEOUT']))
+        return self._well_known
+
+    @property
+    def validator(self):
+        '''The token validator, configured using the app config.'''
+        if self._validator is None:
+            cfg = current_app.config
+            local = cfg['OIDC_LOCAL_VALIDATION']
+            self._validator = TokenValidator(
+                self.well_known, self.client_secrets['client_id'],
+                local=local,
+                introspect=not local or cfg['OIDC_INTROSPECTION_FALLBACK'],
+                check_aud=cfg['OIDC_RESOURCE_CHECK_AUD'],
+                leeway=cfg['OIDC_VALIDATION_LEEWAY'],
+                # introspect over our connection pool (flask_oidc uses a new connection each time)
+                introspect_func=self.well_known.tokeninfo,
+                # flask gives each async view a new event loop, so an httpx client couldn't be reused
+                async_introspect_func=functools.partial(_in_thread, self.well_known.tokeninfo),
+                cache_size=cfg['OIDC_TOKEN_CACHE_SIZE'],
+                negative_ttl=cfg['OIDC_TOKEN_NEGATIVE_CACHE_TTL'],
+                introspection_ttl=cfg['OIDC_INTROSPECTION_CACHE_TTL'],
+                introspection_cache=_as_cache(cfg['OIDC_INTROSPECTION_CACHE']),
+                stale_if_error=cfg['OIDC_INTROSPECTION_STALE_IF_ERROR'])
+        return self._validator
+
     def _validate_token(self, token, scopes_required=None):
         '''Make sure the token is considered valid by the auth server and that it has the
         required scopes/audience.'''
         # NOTE: refactored from flask_oidc to make the logic clearer and error messages more helpful
-        if not token:
-            return 'Missing token'
+        # the token is only validated once per request (e.g. for nested protections), then
+        # each protection just checks its own scopes
+        validity, token_info = request_cached(('validate', str(token)), self.validator.validate, token)
+        if validity is True:
+            validity = check_scopes(token_info, scopes_required)
+        # if everything is good, store the token info
+        if validity is True:
+            g.oidc_token_info = token_info
+        return validity
 
-        # try to introspect the token
-        try:
-            token_info = self._get_token_info(token)
-            if 'error' in token_info:
-                return 'Error received when querying token info: {}'.format(token_info)
-        except Exception as e:
-            return 'Error while trying to query token info: {}'.format(e)
-
-        # see if the token is considered active
-        valid_token = token_info.get('active', False)
-        if not valid_token:
-            return 'Token is not active.'
-
-        # validate the token audience
-        if 'aud' in token_info and current_app.config['OIDC_RESOURCE_CHECK_AUD']:
-            valid_audience = self.client_secrets['client_id'] in util.aslist(token_info['aud'])
-            if not valid_audience:
-                # log.error('Refused token because of invalid audience')
-                return 'Refused token because of invalid audience'
-
-        # check that it has the required scopes
-        scopes_required = set(util.aslist(scopes_required))
-        token_scopes = set(token_info.get('scope', '').split(' ')) if valid_token else set()
-        has_required_scopes = scopes_required.issubset(token_scopes)
-        if not has_required_scopes:
-            return 'Token does not have required scopes'
+    async def _validate_token_async(self, token, scopes_required=None):
+        '''The async version of ``_validate_token``.'''
+        validity, token_info = await request_cached_async(
+            ('validate', str(token)), self.validator.avalidate, token)
+        if validity is True:
+            validity = check_scopes(token_info, scopes_required)
+        if validity is True:
+            g.oidc_token_info = token_info
+        return validity
 
-        # if everything is good, store the token info
-        g.oidc_token_info = token_info
-        return True
+    async def validate_token_async(self, token, scopes_required=None):
+        '''The async version of ``validate_token``.'''
+        return await self._validate_token_async(token, scopes_required)
+
+    def validate_many(self, tokens, scopes_required=None, max_workers=None):
+        '''Validate a batch of tokens (e.g. tokens forwarded by a gateway).
+        See ``TokenValidator.validate_many``.
+
+        Returns:
+            results (list): ``(validity, token_info)`` for each token, in order.
+        '''
+        return self.validator.validate_many(tokens, scopes_required, max_workers=max_workers)
 
     def accept_token(self, scopes=None, role=None, realm_role=None, client_role=None,
-                     required=True, checks=None):
+                     required=True, checks=None, audience=None, policy=None):
+        '''Protect a view. The arguments are compiled into a ``oidcat.policy.Policy`` once,
+        when the view is decorated, and the view is added to ``oidcat.policy.registry``.
+
+        Arguments:
+            policy (Policy, None): use this policy instead of building one from the other arguments.
+        '''
+        policy = policy or Policy(
+            *util.aslist(role), realm_roles=realm_role, client_roles=client_role,
+            scopes=scopes, audience=audience, checks=checks)
         def wrapper(view_func):
-            @functools.wraps(view_func)
-            def decorated(*a, **kw):
-                self.valid_token(*util.aslist(role), scopes=scopes,
-                                 realm_role=realm_role, client_role=client_role,
-                                 required=required, checks=checks)
-                return view_func(*a, **kw)
-            return decorated
+            if inspect.iscoroutinefunction(view_func):
+                @functools.wraps(view_func)
+                async def decorated(*a, **kw):
+                    await self.valid_token_async(policy=policy, required=required)
+                    return await view_func(*a, **kw)
+            else:
+                @functools.wraps(view_func)
+                def decorated(*a, **kw):
+                    self.valid_token(policy=policy, required=required)
+                    return view_func(*a, **kw)
+            decorated.policy = policy
+            return registry.register(decorated, policy)
         return wrapper
 
+    def policy_report(self, app=None, unprotected=True):
+        '''Get a table of the app's routes and the policies protecting them (see ``oidcat.policy``).'''
+        return registry.report(app or current_app, unprotected=unprotected)
+
     # get token
 
     @property
     def token(self):
-        '''Get the current token object.
+        '''Get the current token object. It's looked for in ``OIDC_TOKEN_SOURCES``
+        (by default: the bearer header, the query, a small urlencoded form, and the session).
 
         Returns:
             token (Token): the token object. May be empty (token.token is None).
         '''
         token = getattr(flask.g, 'oidc_token_obj', None)
         if token is None:
-            token = (
-                self._get_bearer_token() or
-                request.form.get('access_token') or
-                request.args.get('access_token') or
-                self.get_access_token() or None)
-            if token:
-                token = Token(token)
+            cfg = current_app.config
+            for source in check_sources(cfg['OIDC_TOKEN_SOURCES'], TOKEN_SOURCES):
+                token = self._token_from(source, cfg)
+                if token:
+                    break
+            token = self._decode_token(token) if token else None
             flask.g.oidc_token_obj = token
         token = token if token is not None else Token()
         token._format = flask.current_app.config['OIDC_OAUTH2_PROVIDER']
         return token
 
+    def _decode_token(self, token):
+        '''Decode a token string. Decoded tokens are remembered until they expire (up to
+        ``OIDC_TOKEN_CACHE_SIZE`` of them), so a token that's reused across requests is only decoded once.'''
+        if self._tokens is None:
+            self._tokens = LRUCache(current_app.config['OIDC_TOKEN_CACHE_SIZE'])
+        key = token_key(token)
+        decoded = self._tokens.get(key)
+        if decoded is None:
+            decoded = Token(token)
+            self._tokens.set(key, decoded, expires=decoded.get('exp'))
+        return copy.copy(decoded)  # each request gets its own validity
+
     def valid_token(self, *roles, scopes=None, realm_role=None, client_role=None,
-                    client_id=True, required=True, checks=None, token=None):
+                    client_id=True, required=True, checks=None, token=None, policy=None):
         '''Check if a token is valid.
 
         Arguments:
@@ -206,6 +338,8 @@ class OpenIDConnect(flask_oidc.OpenIDConnect):
             checks (list[callable]): a list of additional checks to do on the token.
                 Receives the Token object as the only argument.
             token (Token, str, None): Gives you the option to pass your own external token.
+            policy (Policy, None): check the token against a precompiled ``oidcat.policy.Policy``
+                instead of ``roles``, ``scopes``, ``realm_role``, ``client_role`` and ``checks``.
 
         Returns:
             token (Token): The token object. If invalid, bool(token) will evaluate to False.
@@ -214,20 +348,44 @@ class OpenIDConnect(flask_oidc.OpenIDConnect):
             oidcat.UnauthorizedError if required is True and the token is invalid.
         '''
         # check if token is valid
+        token, validity = self._token_validity(token)
+        if validity is True:
+            validity = self.validate_token(token.token, policy.scopes if policy is not None else scopes)
+        return self._check_valid_token(
+            token, validity, roles, realm_role, client_role, client_id, required, checks, policy)
+
+    async def valid_token_async(self, *roles, scopes=None, realm_role=None, client_role=None,
+                                client_id=True, required=True, checks=None, token=None, policy=None):
+        '''The async version of ``valid_token``. Use this in async views so that
+        token introspection doesn't block.'''
+        token, validity = self._token_validity(token)
+        if validity is True:
+            validity = await self.validate_token_async(
+                token.token, policy.scopes if policy is not None else scopes)
+        return self._check_valid_token(
+            token, validity, roles, realm_role, client_role, client_id, required, checks, policy)
+
+    def _token_validity(self, token=None):
         token = self.token if token is None else Token.astoken(token)
         token._format = flask.current_app.config['OIDC_OAUTH2_PROVIDER']
         validity = token.validity
-
         if validity is True and not token.token:
             validity = 'No token'  # redundant
-        if validity is True:
-            validity = self.validate_token(token.token, scopes)
-        if validity is True:
+        return token, validity
+
+    def _check_valid_token(self, token, validity, roles=(), realm_role=None, client_role=None,
+                           client_id=True, required=True, checks=None, policy=None):
+        if validity is True and policy is not None:
+            # the scopes were already checked by the validator
+            validity = request_cached(
+                ('policy', token.token, policy), policy.evaluate,
+                token, self.client_secrets['client_id'], scopes=False)
+        elif validity is True:
             # make sure it has one of the required roles, and that all arbitrary checks pass.
             try:
                 validity = self.has_role(
                     *roles, realm=realm_role, client=client_role, client_id=client_id,
-                    required=True)
+                    required=True, token=token)
             except oidcat.Unauthorized as e:
                 validity = str(e)
             if validity is True and not all(chk(token) for chk in checks or ()):
@@ -242,16 +400,29 @@ class OpenIDConnect(flask_oidc.OpenIDConnect):
     def get_access_token(self):
         return super().get_access_token() if flask.g.oidc_id_token else None
 
+    def _token_from(self, source, cfg):
+        if source == 'header':
+            return self._get_bearer_token()
+        if source == 'query':
+            return request.args.get('access_token')
+        if source == 'form':
+            # don't make werkzeug parse (and buffer) uploads or streaming bodies
+            if readable_form(request.content_type, request.content_length, cfg['OIDC_TOKEN_MAX_FORM_SIZE']):
+                return request.form.get('access_token')
+            return None
+        return self.get_access_token()  # session
+
     def _get_bearer_token(self):
         auth = request.headers.get('Authorization') or ''
         return auth.split(None,1)[1].strip() if auth.startswith('Bearer ') else None
 
     # check token
 
-    def has_role(self, *roles, realm=None, client=None, client_id=True, **kw):
+    def has_role(self, *roles, realm=None, client=None, client_id=True, token=None, **kw):
         if client_id is True:
             client_id = self.client_secrets['client_id']
-        return self.token.has_role(*roles, realm=realm, client=client, client_id=client_id, **kw)
+        token = self.token if token is None else token
+        return token.has_role(*roles, realm=realm, client=client, client_id=client_id, **kw)
 
     def require_role(self, *roles, **kw):
         return self.require(self.has_role(*roles, **kw))
@@ -269,12 +440,38 @@ class OpenIDConnect(flask_oidc.OpenIDConnect):
         return _Protection.define(permission)
 
     def protect_roles(self, *roles):
-        return _Protection.define(_oneof_role_protection)(self, *roles)
+        policy = Policy(*roles, client_id=None)  # any client, like token.check_roles
+        def wrap_func(func):
+            permission = (
+                _policy_protection_async if inspect.iscoroutinefunction(func)
+                else _policy_protection)
+            view = _Protection.define(permission)(self, policy)(func)
+            return registry.register(view, policy)
+        return wrap_func
 
 
-def _oneof_role_protection(oidc, *roles):
-    token = oidc.valid_token()
-    return token, token.check_roles(*roles, required=True)
+def _policy_protection(oidc, policy):
+    token = oidc.valid_token(policy=policy)
+    return token, token.check_roles(*policy.roles)
+
+async def _policy_protection_async(oidc, policy):
+    token = await oidc.valid_token_async(policy=policy)
+    return token, token.check_roles(*policy.roles)
+
+async def _in_thread(func, *a):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *a)
+
+
+def _timeout_kw(timeout):
+    '''OIDC_HTTP_TIMEOUT can be a number (for every endpoint) or a dict of per-endpoint timeouts.'''
+    if timeout is None:
+        return {}
+    if isinstance(timeout, dict):
+        return {'timeouts': timeout}
+    return {'timeout': timeout, 'timeouts': dict.fromkeys(TIMEOUTS, timeout)}
+
+def _as_cache(cache):
+    return SqliteCache(cache, 'introspection') if isinstance(cache, str) else cache
 
 # https://github.com/googleapis/oauth2client/blob/0d1c814779c21503307b2f255dabcf24b2a107ac/oauth2client/clientsecrets.py#L119
 def _json_loads(content):
@@ -315,8 +512,14 @@ class _Protection:
         self.key = permissions_key
         self.a = a
         self.kw = kw
+        # bind the decorator arguments once rather than re-merging them on every request
+        self._check = functools.partial(permission, *a, **kw) if a or kw else permission
         functools.update_wrapper(self, permission)
 
+    def __repr__(self):
+        return '{}({})'.format(getattr(self.permission, '__name__', self.permission), ', '.join(
+            [repr(x) for x in self.a] + ['{}={!r}'.format(k, v) for k, v in self.kw.items()]))
+
     def __call__(self, *a, **kw):
         permissions = self.require_permissions(*a, **kw)
         if self.func is not None:
@@ -333,19 +536,57 @@ class _Protection:
             return False
 
     def require_permissions(self, *a, **kw):
-        return self.permission(*self.a, *a, **self.kw, **kw)
+        permissions = self._check(*a, **kw)
+        if inspect.isawaitable(permissions):
+            # never treat an un-awaited check as a pass
+            if inspect.iscoroutine(permissions):
+                permissions.close()
+            raise TypeError(
+                'The permission check {!r} is async. Use require_permissions_async '
+                '(or protect an async view).'.format(self.permission))
+        return permissions
+
+    # async views - the permission check can be either a function or a coroutine function
+
+    async def call_async(self, *a, **kw):
+        permissions = await self.require_permissions_async(*a, **kw)
+        if self.func is not None:
+            if permissions is not None and self.key:
+                kw[self.key] = permissions
+            return await self.func(*a, **kw)
+        return permissions
+
+    async def has_permissions_async(self, *a, **kw):
+        try:
+            await self.require_permissions_async(*a, **kw)
+            return True
+        except oidcat.Unauthorized:
+            return False
+
+    async def require_permissions_async(self, *a, **kw):
+        permissions = self._check(*a, **kw)
+        return await permissions if inspect.isawaitable(permissions) else permissions
 
     @classmethod
     def define(cls, permission):  # wraps the permissions check
         def wrap_args(*a, **kw):  # wraps arguments for the permissions check
             def wrap_func(func):  # wraps view func with permissions check
+                if inspect.iscoroutinefunction(permission) and not inspect.iscoroutinefunction(func):
+                    raise TypeError(
+                        'The permission check {!r} is async, so the view {!r} must be '
+                        'async too.'.format(permission, func))
                 protected = cls(permission, *a, _view_func=func, **kw)
 
-                @functools.wraps(func)
-                def view(*a, **kw):
-                    return protected(*a, **kw)
+                if inspect.iscoroutinefunction(func):
+                    @functools.wraps(func)
+                    async def view(*a, **kw):
+                        return await protected.call_async(*a, **kw)
+                else:
+                    @functools.wraps(func)
+                    def view(*a, **kw):
+                        return protected(*a, **kw)
                 view.protection = protected
-                return view
+                return registry.register(view, protected)
             return wrap_func
         return wrap_args
 
@@ -353,21 +594,42 @@ class _Protection:
 protection = _Protection.define
 
 
-# def _g_get_once(key, default=None):
-#     try:
-#         return getattr(g, key)
-#     except AttributeError:
-#         setattr(g, key, default() if callable(default) else default)
+def _g_get_once(key, default=None):
+    '''Get an attribute from ``flask.g``, setting it to ``default`` (or ``default()``) the first time.'''
+    try:
+        return getattr(g, key)
+    except AttributeError:
+        value = default() if callable(default) else default
+        setattr(g, key, value)
+        return value
 
-# def request_cached(func, *a, **kw):  # TODO: I want to cache OIDC.validate_token
-#     cache = _g_get_once('oidcat_cache', dict)
-#     key = '{}{}{}'.format(func.__name__, str(a), str(kw))
-#     try:
-#         return cache[key]
-#     except KeyError:
-#         val = cache[key] = func(*a, **kw)
-#         return val
+def request_cached(key, func, *a, **kw):
+    '''Call ``func(*a, **kw)`` once per request and remember the result (on ``flask.g``)
+    for anything else that asks for the same ``key`` during the request.
 
+    Arguments:
+        key (hashable): what identifies the result, e.g. ``('validate', token)``.
+        func (callable): computes the result.
+    '''
+    if not flask.has_app_context():
+        return func(*a, **kw)
+    cache = _g_get_once('oidcat_cache', dict)
+    try:
+        return cache[key]
+    except KeyError:
+        value = cache[key] = func(*a, **kw)
+        return value
+
+async def request_cached_async(key, func, *a, **kw):
+    '''The async version of ``request_cached`` - ``func`` is a coroutine function.'''
+    if not flask.has_app_context():
+        return await func(*a, **kw)
+    cache = _g_get_once('oidcat_cache', dict)
+    try:
+        return cache[key]
+    except KeyError:
+        value = cache[key] = await func(*a, **kw)
+        return value
 
 
 OIDC = OpenIDConnect
@@ -0,0 +1,91 @@
+'''Share tokens between processes.
+
+If you run a bunch of worker processes that each have their own ``Access``, they'll
+each login and refresh separately. With a shared token store, one process refreshes
+and the others just pick up the new token from the file - no network call.
+
+.. code-block:: python
+
+    sess = oidcat.Session(
+        'auth.myproject.com', 'myusername', 'mysecretpassword',
+        shared_store='/tmp/myapp-tokens.json')
+
+The file is replaced atomically (so readers never see half of it) and refreshes are
+coordinated using a lock file, so when the token expires, only one process goes
+to the auth server and the rest wait for it.
+
+'''
+import os
+import json
+import time
+import threading
+from . import util
+
+__all__ = ['TokenStore']
+
+
+class TokenStore:
+    def __init__(self, fname):
+        '''A JSON file holding the current access and refresh tokens.
+
+        Reading is cheap: the file is only re-read when its modification time or size changes.
+
+        Arguments:
+            fname (str): the file to store the tokens in. It's created with owner-only permissions.
+        '''
+        self.fname = os.path.expanduser(fname)
+        self._stat = None
+        self._tokens = None, None
+        self._lock = threading.Lock()
+        self.reads = self.writes = 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.fname)
+
+    def load(self):
+        '''Get the stored tokens.
+
+        Returns:
+            token (str, None): the access token.
+            refresh_token (str, None): the refresh token.
+        '''
+        try:
+            st = os.stat(self.fname)
+        except OSError:
+            return None, None
+        stat = st.st_mtime_ns, st.st_size, st.st_ino
+        with self._lock:
+            if stat != self._stat:
+                try:
+                    with open(self.fname, 'r') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):  # replaced while we were reading - try next time
+                    return self._tokens
+                self._tokens = data.get('token'), data.get('refresh_token')
+                self._stat = stat
+                self.reads += 1
+            return self._tokens
+
+    def save(self, token, refresh_token=None):
+        '''Store the tokens.'''
+        # not ``if token`` - that's False inside the token's buffer, but it can still be used
+        tokens = _token_str(token), _token_str(refresh_token)
+        util.atomic_write(self.fname, json.dumps({
+            'token': tokens[0], 'refresh_token': tokens[1], 'updated': time.time()}))
+        self.writes += 1
+
+    def clear(self):
+        '''Remove the stored tokens.'''
+        self.save(None, None)
+
+    def lock(self):
+        '''A lock that is shared between processes. Hold this while refreshing the token.'''
+        return util.file_lock(self.fname)
+
+    def stats(self):
+        '''Get the read/write counters.'''
+        return {'reads': self.reads, 'writes': self.writes}
+
+
+def _token_str(token):
+    return (str(token) or None) if token is not None else None
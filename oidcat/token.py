@@ -24,13 +24,21 @@ Token objects encapsulate the different forms of a token: a string, a data paylo
     else:
         print('R.I.P. this token is dead')
 '''
+import re
+import sys
 import json
+import time
 import base64
+import fnmatch
 import datetime
+import functools
 from . import util
 from .exceptions import *
 
-__all__ = ['Token']
+__all__ = ['Token', 'RoleMatcher']
+
+_EMPTY = frozenset()
+_ROLE_KEYS = ('realm_access', 'resource_access')
 
 class _MODES:
     KEYCLOAK = ('keycloak', 'kc', None)
@@ -71,20 +79,14 @@ class Token(dict):
             complete a slower request.
         valid (bool): A flag that can be used to override token validity. (Can be set after checking the auth server blacklist for example).
         format (str): The token role format. Currently only supports 'keycloak'.
+        lazy (bool): If True, the token isn't decoded until you access its data (e.g. ``token['exp']``,
+            ``bool(token)``, ``token.header``). This is useful when you only need to pass the token
+            string along (e.g. ``str(token)``). Note that ``json.dumps(token)`` doesn't trigger decoding.
     '''
     _FOREVER_ = datetime.timedelta(seconds=3600*24*5000)
-    def __init__(self, token='', buffer=None, valid=True, format='keycloak'):
+    def __init__(self, token='', buffer=None, valid=True, format='keycloak', lazy=False):
         self.token = token or None
-        self.header, self.data, self.signature = jwt_decode(token) if token else ({}, {}, '')
-        super().__init__(self.data)
-
-        expires = self.get('exp')
-        self.expires = datetime.datetime.fromtimestamp(expires) if expires else None
-        if buffer is None and self.expires:
-            buffer = min(max((self.expires - datetime.datetime.now()).total_seconds() * 0.05, 0), 30)
-        self.buffer = (
-            buffer if isinstance(buffer, datetime.timedelta) else
-            datetime.timedelta(seconds=buffer or 0))
+        self._buffer = buffer
         self._valid = valid
 
         # check token format
@@ -92,46 +94,133 @@ class Token(dict):
             _MODES.unknown(format)
         self._format = format
 
+        self._decoded = False
+        if not lazy:
+            self._decode()
+
+    def _decode(self):
+        '''Decode the token string and compute the expiration. This only happens once.'''
+        if self._decoded:
+            return
+        header, data, signature = jwt_decode(self.token) if self.token else ({}, {}, '')
+        self.header, self.data, self.signature = header, data, signature
+        dict.update(self, data)
+        self._index_roles()
+
+        # expiration is kept as a float timestamp so that checking is cheap
+        exp = data.get('exp')
+        self._exp = float(exp) if exp else None
+        buffer = self._buffer
+        if buffer is None and self._exp:
+            buffer = min(max((self._exp - time.time()) * 0.05, 0), 30)
+        self._set_buffer(buffer)
+        self._decoded = True
+
+    def _index_roles(self):
+        '''Build the role index: the realm roles, the roles for each client, and their unions.
+        The sets are frozen and the role names are interned, so role checks are just set lookups.'''
+        realm, clients = _EMPTY, {}
+        if self._format in _MODES.KEYCLOAK:
+            realm = _role_set((dict.get(self, 'realm_access') or {}).get('roles'))
+            clients = {
+                c: _role_set((rsc or {}).get('roles'))
+                for c, rsc in (dict.get(self, 'resource_access') or {}).items()}
+        self._realm_roles = realm
+        self._clients_roles = clients
+        self._all_client_roles = _EMPTY.union(*clients.values())
+        self._all_roles = realm | self._all_client_roles
+
+    def _set_buffer(self, buffer):
+        self._buffer = (
+            buffer.total_seconds() if isinstance(buffer, datetime.timedelta) else
+            float(buffer or 0))
+        # the time after which bool(token) is False
+        self._deadline = self._exp - self._buffer if self._exp else None
+
     def __repr__(self):
         '''Show the token information, including expiration and data payload.'''
         if self.token is None:
             return 'Token(None)'
         return 'Token(time_left={}, {})'.format(self.time_left, super().__repr__())
 
+    def __copy__(self):
+        '''A shallow copy that doesn't decode the token again (the payload and role index are shared).
+        Use it to hand out a previously decoded token without sharing its ``valid`` flag.'''
+        token = self.__class__.__new__(self.__class__)
+        token.__dict__.update(self.__dict__)
+        dict.update(token, self)
+        return token
+
     def __str__(self):
         '''Get the token as a string (can be passed in an Authorization header)'''
         return str(self.token or '')
 
     def __getitem__(self, key):
         '''Retrieve an item from the token payload.'''
+        self._decode()
         try:
             return super().__getitem__(key)
         except KeyError as e:
-            raise KeyError('{} not found in: {}'.format(str(e), set(self)))
+            raise KeyError('{} not found in: {}'.format(str(e), set(dict.keys(self))))
 
     def __getattr__(self, key):
         '''Retrieve an item from the token payload.'''
+        decoded = self.__dict__.get('_decoded')
+        if decoded is None or key.startswith('__'):
+            # not initialized yet (e.g. while unpickling/copying) or a python protocol lookup
+            raise AttributeError(key)
+        # lazy tokens: decode and see if that set the attribute (e.g. header, expires)
+        if decoded is False:
+            self._decode()
+            if key in self.__dict__:
+                return self.__dict__[key]
         try:
             return super().__getitem__(key)
         except KeyError as e:
-            raise AttributeError('{} not found in: {}'.format(str(e), set(self)))
+            raise AttributeError('{} not found in: {}'.format(str(e), set(dict.keys(self))))
 
     def __bool__(self):
-        '''Check if the token exists and is not expired.'''
-        return bool(self.token) and (not self.expires or self.time_left > self.buffer)
+        '''Check if the token exists and is not expired (or about to expire, see ``buffer``).'''
+        if not self.token:
+            return False
+        deadline = self._deadline
+        return deadline is None or time.time() < deadline
+
+    @property
+    def expires(self):
+        '''When the token expires, as a ``datetime``.'''
+        return datetime.datetime.fromtimestamp(self._exp) if self._exp else None
+
+    @property
+    def buffer(self):
+        '''How long before the token expires that we stop considering it usable, as a ``timedelta``.'''
+        self._decode()
+        return datetime.timedelta(seconds=self._buffer)
+
+    @buffer.setter
+    def buffer(self, buffer):
+        self._decode()
+        self._set_buffer(buffer)
+
+    @property
+    def seconds_left(self):
+        '''Get how many seconds are left in the token (as a float).'''
+        return (
+            self._exp - time.time() if self._exp else
+            float('inf') if self.token else 0.)
 
     @property
     def time_left(self):
         '''Get how much time left is in the token.'''
         return (
-            self.expires - datetime.datetime.now() if self.expires else 
-            self._FOREVER_ if self.token else 
+            datetime.timedelta(seconds=self._exp - time.time()) if self._exp else
+            self._FOREVER_ if self.token else
             datetime.timedelta(seconds=0))
 
     @property
     def valid(self):
         '''Determines if the token is valid and is not expired.'''
-        return self.token and self._valid is True and (not self.expires or self.time_left.total_seconds() > 0)
+        return self.token and self._valid is True and (not self._exp or self._exp > time.time())
 
     @valid.setter
     def valid(self, value):
@@ -143,7 +232,7 @@ class Token(dict):
         return (
             'No token' if not self.token else
             'Token invalid' if not self._valid else
-            'Token expired' if (self.expires and self.time_left.total_seconds() <= 0)
+            'Token expired' if (self._exp and self._exp <= time.time())
             else True)
 
     @property
@@ -151,17 +240,18 @@ class Token(dict):
         '''An alias for the username of the token owner.'''
         return self.preferred_username
 
+    # NOTE: the role index attributes (self._realm_roles, etc.) are set when the token is
+    #       decoded, so for lazy tokens, accessing them goes through __getattr__ which decodes it.
+
     @property
     def roles(self):
-        '''Get all realm and client roles.'''
-        return self.realm_roles | self.client_roles()
+        '''Get all realm and client roles (as a ``frozenset``).'''
+        return self._all_roles
 
     @property
     def realm_roles(self):
-        '''Get all realm roles in the token.'''
-        if self._format in _MODES.KEYCLOAK:
-            return set((self.get('realm_access') or {}).get('roles') or ())
-        return set()
+        '''Get all realm roles in the token (as a ``frozenset``).'''
+        return self._realm_roles
 
     def client_roles(self, client_id=None, *additional, allow_missing=True):
         '''Get all client roles in the token.
@@ -170,23 +260,23 @@ class Token(dict):
             client_id (list, str): The client ID(s) to include. If not specified, it will get the roles from all clients in the token.
 
         Returns:
-            roles (list): The list of matching client roles.
+            roles (frozenset): The matching client roles.
         '''
-        if self._format in _MODES.KEYCLOAK:
-            rsc = self.get('resource_access') or {}
-            all_clients = list(rsc)
+        clients = self._clients_roles
+        if not additional:  # the common cases don't need to build anything
             if client_id is None or client_id is True:
-                client_id = all_clients
-            client_id = util.aslist(client_id) + list(additional)
-
-            missing_clients = set(client_id) - set(all_clients)
-            if missing_clients:
-                if not allow_missing:
-                    raise ValueError('clients {} not in available clients {}.'.format(missing_clients, all_clients))
-            return set(
-                r for c in client_id
-                for r in (rsc.get(c) or {}).get('roles') or ())
-        return set()
+                return self._all_client_roles
+            if isinstance(client_id, str) and (allow_missing or client_id in clients):
+                return clients.get(client_id, _EMPTY)
+        if client_id is None or client_id is True:
+            client_id = list(clients)
+        client_id = util.aslist(client_id) + list(additional)
+
+        missing_clients = set(client_id) - set(clients)
+        if missing_clients:
+            if not allow_missing:
+                raise ValueError('clients {} not in available clients {}.'.format(missing_clients, list(clients)))
+        return _EMPTY.union(*(clients.get(c, _EMPTY) for c in client_id))
 
     @classmethod
     def astoken(cls, token, *a, **kw):
@@ -205,6 +295,8 @@ class Token(dict):
     def has_role(self, *roles, realm=None, client=None, client_id=True, **kw):
         '''Check if the token has certain roles.
 
+        Roles can be glob patterns, e.g. ``token.has_role('data-read-*')``.
+
         Arguments:
             *roles (str): the roles to look for.
             realm (str, list, None): the realm roles to look for.
@@ -217,23 +309,137 @@ class Token(dict):
         Returns:
             has_roles (bool): Whether or not the user has any of the roles.
         '''
-        realm_roles = self.realm_roles if realm is not False else set()
-        client_roles = self.client_roles(client_id) if client_id else set()
-        return all(
-            (not req or any(compare_roles(req, avail, asdict=False, **kw)))
-            for req, avail in zip((roles, realm, client), (realm_roles | client_roles, realm_roles, client_roles)))
+        if not kw and realm is None and client is None and client_id is True:
+            # the common case: any of these roles, anywhere in the token
+            return not roles or compile_roles(roles).any(self._all_roles)
+        realm_roles = self._realm_roles if realm is not False else _EMPTY
+        client_roles = self.client_roles(client_id) if client_id else _EMPTY
+        if kw:
+            return all(
+                (not req or any(compare_roles(req, avail, asdict=False, **kw)))
+                for req, avail in zip((roles, realm, client), (
+                    self._union_roles(realm_roles, client_roles), realm_roles, client_roles)))
+        return (
+            _has_any(realm, realm_roles) and _has_any(client, client_roles) and
+            (not roles or _has_any(roles, self._union_roles(realm_roles, client_roles))))
 
     def check_roles(self, *roles, realm_only=None, client_only=None, client_id=True,
                     asdict=False, required=False):
-        realm_roles = self.realm_roles if not client_only else set()
-        client_roles = self.client_roles(client_id) if not realm_only else set()
-        target_roles = realm_roles if realm_only else client_roles if client_only else (realm_roles | client_roles)
+        realm_roles = self._realm_roles if not client_only else _EMPTY
+        client_roles = self.client_roles(client_id) if not realm_only else _EMPTY
+        target_roles = (
+            realm_roles if realm_only else client_roles if client_only else
+            self._union_roles(realm_roles, client_roles))
         return compare_roles(roles, target_roles, asdict=asdict, required=required)
 
+    def _union_roles(self, realm_roles, client_roles):
+        # use the precomputed union when we're looking at everything
+        if realm_roles is self._realm_roles and client_roles is self._all_client_roles:
+            return self._all_roles
+        return realm_roles | client_roles if realm_roles and client_roles else realm_roles or client_roles
+
+
+def _decoding(name, reindex=False):
+    '''Wrap a dict method so that lazy tokens are decoded before it's called.
+    If ``reindex``, the method can change the token data so the role index is rebuilt after.'''
+    method = getattr(dict, name)
+    @functools.wraps(method)
+    def inner(self, *a, **kw):
+        # tokens that are still being built (e.g. by pickle) have nothing to decode or index yet
+        decoded = self.__dict__.get('_decoded')
+        if decoded is False:
+            self._decode()
+        result = method(self, *a, **kw)
+        if reindex and decoded is not None:
+            self._index_roles()
+        return result
+    return inner
+
+for _name in ('__contains__', '__iter__', '__len__', '__eq__', '__ne__', 'get', 'keys',
+              'items', 'values', 'copy'):
+    setattr(Token, _name, _decoding(_name))
+for _name in ('__setitem__', '__delitem__', 'setdefault', 'pop', 'popitem', 'update'):
+    setattr(Token, _name, _decoding(_name, reindex=True))
+
+
+def _role_set(roles):
+    '''Freeze a list of roles, interning the names so that lookups with literal role names are quick.'''
+    return frozenset(sys.intern(r) if type(r) is str else r for r in roles or ())
+
+
+def _has_any(targets, existing):
+    '''Check if ``existing`` has any of ``targets`` (a role or a list of roles). No targets => True.'''
+    if not targets:
+        return True
+    if isinstance(targets, str):
+        if targets in existing:
+            return True
+        if not is_role_pattern(targets):
+            return False
+        targets = (targets,)
+    elif not isinstance(targets, tuple):
+        targets = tuple(targets)
+    return compile_roles(targets).any(existing)
+
+
+def is_role_pattern(role):
+    '''Check if a role is a glob pattern (e.g. ``'data-read-*'``).'''
+    return isinstance(role, str) and ('*' in role or '?' in role or '[' in role)
+
+
+class RoleMatcher:
+    def __init__(self, targets):
+        '''A list of roles and role patterns (e.g. ``'data-read-*'``, see ``fnmatch``) compiled for matching.
+
+        The patterns are combined into a single regex, and which of a token's roles match is
+        remembered (per role set), so checking the same token again is just a lookup.
+
+        Arguments:
+            targets (list): the roles/patterns.
+        '''
+        self.targets = tuple(targets)
+        self.exact = frozenset(r for r in self.targets if not is_role_pattern(r))
+        self.patterns = tuple(r for r in self.targets if is_role_pattern(r))
+        self._regexes = {p: re.compile(fnmatch.translate(p)) for p in self.patterns}
+        self._regex = self.patterns and re.compile('|'.join(
+            '(?:{})'.format(fnmatch.translate(p)) for p in self.patterns))
+        # the token's role sets are frozen, so we can cache what matched
+        self._matching = functools.lru_cache(maxsize=256)(self._find_matching)
+        self.any = functools.lru_cache(maxsize=256)(self._find_any)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, list(self.targets))
+
+    def _find_matching(self, existing):
+        return frozenset(r for r in existing if self._regex.match(r))
+
+    def matching(self, existing):
+        '''Get the roles in ``existing`` that match any of the patterns.'''
+        return self._matching(existing) if self._regex else _EMPTY
+
+    def _find_any(self, existing):
+        '''Check if any of the roles in ``existing`` (a frozenset) match. This is cached per
+        role set as ``self.any(existing)``.'''
+        # exact roles are a set lookup, only fall back to the regex if none of them are there
+        return not self.exact.isdisjoint(existing) or bool(self.matching(existing))
+
+    def has(self, target, existing):
+        '''Check if a single target role/pattern matches any of the roles in ``existing``.'''
+        regex = self._regexes.get(target)
+        if regex is None:
+            return target in existing
+        return any(regex.match(r) for r in self.matching(existing))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_roles(targets):
+    '''Get a (cached) ``RoleMatcher`` for a tuple of roles/patterns.'''
+    return RoleMatcher(targets)
 
 
 def compare_roles(targets, existing, required=False, asdict=False):
-    '''Compare target roles with a set of existing roles.
+    '''Compare target roles with a set of existing roles. Targets can be glob patterns
+    (e.g. ``'data-read-*'``), which match if any existing role matches.
 
     Arguments:
         *roles (str): the roles to look for.
@@ -247,8 +453,16 @@ def compare_roles(targets, existing, required=False, asdict=False):
     Returns:
         has_roles (bool): Whether or not the user has any of the roles.
     '''
-    targets, existing = util.aslist(targets), util.as_set(existing)
-    has_roles = {r: r in existing for r in targets}
+    targets = util.aslist(targets)
+    if not isinstance(existing, frozenset):
+        existing = frozenset(util.as_set(existing))
+    matcher = compile_roles(tuple(targets))
+    if not matcher.patterns:
+        if not required and not asdict:
+            return [r in existing for r in targets]
+        has_roles = {r: r in existing for r in targets}
+    else:
+        has_roles = {r: matcher.has(r, existing) for r in targets}
 
     if required:  # make sure we have at least one
         required = any if required is True else required
@@ -2,10 +2,7 @@ import os
 import json
 import functools
 import contextlib
-import traceback
-import warnings
-import requests
-import urllib
+import urllib.parse
 from . import RequestError
 from .exceptions import safe_format
 
@@ -163,8 +160,7 @@ def well_known_url(url, realm=None, secure=None):
 #     return [asurl(u, **kw) for u in uris]
 
 
-@functools.lru_cache()
-def get_well_known(url, realm=None, secure=None):
+def get_well_known(url, realm=None, secure=None, sess=None, discovery=None):
     '''Get the well known for an oauth2 server.
 
     These are equivalent:
@@ -211,9 +207,17 @@ def get_well_known(url, realm=None, secure=None):
             "tls_client_certificate_bound_access_tokens": true,
         }
 
+    The request uses the shared pooled session (see ``oidcat.pool``) unless you pass ``sess``.
+    The result is cached (in memory, or on disk with ``discovery=True`` or ``$OIDCAT_CACHE_DIR``)
+    and revalidated once it expires. See ``oidcat.discovery``. Pass ``discovery=False`` to skip the cache.
     '''
+    from .pool import shared_session
+    from .discovery import get_cache
     url = well_known_url(url, realm, secure=secure)
-    resp = requests.get(url).json()
+    def fetch(headers=None):
+        return (sess or shared_session()).get(url, headers=headers or {}, timeout=10)
+    cache = get_cache(discovery)
+    resp = fetch().json() if cache is None else cache.get(url, fetch)
     if 'error' in resp:
         raise RequestError('Error getting .well-known: {}'.format(resp['error']))
     return resp
@@ -408,6 +412,13 @@ class Role(list):
         r.audio + r.any.spl + (r+w).meta + d('audio', 'spl')
         # ['read-audio', 'read-any-spl', 'read-any-meta', 'write-any-meta',
         #  'delete-audio', 'delete-spl']
+
+    Roles can also be glob patterns, which ``Token.has_role`` and ``Token.check_roles`` understand:
+
+    .. code-block:: python
+
+        r('*')  # ['read-*']
+        (r + w)('data-*').matches('read-data-audio')  # True
     '''
     def __init__(self, *xs):
         super().__init__(
@@ -427,6 +438,11 @@ class Role(list):
         # return Role(x).join(self)  # << idk wtf that was supposed to be
         return Role(x) + self
 
+    def matches(self, *roles):
+        '''Check if any of ``roles`` match any of these roles/patterns.'''
+        from .token import compile_roles
+        return compile_roles(tuple(self)).any(frozenset(roles))
+
 
 class Colors(dict):
     '''Color text. e.g.
@@ -506,7 +522,7 @@ def ask(question, color=None, secret=False):
 
 
 @contextlib.contextmanager
-def saveddict(fname):
+def saveddict(fname, lock=False, plain=False):
     '''A context manager that lets you store data in a JSON file. This is useful for storing configuration values 
     between runs (great for configuring CLIs).
     If ``fname`` is None, then nothing is saved to file.
@@ -528,20 +544,111 @@ def saveddict(fname):
             if store_password:  # not very secure !!
                 cfg['password'] = password
 
+    The file is only written if the data changed, and it's written atomically
+    (see ``atomic_write``) so a crash can't leave a half-written file behind.
+
+    Arguments:
+        fname (str, None): the file to store the data in.
+        lock (bool): hold a lock (see ``file_lock``) for the duration of the ``with`` block so
+            that concurrent processes don't overwrite each other's changes.
+        plain (bool): write plain JSON instead of base64 encoded JSON. Either format can be read.
     '''
+    fname = fname and os.path.expanduser(fname)
+    with (file_lock(fname) if fname and lock else contextlib.nullcontext()):
+        data = _read_saveddict(fname) if fname else {}
+        before = _dumps_saveddict(data)
+        try:
+            yield data
+        finally:
+            if fname:
+                after = _dumps_saveddict(data)
+                if after != before:
+                    _write_saveddict(fname, after, plain)
+
+
+def _dumps_saveddict(data):
+    return json.dumps(data, sort_keys=True)
+
+
+def _read_saveddict(fname):
+    import base64
+    try:
+        with open(fname, 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return {}
+    try:
+        if not raw.lstrip().startswith(b'{'):  # the original base64 format
+            raw = base64.b64decode(raw)
+        return json.loads(raw.decode('utf-8'))
+    except ValueError:
+        return {}
+
+
+def _write_saveddict(fname, text, plain=False):
     import base64
+    data = text.encode('utf-8')
+    atomic_write(fname, data if plain else base64.b64encode(data))
+
+def atomic_write(fname, data, mode=0o600):
+    '''Write a file so that readers see either the old contents or the new
+    contents, but never a partially written file. It writes to a temporary file
+    in the same directory and then renames it over the old one.
+
+    Arguments:
+        fname (str): the file to write.
+        data (bytes, str): the contents.
+        mode (int): the file permissions. By default, only the owner can read it
+            (these files usually have tokens in them).
+    '''
+    import tempfile
+    fname = os.path.expanduser(fname)
+    dirname = os.path.dirname(fname) or '.'
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.{}.'.format(os.path.basename(fname)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, fname)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(fname, shared=False):
+    '''An advisory lock that's shared between processes (and threads). This uses a
+    separate ``{fname}.lock`` file so that it still works if ``fname`` gets replaced
+    using ``atomic_write``.
+
+    Locking uses ``fcntl.flock`` so on platforms without ``fcntl`` (Windows) this doesn't lock.
+
+    .. code-block:: python
+
+        with oidcat.util.file_lock('~/.myapp/tokens.json'):
+            ...  # only one process at a time in here
+
+    Arguments:
+        fname (str): the file to lock.
+        shared (bool): take a shared (read) lock instead of an exclusive one.
+    '''
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover
+        yield
+        return
+    lockname = os.path.expanduser(fname) + '.lock'
+    os.makedirs(os.path.dirname(lockname) or '.', exist_ok=True)
+    fd = os.open(lockname, os.O_RDWR | os.O_CREAT, 0o600)
     try:
-        data = {}
-        fname = fname and os.path.expanduser(fname)
-        if fname and os.path.isfile(fname):
-            try:
-                with open(fname, 'rb') as f:
-                    data = json.loads(base64.b64decode(f.read()).decode('utf-8'))
-            except json.decoder.JSONDecodeError:
-                pass
-        yield data
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
     finally:
-        if fname:
-            os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
-            with open(fname, 'wb') as f:
-                f.write(base64.b64encode(json.dumps(data).encode('utf-8')))
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
@@ -0,0 +1,379 @@
+'''Server-side token validation that isn't tied to a specific web framework.
+
+.. code-block:: python
+
+    wk = oidcat.WellKnown('auth.myproject.com', 'my-client', 'my-secret')
+    validator = oidcat.validation.TokenValidator(wk, 'my-client', local=True)
+
+    validity, token_info = validator.validate(token_str, scopes_required=['profile'])
+    if validity is not True:
+        raise oidcat.Unauthorized(validity)
+
+In async code (e.g. ASGI apps or async Flask views), use ``await validator.avalidate(...)``
+which queries the introspection endpoint using ``httpx`` instead of blocking a thread.
+
+'''
+import time
+import asyncio
+from . import util, Unauthorized
+from .cache import LRUCache, LatencyStats, SingleFlight, AsyncSingleFlight, token_key
+from .well_known import _unverified_kid
+
+
+class TokenValidator:
+    def __init__(self, well_known, client_id=None, local=False, introspect=True,
+                 check_aud=True, leeway=0, introspect_func=None,
+                 cache_size=1024, negative_ttl=0,
+                 introspection_ttl=0, introspection_cache=None,
+                 async_introspect_func=None, async_sess=None, stale_if_error=0):
+        '''Checks that a token is valid and has the required scopes/audience.
+
+        Arguments:
+            well_known (WellKnown): the well-known configuration of the auth server.
+            client_id (str): the client ID that tokens should be issued for. Used
+                for the audience check. By default, it uses ``well_known.client_id``.
+            local (bool): whether we should verify the token signature locally using
+                the auth server's JWKS instead of querying the introspection endpoint.
+            introspect (bool): whether we should use the introspection endpoint. If
+                ``local=True``, introspection is only used as a fallback when the token
+                can't be verified locally.
+            check_aud (bool): whether to check that ``client_id`` is in the token audience.
+            leeway (float): the number of seconds of clock skew to allow when verifying locally.
+            introspect_func (callable, None): a function that receives the token string and
+                returns the introspected token info. By default, it uses ``well_known.tokeninfo``.
+            cache_size (int): the maximum number of locally verified tokens to remember. Tokens are
+                remembered until they expire so that we don't have to re-verify the signature of
+                a token that we've already seen. Set to 0 to disable.
+            negative_ttl (float): the number of seconds to remember rejected tokens for.
+                Set to 0 to disable.
+            introspection_ttl (float): the maximum number of seconds to remember an introspection
+                result for. Entries never outlive the token's ``exp``. This is a trade-off between how
+                quickly we notice revoked tokens and how much load we put on the auth server.
+                Set to 0 to disable.
+            introspection_cache (LRUCache, SqliteCache, None): where to store introspection
+                results. By default, it uses an in-memory ``LRUCache`` with ``cache_size``.
+                Use a ``SqliteCache`` to share the cache between processes.
+            async_introspect_func (callable, None): the coroutine function version of ``introspect_func``,
+                used by ``avalidate``. By default, it queries the introspection endpoint using ``httpx``.
+            async_sess (httpx.AsyncClient, None): the client used by the default ``async_introspect_func``.
+                By default, a client is created the first time it's needed on each event loop and kept
+                so that connections are reused. Close it using ``await validator.aclose()``.
+            stale_if_error (float): if the introspection endpoint fails (e.g. the auth server is down
+                or its circuit breaker is open), we can keep accepting tokens that were introspected
+                successfully within this many seconds (but never past their ``exp``). This trades
+                noticing revoked tokens for staying up during an auth server outage. Set to 0 to disable.
+        '''
+        self.well_known = well_known
+        self.client_id = client_id or well_known.client_id
+        self.local = local
+        self.introspect = introspect
+        self.check_aud = check_aud
+        self.leeway = leeway
+        self.introspect_func = introspect_func or well_known.tokeninfo
+        self.cache = LRUCache(cache_size)
+        self.rejected = LRUCache(cache_size, ttl=negative_ttl or 0)
+        self.introspection_ttl = introspection_ttl or 0
+        self.introspection_cache = (
+            LRUCache(cache_size) if introspection_cache is None else introspection_cache)
+        self.introspection_latency = LatencyStats()
+        # concurrent introspections of the same token share a single request
+        self.introspection_flight = SingleFlight()
+        self.async_introspection_flight = AsyncSingleFlight()
+        self.async_introspect_func = async_introspect_func or self._async_tokeninfo
+        self.async_sess = async_sess
+        self._async_clients = {}  # {event loop: httpx.AsyncClient}
+        self.stale_if_error = stale_if_error or 0
+        self.stale = LRUCache(cache_size if self.stale_if_error else 0)
+
+    def __repr__(self):
+        return '{}(client_id={!r}, local={}, introspect={})'.format(
+            self.__class__.__name__, self.client_id, self.local, self.introspect)
+
+    def token_info(self, token):
+        '''Get the token info, either by verifying the token locally or by
+        querying the introspection endpoint.
+
+        Arguments:
+            token (str, Token): the token.
+
+        Returns:
+            token_info (dict): the token info. Verified tokens are marked as ``active``.
+        '''
+        token = str(token)
+        key = token_key(token)
+        info = self.cache.get(key)
+        if info is not None:
+            return info
+        if self.local:
+            try:
+                return self._local_token_info(token, key)
+            except Exception:
+                if not self.introspect:
+                    raise
+        return self._introspect_token_info(token, key)
+
+    async def atoken_info(self, token):
+        '''The async version of ``token_info``.'''
+        token = str(token)
+        key = token_key(token)
+        info = self.cache.get(key)
+        if info is not None:
+            return info
+        if self.local:
+            try:
+                keys = self.well_known.key_store
+                if keys.age() > keys.ttl or _unverified_kid(token) not in keys:
+                    # we may need to fetch the keys (e.g. after a key rotation) - don't block the event loop
+                    return await asyncio.get_running_loop().run_in_executor(
+                        None, self._local_token_info, token, key)
+                return self._local_token_info(token, key)
+            except Exception:
+                if not self.introspect:
+                    raise
+        if self.introspection_ttl:
+            info = self.introspection_cache.get(key)
+            if info is not None:
+                return info
+        try:
+            return await self.async_introspection_flight.do(key, self._aintrospect, token, key)
+        except Exception:
+            return self._stale_token_info(key)
+
+    def _local_token_info(self, token, key):
+        data = self.well_known.verify_token(token, leeway=self.leeway)
+        info = dict(data, active=True)
+        self.cache.set(key, info, expires=data.get('exp'))
+        return info
+
+    def _introspect_token_info(self, token, key):
+        if self.introspection_ttl:
+            info = self.introspection_cache.get(key)
+            if info is not None:
+                return info
+        try:
+            return self.introspection_flight.do(key, self._introspect, token, key)
+        except Exception:
+            return self._stale_token_info(key)
+
+    def _stale_token_info(self, key):
+        '''The introspection failed - see if we have an older result we can use.
+        This must be called from an ``except`` block.'''
+        info = self.stale.get(key) if self.stale_if_error else None
+        if info is None:
+            raise
+        return info
+
+    def _introspect(self, token, key):
+        start = time.perf_counter()
+        info = self.introspect_func(token)
+        self.introspection_latency.add(time.perf_counter() - start)
+        self._cache_introspection(key, info)
+        return info
+
+    async def _aintrospect(self, token, key):
+        start = time.perf_counter()
+        info = await self.async_introspect_func(token)
+        self.introspection_latency.add(time.perf_counter() - start)
+        self._cache_introspection(key, info)
+        return info
+
+    def _cache_introspection(self, key, info):
+        if not info.get('active') or 'error' in info:
+            return
+        if self.introspection_ttl:
+            self.introspection_cache.set(key, info, ttl=self.introspection_ttl, expires=info.get('exp'))
+        if self.stale_if_error:
+            self.stale.set(key, info, ttl=self.stale_if_error, expires=info.get('exp'))
+
+    async def _async_tokeninfo(self, token):
+        from .aio import AsyncWellKnown
+        wk = self.well_known
+        # share the timeouts, retries, and circuit breaker with the sync client
+        kw = dict(
+            timeout=wk.timeout, timeouts=wk.timeouts, retries=wk.retries, breaker=wk.breaker,
+            retry_backoff=wk.retry_backoff, retry_backoff_max=wk.retry_backoff_max)
+        return await AsyncWellKnown(
+            dict(wk), wk.client_id, wk.client_secret, sess=self._async_client(), **kw).tokeninfo(token)
+
+    def _async_client(self):
+        '''Get the httpx client for the running event loop (creating it the first time).'''
+        if self.async_sess is not None:
+            return self.async_sess
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            # forget the clients of loops that are gone (their connections went with them)
+            for old in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[old]
+            client = self._async_clients[loop] = httpx.AsyncClient()
+        return client
+
+    async def aclose(self):
+        '''Close the introspection client that we created for the running event loop (if any).
+        ``async_sess`` is left alone - it belongs to you.'''
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self):
+        '''Get the cache hit/miss counters and the introspection latency.
+
+        .. code-block:: python
+
+            {
+                'cache': {'hits': 120, 'misses': 3, 'hit_ratio': 0.97, ...},
+                'rejected': {...},
+                'introspection_cache': {...},
+                'introspection_latency': {'count': 3, 'mean': 0.021, 'max': 0.03, 'last': 0.015},
+                'introspection_flight': {'calls': 3, 'shared': 12, 'in_flight': 0},
+            }
+        '''
+        return {
+            'cache': self.cache.stats(),
+            'rejected': self.rejected.stats(),
+            'introspection_cache': self.introspection_cache.stats(),
+            'introspection_latency': self.introspection_latency.stats(),
+            'introspection_flight': self.introspection_flight.stats(),
+            'async_introspection_flight': self.async_introspection_flight.stats(),
+            'stale': self.stale.stats(),
+            'breaker': self.well_known.breaker.stats(),
+        }
+
+    def validate(self, token, scopes_required=None):
+        '''Make sure the token is considered valid by the auth server and that it has the
+        required scopes/audience.
+
+        Arguments:
+            token (str, Token): the token.
+            scopes_required (list, str, None): the scopes that the token must have.
+
+        Returns:
+            validity (bool, str): True if the token is valid, otherwise a string describing
+                why the token is invalid.
+            token_info (dict, None): the token info if it could be retrieved.
+        '''
+        if not token:
+            return 'Missing token', None
+
+        # have we rejected this token recently?
+        key = token_key(token)
+        validity = self.rejected.get(key)
+        if validity is not None:
+            return validity, None
+
+        # get the token info (locally or from the auth server)
+        try:
+            token_info = self.token_info(token)
+        except Exception as e:
+            return self._query_error(key, e), None
+        return self._check_token_info(key, token_info, scopes_required)
+
+    async def avalidate(self, token, scopes_required=None):
+        '''The async version of ``validate``.'''
+        if not token:
+            return 'Missing token', None
+
+        # have we rejected this token recently?
+        key = token_key(token)
+        validity = self.rejected.get(key)
+        if validity is not None:
+            return validity, None
+
+        # get the token info (locally or from the auth server)
+        try:
+            token_info = await self.atoken_info(token)
+        except Exception as e:
+            return self._query_error(key, e), None
+        return self._check_token_info(key, token_info, scopes_required)
+
+    def validate_many(self, tokens, scopes_required=None, max_workers=None):
+        '''Validate a batch of tokens (e.g. in a gateway or when processing logs).
+
+        Identical tokens are only validated once and tokens that we've already seen are
+        answered from the caches. The rest are validated in a thread pool, so local signature
+        verification can use multiple cores (the crypto releases the GIL) and introspection
+        requests run concurrently.
+
+        .. code-block:: python
+
+            results = validator.validate_many(tokens)
+            for token, (validity, token_info) in zip(tokens, results):
+                ...
+
+        Arguments:
+            tokens (list): the tokens (str or Token).
+            scopes_required (list, str, None): the scopes that every token must have.
+            max_workers (int, None): the maximum number of threads. By default, it uses
+                the ``concurrent.futures.ThreadPoolExecutor`` default.
+
+        Returns:
+            results (list): ``(validity, token_info)`` for each token, in the same order as ``tokens``.
+        '''
+        unique = {}
+        for token in tokens:
+            unique.setdefault(str(token or ''), None)
+
+        # answer what we can without any work
+        pending = []
+        for token in unique:
+            info = self.cache.get(token_key(token)) if token else None
+            if info is not None:
+                unique[token] = self._check_token_info(token_key(token), info, scopes_required)
+            else:
+                pending.append(token)
+
+        if len(pending) == 1:
+            unique[pending[0]] = self.validate(pending[0], scopes_required)
+        elif pending:
+            if self.local:  # fetch the keys once up front instead of every thread waiting on it
+                keys = self.well_known.key_store
+                if keys.age() > keys.ttl:
+                    try:
+                        keys.refresh(keys.ttl)
+                    except Exception:
+                        pass  # each token will report the error (or fall back to introspection)
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers, thread_name_prefix='oidcat-validate') as pool:
+                results = pool.map(lambda token: self.validate(token, scopes_required), pending)
+                unique.update(zip(pending, results))
+        return [unique[str(token or '')] for token in tokens]
+
+    def _query_error(self, key, e):
+        validity = 'Error while trying to query token info: {}'.format(e)
+        if isinstance(e, Unauthorized):  # the token was rejected (rather than a network error)
+            self.rejected.set(key, validity)
+        return validity
+
+    def _check_token_info(self, key, token_info, scopes_required=None):
+        if 'error' in token_info:
+            return 'Error received when querying token info: {}'.format(token_info), token_info
+
+        # see if the token is considered active
+        if not token_info.get('active', False):
+            self.rejected.set(key, 'Token is not active.')
+            return 'Token is not active.', token_info
+
+        # validate the token audience
+        if 'aud' in token_info and self.check_aud:
+            if self.client_id not in util.aslist(token_info['aud']):
+                return 'Refused token because of invalid audience', token_info
+
+        # check that it has the required scopes
+        return check_scopes(token_info, scopes_required), token_info
+
+
+def check_scopes(token_info, scopes_required=None):
+    '''Check that the token info has the required scopes (without validating anything else).
+
+    Returns:
+        validity (bool, str): True if it has all of the scopes, otherwise a string saying it doesn't.
+    '''
+    if not scopes_required:
+        return True
+    scopes_required = set(
+        scopes_required if isinstance(scopes_required, (set, frozenset)) else util.aslist(scopes_required))
+    token_scopes = set(token_info.get('scope', '').split(' '))
+    if not scopes_required.issubset(token_scopes):
+        return 'Token does not have required scopes'
+    return True
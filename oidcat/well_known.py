@@ -1,13 +1,25 @@
+import time
+import threading
 import requests
-from requests.auth import HTTPBasicAuth
 from .util import aslist, well_known_url
-from . import RequestError, Token
+from . import RequestError, Unauthorized, Token
+from .pool import shared_session
+from .breaker import CircuitBreaker, backoff
+from .discovery import get_cache
+
+# endpoints that are on the request path of a server get a shorter timeout
+TIMEOUTS = {'tokeninfo': 5, 'userinfo': 5, 'jwks': 5, 'end_session': 5}
+# endpoints that can be safely retried (they don't change anything on the auth server)
+IDEMPOTENT = {'well_known', 'jwks', 'tokeninfo', 'userinfo'}
 
 
 class WellKnown(dict):
     def __init__(self, url, client_id='admin-cli', client_secret=None, 
                  realm=None, sess=None, secure=True,
-                 refresh_buffer=0, refresh_token_buffer=0):
+                 refresh_buffer=0, refresh_token_buffer=0,
+                 jwks_ttl=300, jwks_refetch_interval=30,
+                 timeout=10, timeouts=None, retries=2, retry_backoff=0.1, retry_backoff_max=2,
+                 breaker=None, discovery=None):
         '''A generic interface that encapsulates the information returned from 
         the Well-Known configuration of an authorization server.
 
@@ -28,6 +40,10 @@ class WellKnown(dict):
             client_id (str): the client ID
             client_id (str): the client secret
             realm (str): the authorization server realm. By default, 'master'.
+            sess (requests.Session): the session used to talk to the auth server. By default,
+                this uses a pooled, keep-alive session that's shared between ``WellKnown``
+                objects (see ``oidcat.pool``). It's looked up on each request, so forked
+                processes get their own.
             secure (bool): Whether https:// or http:// should be added for a 
                 url without a schema.
             refresh_buffer (float): the number of seconds prior to expiration
@@ -39,90 +55,324 @@ class WellKnown(dict):
                 a request and the server authenticating the token (which usually happens
                 at the beginning of the route).
             refresh_token_buffer (float): equivalent to `refresh_buffer`, but for the refresh token.
+            jwks_ttl (float): how many seconds to cache the JWKS signing keys for.
+            jwks_refetch_interval (float): the minimum number of seconds between JWKS
+                requests when we see a key ID that we don't know (e.g. after key rotation).
+            timeout (float, tuple): the default timeout for requests to the auth server.
+            timeouts (dict): timeouts for specific endpoints, overriding ``timeout``. The keys are:
+                ``well_known``, ``jwks``, ``tokeninfo``, ``userinfo``, ``token``, ``refresh``,
+                and ``end_session``. By default, the endpoints used while handling a request
+                (``tokeninfo``, ``userinfo``, ``jwks``) time out after 5s.
+            retries (int): how many times to retry the read-only endpoints (``well_known``, ``jwks``,
+                ``tokeninfo``, ``userinfo``) after a connection error, timeout, or 5xx response.
+                Logins and refreshes are never retried.
+            retry_backoff (float): the backoff before the first retry. It doubles (with jitter) after each attempt.
+            retry_backoff_max (float): the maximum backoff between retries.
+            breaker (CircuitBreaker, None): the circuit breaker for this auth server. After repeated
+                failures, calls will fail immediately with ``oidcat.AuthServerUnavailable``.
+                By default, it trips after 5 consecutive failures and tries again after 30s.
+            discovery (DiscoveryCache, bool, None): where to cache the well-known configuration.
+                By default, it's cached in memory (or on disk if ``$OIDCAT_CACHE_DIR`` is set) and
+                revalidated using its ``Cache-Control``/``ETag`` headers (see ``oidcat.discovery``).
+                Pass True to cache it on disk, or False to always fetch it.
         '''
-        self.sess = sess or requests
+        self._sess = sess
         self.client_id = client_id
         self.client_secret = client_secret
         self.refresh_buffer = refresh_buffer
         self.refresh_token_buffer = refresh_token_buffer
+        self.timeout = timeout
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.breaker = CircuitBreaker() if breaker is None else breaker
         if isinstance(url, dict):
             data = url
         else:
-            data = check_error(self.sess.get(
-                well_known_url(url, realm=realm, secure=secure)
-            ).json(), '.well-known')
+            data = check_error(self._discover(
+                well_known_url(url, realm=realm, secure=secure), discovery), '.well-known')
         super().__init__(data)
+        self.key_store = KeyStore(self, ttl=jwks_ttl, refetch_interval=jwks_refetch_interval)
+
+    @property
+    def sess(self):
+        '''The session used to talk to the auth server.'''
+        return self._sess if self._sess is not None else shared_session()
+
+    @sess.setter
+    def sess(self, sess):
+        self._sess = sess
+
+    def _discover(self, url, discovery=None):
+        '''Get the well-known configuration, using the discovery cache if we have one.'''
+        def fetch(headers=None):
+            return self._request('well_known', 'get', dict(url=url, headers=headers or {}))
+        cache = get_cache(discovery)
+        return fetch().json() if cache is None else cache.get(url, fetch)
 
     def jwks(self):
         '''Get the JSON Web Key certificates. Queries ``wk['jwks_uri']``.'''
-        return self.sess.get(self['jwks_uri']).json()['keys']
+        return self._request('jwks', 'get', dict(url=self['jwks_uri'])).json()['keys']
+
+    def verify_token(self, token, audience=None, leeway=0, algorithms=None):
+        '''Verify the token signature, expiration, and issuer locally using the
+        keys from ``jwks()``. This avoids a round trip to the introspection endpoint.
+
+        Requires ``pyjwt[crypto]`` (``pip install oidcat[jwt]``).
+
+        Arguments:
+            token (str, Token): the token to verify.
+            audience (str, list, None): the audience that the token must be issued for.
+                If None, the audience is not checked.
+            leeway (float): the number of seconds of clock skew to allow when
+                checking ``exp``/``nbf``/``iat``.
+            algorithms (list, None): the allowed signing algorithms. By default,
+                this is the algorithm associated with the signing key.
+
+        The signing keys are cached in ``self.key_store``.
+
+        Returns:
+            data (dict): the verified token payload.
+
+        Raises:
+            oidcat.Unauthorized if the token could not be verified.
+        '''
+        token = str(token)
+        kid = _unverified_kid(token)
+        return self._verify_token(token, kid, self.key_store.get(kid), audience, leeway, algorithms)
+
+    def _verify_token(self, token, kid, key, audience=None, leeway=0, algorithms=None):
+        '''Verify the token using the key that we looked up for its ``kid``.'''
+        import jwt
+        if key is None:
+            raise Unauthorized('No signing key found for kid {!r}.'.format(kid))
+        try:
+            return jwt.decode(
+                token, key.key, algorithms=algorithms or [key.algorithm_name],
+                audience=audience, issuer=self.get('issuer'), leeway=leeway,
+                options={'verify_aud': audience is not None})
+        except (jwt.InvalidTokenError, jwt.PyJWKError) as e:
+            raise Unauthorized('Invalid token: {}'.format(e))
 
     def userinfo(self, token):
         '''Get user info from the token string.
         Queries ``wk['userinfo_endpoint']``.'''
-        return check_error(self.sess.post(
-            self['userinfo_endpoint'],
-            headers=bearer(token)
-        ).json(), 'user info')
+        return check_error(self._request('userinfo', 'post', self._userinfo_request(token)).json(), 'user info')
 
     def tokeninfo(self, token):
         '''Get token info from the token string.
         Queries ``wk['token_introspection_endpoint']``.'''
-        return check_error(self.sess.post(
-            self['token_introspection_endpoint'],
-            data={'token': str(token)},
-            auth=HTTPBasicAuth(self.client_id, self.client_secret),
-        ).json(), 'token info')
+        return check_error(self._request('tokeninfo', 'post', self._tokeninfo_request(token)).json(), 'token info')
 
     def get_token(self, username, password=None, offline=False, scope=None):
         '''Login to get the token.'''
-        scope = aslist(scope)
-        if offline:
-            scope.append('offline_access')
-        resp = check_error(self.sess.post(
-            self['token_endpoint'],
-            data={
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-                'grant_type': 'password',
-                'username': username,
-                'password': password,
-                **({'scope': scope} if scope else {})
-            }).json(), 'access token')
-        token = Token(resp['access_token'], self.refresh_buffer)
-        refresh_token = Token(resp['refresh_token'], self.refresh_token_buffer)
-        return token, refresh_token
+        return self._tokens(check_error(self._request('token', 'post', self._get_token_request(
+            username, password, offline=offline, scope=scope)).json(), 'access token'))
 
     def refresh_token(self, refresh_token, offline=False, scope=None):
         '''Refresh the token.'''
+        return self._tokens(check_error(self._request('refresh', 'post', self._refresh_token_request(
+            refresh_token, offline=offline, scope=scope)).json(), 'refreshed access token'))
+
+    # def register(self):
+    #     self.sess.post(self['registration_endpoint']).json()
+
+    def end_session(self, token, refresh_token=None):
+        '''Logout.'''
+        self._request('end_session', 'post', self._end_session_request(token, refresh_token))
+
+    def _request(self, endpoint, method, kw):
+        '''Send a request to the auth server with a timeout, retries, and the circuit breaker.
+
+        Arguments:
+            endpoint (str): the endpoint name (see ``timeouts``).
+            method (str): the session method to call (e.g. 'get', 'post').
+            kw (dict): the request arguments.
+        '''
+        kw = dict(kw, timeout=self._timeout(endpoint))
+        attempts = 1 + (self.retries if endpoint in IDEMPOTENT else 0)
+        for i in range(attempts):
+            self.breaker.check()
+            try:
+                resp = getattr(self.sess, method)(**kw)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                self.breaker.failure()
+                if i + 1 >= attempts:
+                    raise
+            except BaseException:
+                self.breaker.release()  # don't hold on to the half-open trial slot
+                raise
+            else:
+                if not _server_error(resp):
+                    self.breaker.success()
+                    return resp
+                self.breaker.failure()
+                if i + 1 >= attempts:
+                    return resp  # let the caller deal with the error response
+            time.sleep(self._backoff(i))
+
+    def _timeout(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeout)
+
+    def _backoff(self, attempt):
+        return backoff(attempt, self.retry_backoff, self.retry_backoff_max)
+
+    # The request arguments are built separately from the requests themselves
+    # so that they can be shared with other http clients (see oidcat.aio).
+
+    def _userinfo_request(self, token):
+        return dict(url=self['userinfo_endpoint'], headers=bearer(token))
+
+    def _tokeninfo_request(self, token):
+        return dict(
+            url=self.get('token_introspection_endpoint') or self['introspection_endpoint'],
+            data={'token': str(token)},
+            auth=(self.client_id, self.client_secret or ''))
+
+    def _get_token_request(self, username, password=None, offline=False, scope=None):
         scope = aslist(scope)
         if offline:
             scope.append('offline_access')
-        resp = check_error(self.sess.post(
-            self['token_endpoint'],
-            data={
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-                'grant_type': 'refresh_token',
-                'refresh_token': str(refresh_token),
-            }).json(), 'refreshed access token')
+        return self._token_endpoint_request(
+            grant_type='password', username=username, password=password,
+            scope=scope or None)
+
+    def _refresh_token_request(self, refresh_token, offline=False, scope=None):
+        return self._token_endpoint_request(
+            grant_type='refresh_token', refresh_token=str(refresh_token))
+
+    def _token_endpoint_request(self, **data):
+        return dict(url=self['token_endpoint'], data=_drop_none(
+            client_id=self.client_id, client_secret=self.client_secret, **data))
+
+    def _end_session_request(self, token, refresh_token=None):
+        return dict(url=self['end_session_endpoint'], data=_drop_none(
+            access_token=str(token) if token is not None else None,
+            refresh_token=str(refresh_token) if refresh_token is not None else None,
+            client_id=self.client_id,
+            client_secret=self.client_secret))
+
+    def _tokens(self, resp):
+        '''Get the access and refresh tokens from a token endpoint response.'''
         token = Token(resp['access_token'], self.refresh_buffer)
-        refresh_token = Token(resp['refresh_token'], self.refresh_token_buffer)
+        refresh_token = Token(resp['refresh_token'], self.refresh_token_buffer, lazy=True)
         return token, refresh_token
 
-    # def register(self):
-    #     self.sess.post(self['registration_endpoint']).json()
 
-    def end_session(self, token, refresh_token=None):
-        '''Logout.'''
-        self.sess.post(
-            self['end_session_endpoint'],
-            data={
-                'access_token': str(token) if token is not None else None,
-                'refresh_token': str(refresh_token) if refresh_token is not None else None,
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-            })
+def _server_error(resp):
+    '''Is this a (probably temporary) auth server error? (e.g. 502 from a proxy while it restarts)'''
+    return resp.status_code >= 500
+
+
+def _unverified_kid(token):
+    '''Get the key ID from the token header (without verifying anything).'''
+    import jwt
+    try:
+        return jwt.get_unverified_header(token).get('kid')
+    except jwt.InvalidTokenError as e:
+        raise Unauthorized('Invalid token: {}'.format(e))
+
+
+def _drop_none(**data):
+    return {k: v for k, v in data.items() if v is not None}
+
+
+class KeyStore:
+    def __init__(self, well_known, ttl=300, refetch_interval=30):
+        '''A cache of the auth server's public signing keys, indexed by key ID (``kid``).
+
+        Keys are fetched using ``well_known.jwks()`` and are refetched once they are older
+        than ``ttl``. If we're asked for a key ID that we don't have (which happens when the
+        auth server rotates its keys), we'll refetch the keys, but at most once every
+        ``refetch_interval`` seconds so that garbage key IDs can't flood the auth server.
+
+        .. code-block:: python
+
+            key = wk.key_store.get(jwt.get_unverified_header(token)['kid'])
+            print(wk.key_store.stats())  # {'hits': 1023, 'misses': 1, 'fetches': 1, 'keys': 2}
+
+        Arguments:
+            well_known (WellKnown): the well-known configuration.
+            ttl (float): how many seconds to cache the keys for.
+            refetch_interval (float): the minimum number of seconds between fetches
+                triggered by an unknown key ID.
+        '''
+        self.well_known = well_known
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+        self.keys = {}
+        self.fetched_at = None
+        self.hits = self.misses = self.fetches = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in self.stats().items()))
+
+    def __contains__(self, kid):
+        return kid in self.keys
+
+    def get(self, kid):
+        '''Get the parsed public key (a ``jwt.PyJWK``) for a key ID.
+
+        Arguments:
+            kid (str): the key ID from the token header.
+
+        Returns:
+            key (jwt.PyJWK, None): the key, or None if the auth server doesn't have the key.
+        '''
+        if self.age() > self.ttl:
+            self.refresh(self.ttl)
+        key = self.keys.get(kid)
+        if key is None:  # maybe the keys were rotated
+            self.refresh(self.refetch_interval)
+            key = self.keys.get(kid)
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key
+
+    def age(self):
+        '''How many seconds ago the keys were fetched.'''
+        return time.monotonic() - self.fetched_at if self.fetched_at is not None else float('inf')
+
+    def refresh(self, min_age=0):
+        '''Fetch the keys from the auth server.
+
+        Arguments:
+            min_age (float): only fetch if the keys are older than this. This is
+                checked after acquiring the lock so that concurrent callers only
+                trigger a single fetch.
+        '''
+        with self._lock:
+            if self.age() < min_age:
+                return
+            self._set_keys(self.well_known.jwks())
+
+    def _set_keys(self, jwks):
+        '''Parse the signing keys from the JWKS response.'''
+        import jwt
+        keys = {}
+        for jwk in jwks:
+            if jwk.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[jwk.get('kid')] = jwt.PyJWK(jwk)
+            except jwt.PyJWKError:  # e.g. an unsupported algorithm
+                pass
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+        self.fetches += 1
+
+    def clear(self):
+        '''Forget all of the keys.'''
+        with self._lock:
+            self.keys, self.fetched_at = {}, None
+
+    def stats(self):
+        '''Get the cache hit/miss counters.'''
+        return {'hits': self.hits, 'misses': self.misses, 'fetches': self.fetches, 'keys': len(self.keys)}
 
 
 def check_error(resp, item='request'):
@@ -23,7 +23,9 @@ setuptools.setup(
     entry_points={'console_scripts': ['oidcat-admin=oidcat.cli.keycloak:main']},
     install_requires=['requests'],
     extras_require={
-        'server': ['flask', 'flask_oidc', 'sqlitedict'],
+        'server': ['flask', 'flask_oidc', 'sqlitedict', 'pyjwt[crypto]'],
+        'jwt': ['pyjwt[crypto]'],
+        'async': ['httpx'],
         'cli': ['tabulate', 'fire'],
     },
     license='MIT License',
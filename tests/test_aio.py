@@ -0,0 +1,139 @@
+import time
+import asyncio
+import pytest
+import oidcat
+
+httpx = pytest.importorskip('httpx')
+import oidcat.aio
+
+AUTH = 'https://auth.myproject.com/auth/realms/master'
+WK = {
+    'issuer': AUTH,
+    'token_endpoint': AUTH + '/token',
+    'token_introspection_endpoint': AUTH + '/token/introspect',
+    'userinfo_endpoint': AUTH + '/userinfo',
+    'end_session_endpoint': AUTH + '/logout',
+}
+
+
+def make_token(lifetime=60, **kw):
+    now = time.time()
+    return oidcat.token.jwt_encode({'alg': 'none'}, dict({'iat': now, 'exp': now + lifetime}, **kw), 'x')
+
+
+class FakeAuthServer:
+    def __init__(self, lifetime=60, delay=0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.requests = []
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        await asyncio.sleep(self.delay)
+        path = request.url.path
+        if path.endswith('/.well-known/openid-configuration'):
+            return httpx.Response(200, json=WK)
+        if path.endswith('/token'):
+            return httpx.Response(200, json={
+                'access_token': make_token(self.lifetime),
+                'refresh_token': make_token(self.lifetime * 10)})
+        if path.endswith('/logout'):
+            return httpx.Response(204)
+        if path == '/api':
+            return httpx.Response(200, json={'auth': request.headers.get('Authorization')})
+        return httpx.Response(404, json={'error': 'not_found'})
+
+
+def test_async_session():
+    server = FakeAuthServer(delay=0.05)
+    transport = httpx.MockTransport(server)
+
+    async def main():
+        sess = oidcat.aio.AsyncSession(
+            'auth.myproject.com', 'user', 'pass', sess=httpx.AsyncClient(transport=transport),
+            client_kw={'transport': transport})
+        async with sess:
+            assert not server.requests  # nothing happens until we need a token
+            results = await asyncio.gather(*(sess.get('https://api.myproject.com/api') for _ in range(10)))
+            token = sess.access.token
+            assert token
+            assert all(r.json()['auth'] == 'Bearer {}'.format(token) for r in results)
+            # one well-known request, one login, ten api requests
+            assert len(server.requests) == 12
+
+            r = await sess.get('https://api.myproject.com/api', auth=None)
+            assert r.json()['auth'] is None
+
+            # refresh
+            sess.access.token = oidcat.Token(make_token(-1))
+            await asyncio.gather(*(sess.require_login() for _ in range(5)))
+            assert sess.access.token
+            assert len(server.requests) == 14
+            assert b'grant_type=refresh_token' in server.requests[-1].content
+
+            await sess.logout()
+            assert sess.access.token is None
+    asyncio.run(main())
+
+
+def test_async_breaker_cancelled_trial():
+    breaker = oidcat.breaker.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    delay = [0]
+    async def handler(request):
+        await asyncio.sleep(delay[0])
+        return httpx.Response(200, json={'active': True})
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        wk = oidcat.aio.AsyncWellKnown(WK, sess=client, retries=0, breaker=breaker)
+        breaker.failure()
+        assert breaker.state == 'open'
+        await asyncio.sleep(0.05)
+
+        # the client disconnects during the trial call
+        delay[0] = 1
+        task = asyncio.ensure_future(wk.tokeninfo('abc'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # the next call is still let through
+        delay[0] = 0
+        assert await wk.tokeninfo('abc') == {'active': True}
+        assert breaker.state == 'closed'
+        await client.aclose()
+    asyncio.run(main())
+
+
+def test_async_verify_token():
+    jwt = pytest.importorskip('jwt')
+    pytest.importorskip('cryptography')
+    import json
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = dict(json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key())), kid='key1', alg='RS256', use='sig')
+    def sign(kid='key1', **kw):
+        return jwt.encode(dict({'exp': time.time() + 60, 'iss': AUTH, 'aud': 'my-client'}, **kw),
+                          key, algorithm='RS256', headers={'kid': kid})
+
+    requests = []
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={'keys': [jwk]})
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            wk = oidcat.aio.AsyncWellKnown(dict(WK, jwks_uri=AUTH + '/certs'), sess=client)
+            assert isinstance(wk.key_store, oidcat.aio.AsyncKeyStore)
+            assert (await wk.verify_token(sign(), audience='my-client'))['iss'] == AUTH
+            assert (await wk.verify_token(sign(sub='me')))['sub'] == 'me'
+            assert await wk.key_store.get('key1') is not None
+            for token in (sign(kid='unknown'), sign(iss='https://evil.com'), 'garbage'):
+                with pytest.raises(oidcat.Unauthorized):
+                    await wk.verify_token(token)
+            await wk.key_store.refresh()
+            return wk.key_store.stats()
+    # the unknown kid doesn't refetch within refetch_interval
+    assert asyncio.run(main()) == {'hits': 4, 'misses': 1, 'fetches': 2, 'keys': 1}
+    assert len(requests) == 2
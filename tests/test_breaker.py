@@ -0,0 +1,64 @@
+import time
+import pytest
+import oidcat
+
+
+def test_circuit_breaker():
+    breaker = oidcat.breaker.CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    breaker.check()
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == 'open'
+    with pytest.raises(oidcat.AuthServerUnavailable):
+        breaker.check()
+
+    # after the timeout, a single trial call is let through
+    time.sleep(0.1)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()  # failed trial - open again
+    assert breaker.state == 'open'
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == 'closed' and breaker.allow()
+    assert breaker.stats() == {'state': 'closed', 'failures': 0, 'trips': 2, 'rejected': 2}
+
+    for i in range(10):
+        assert 0 <= oidcat.breaker.backoff(i, 0.1, 2) <= min(2, 0.1 * 2 ** i)
+
+
+def test_circuit_breaker_trial_released():
+    import requests
+
+    class Session:
+        def __init__(self):
+            self.error = requests.ConnectionError()
+
+        def post(self, **kw):
+            if self.error:
+                raise self.error
+            return Response()
+
+    class Response:
+        status_code = 200
+        def json(self):
+            return {'active': True}
+
+    breaker = oidcat.breaker.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    sess = Session()
+    wk = oidcat.WellKnown({'token_introspection_endpoint': 'x'}, sess=sess, retries=0, breaker=breaker)
+    with pytest.raises(requests.ConnectionError):
+        wk.tokeninfo('abc')
+    assert breaker.state == 'open'
+
+    # the trial call fails with something unexpected (e.g. a bug or a cancelled call)
+    time.sleep(0.05)
+    sess.error = ValueError('oops')
+    with pytest.raises(ValueError):
+        wk.tokeninfo('abc')
+    # ... which doesn't keep the circuit half-open forever
+    sess.error = None
+    assert wk.tokeninfo('abc') == {'active': True}
+    assert breaker.state == 'closed'
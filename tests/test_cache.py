@@ -0,0 +1,111 @@
+import time
+import pytest
+import oidcat
+
+
+def test_lru_cache():
+    cache = oidcat.cache.LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # evicts b
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 0, 'hit_ratio': 1, 'size': 2, 'maxsize': 2}
+
+    cache.set('d', 4, ttl=0.1)
+    cache.set('e', 5, expires=time.time() - 1)  # already expired
+    assert cache.get('d') == 4
+    assert 'e' not in cache
+    time.sleep(0.15)
+    assert cache.get('d') is None
+
+    cache = oidcat.cache.LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_sqlite_cache(tmpdir):
+    pytest.importorskip('sqlitedict')
+    fname = str(tmpdir.join('cache.db'))
+    cache = oidcat.cache.SqliteCache(fname)
+    cache.set('a', {'x': 1})
+    cache.set('b', 2, ttl=0.1)
+    cache.set('c', 3, expires=time.time() - 1)
+    # shared between instances (e.g. other processes)
+    other = oidcat.cache.SqliteCache(fname)
+    assert other.get('a') == {'x': 1}
+    assert other.get('b') == 2
+    assert other.get('c') is None
+    time.sleep(0.15)
+    assert other.get('b') is None
+    assert other.stats()['hit_ratio'] == 0.5
+
+
+def test_single_flight():
+    import threading
+    flight = oidcat.cache.SingleFlight()
+    calls = []
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return x * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('a', slow, 2))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [4] * 5
+    assert calls == [2]
+    assert flight.stats() == {'calls': 1, 'shared': 4, 'in_flight': 0}
+
+    # errors are raised, and the next call runs again
+    def fail():
+        raise ValueError('nope')
+    with pytest.raises(ValueError):
+        flight.do('a', fail)
+    assert flight.do('a', slow, 3) == 6
+
+
+def test_async_single_flight():
+    import asyncio
+    flight = oidcat.cache.AsyncSingleFlight()
+    calls = []
+    async def slow(x):
+        calls.append(x)
+        await asyncio.sleep(0.05)
+        return x * 2
+
+    async def fail():
+        raise ValueError('nope')
+
+    async def main():
+        assert await asyncio.gather(*(flight.do('a', slow, 2) for _ in range(5))) == [4] * 5
+        with pytest.raises(ValueError):
+            await flight.do('a', fail)
+        assert await flight.do('a', slow, 3) == 6
+    asyncio.run(main())
+    assert calls == [2, 3]
+    assert flight.stats() == {'calls': 3, 'shared': 4, 'in_flight': 0}
+
+
+def test_async_single_flight_leader_cancelled():
+    import asyncio
+    flight = oidcat.cache.AsyncSingleFlight()
+    async def slow(x):
+        await asyncio.sleep(0.05)
+        return x * 2
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do('a', slow, 2))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(flight.do('a', slow, 2)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()  # e.g. the leader's client disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await asyncio.gather(*waiters) == [4] * 3
+    asyncio.run(main())
+    assert flight.stats() == {'calls': 1, 'shared': 3, 'in_flight': 0}
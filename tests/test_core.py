@@ -1,4 +1,5 @@
 import os
+import time
 import pytest
 
 import oidcat
@@ -153,3 +154,183 @@ def test_inaccessible3(server, sess, bearer):
     assert server.get('/inaccessible3', headers=bearer).status_code == 401
 
 
+
+
+# these don't need an auth server
+
+WK = {'token_endpoint': 'https://auth.myproject.com/token', 'end_session_endpoint': 'https://auth.myproject.com/logout'}
+
+def make_token(lifetime=60, **kw):
+    now = time.time()
+    return oidcat.token.jwt_encode({'alg': 'none'}, dict({'iat': now, 'exp': now + lifetime}, **kw), 'x')
+
+
+class FakeAuth:
+    '''Stands in for the token endpoint.'''
+    def __init__(self, lifetime=60, delay=0, fail=False, buffer=0.1):
+        self.lifetime = lifetime
+        self.buffer = buffer
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, *a, **kw):
+        self.calls.append(time.time())
+        time.sleep(self.delay)
+        if self.fail:
+            raise oidcat.RequestError('auth server is down')
+        return (oidcat.Token(make_token(self.lifetime), self.buffer),
+                oidcat.Token(make_token(self.lifetime * 10), self.buffer))
+
+def fake_access(auth, **kw):
+    access = oidcat.Access(None, 'user', 'pass', _wk=WK, login=False, **kw)
+    access.well_known.get_token = access.well_known.refresh_token = auth
+    access.well_known.end_session = lambda *a, **kw: None
+    return access
+
+
+def test_background_refresh():
+    auth = FakeAuth(lifetime=1)
+    access = fake_access(auth, refresh_fraction=0.4, refresh_buffer=0.1)
+    access.login()
+    first = access.token
+    access.start_refresher()
+    time.sleep(1.1)
+    assert len(auth.calls) >= 3
+    assert access.token is not first and access.token
+    assert access.refresh_latency.count == len(auth.calls) - 1
+    access.stop_refresher()
+    n = len(auth.calls)
+    time.sleep(0.5)
+    assert len(auth.calls) == n
+
+    # failures are recorded and retried
+    auth.fail = True
+    access.refresh_retry = 0.1
+    access.start_refresher()
+    time.sleep(1)
+    access.logout()
+    assert access.refresh_failures >= 2
+    assert isinstance(access.refresh_error, oidcat.RequestError)
+    assert access._refresher is None
+
+
+def test_stale_while_revalidate():
+    auth = FakeAuth(lifetime=3, delay=0.5, buffer=2.8)
+    access = fake_access(auth, stale_while_revalidate=True, stale_deadline=0.5)
+    access.login()
+    old = access.token
+    time.sleep(0.3)
+    assert not old  # inside the buffer
+    # callers get the old token immediately while it refreshes
+    start = time.time()
+    assert access.require() is old
+    assert access.require() is old
+    assert time.time() - start < 0.1
+    time.sleep(0.7)
+    assert len(auth.calls) == 2  # only one refresh
+    assert access.token is not old
+
+    # past the deadline, callers wait
+    auth.buffer = 0.1
+    old = access.token = oidcat.Token(make_token(0.3), 0.3)
+    start = time.time()
+    assert access.require() is not old
+    assert time.time() - start >= 0.5
+    assert len(auth.calls) == 3
+
+
+def test_stale_while_revalidate_backoff():
+    auth = FakeAuth(lifetime=3, buffer=2.8)
+    access = fake_access(auth, stale_while_revalidate=True, stale_deadline=0.5, refresh_retry=0.5)
+    access.login()
+    old = access.token
+    time.sleep(0.3)
+    auth.fail = True
+
+    # a failed refresh isn't retried on every call
+    for _ in range(20):
+        assert access.require() is old
+        time.sleep(0.01)
+    assert len(auth.calls) == 2
+    assert access.refresh_failures == 1
+    assert isinstance(access.refresh_error, oidcat.RequestError)
+
+    # but it is once refresh_retry has passed
+    time.sleep(0.5)
+    auth.fail = False
+    assert access.require() is old
+    time.sleep(0.1)
+    assert len(auth.calls) == 3
+    assert access.token is not old and access._refresh_failed_at is None
+
+
+def test_lazy_access(monkeypatch):
+    auth = FakeAuth(delay=0.1)
+    created = []
+    class FakeWellKnown(oidcat.WellKnown):
+        def __init__(self, *a, **kw):
+            created.append(time.time())
+            super().__init__(*a, **kw)
+            self.get_token = self.refresh_token = auth
+    monkeypatch.setattr(oidcat.core, 'WellKnown', FakeWellKnown)
+
+    # nothing happens until we need a token
+    access = oidcat.Access(None, 'user', 'pass', _wk=WK, lazy=True, discard_credentials=True)
+    assert not created and not auth.calls
+    assert access.require() and len(created) == 1 and len(auth.calls) == 1
+    assert access._deferred_login is None
+
+    # prefetching logs in in the background
+    access = oidcat.Access(None, 'user', 'pass', _wk=WK, lazy=True, prefetch=True)
+    time.sleep(0.2)
+    assert len(created) == 2 and len(auth.calls) == 2
+    assert access.token
+
+
+def test_shared_store(tmpdir):
+    auth = FakeAuth()
+    fname = str(tmpdir.join('tokens.json'))
+    a = fake_access(auth, shared_store=fname)
+    b = fake_access(auth, shared_store=fname)
+    a.login()
+    assert len(auth.calls) == 1
+    assert oct(os.stat(fname).st_mode & 0o777) == oct(0o600)
+
+    # b picks up a's token without logging in
+    assert str(b.require()) == str(a.token)
+    assert len(auth.calls) == 1
+
+    # when it expires, only one of them refreshes
+    a.token = b.token = oidcat.Token(make_token(-1))
+    a.shared_store.save(a.token, a.refresh_token)
+    assert a.require() and b.require()
+    assert len(auth.calls) == 2
+    assert str(a.token) == str(b.token)
+    assert b.shared_store.stats()['writes'] == 0
+
+    # a new process starts with the shared token
+    c = oidcat.Access(None, 'user', 'pass', _wk=WK, shared_store=fname)
+    assert str(c.token) == str(a.token)
+    assert len(auth.calls) == 2
+
+
+def test_shared_store_doesnt_race_refresh(tmpdir):
+    import threading
+    fname = str(tmpdir.join('tokens.json'))
+    access = fake_access(FakeAuth(), shared_store=fname)
+    older = oidcat.Token(make_token(60))
+    access.shared_store.save(older, None)
+    access.token = oidcat.Token(make_token(-1))
+
+    # another thread is refreshing - wait for it rather than loading the older shared token
+    access.login_lock.acquire()
+    result = []
+    t = threading.Thread(target=lambda: result.append(access.require()))
+    t.start()
+    time.sleep(0.1)
+    assert not result
+    refreshed = access.token = oidcat.Token(make_token(120))
+    access.login_lock.release()
+    t.join()
+    assert result == [refreshed] and result[0] is refreshed
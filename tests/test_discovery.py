@@ -0,0 +1,104 @@
+import oidcat
+
+
+def test_discovery_cache(tmpdir):
+    class Response:
+        def __init__(self, status_code, data=None, headers=None):
+            self.status_code, self.data, self.headers = status_code, data, headers or {}
+
+        def json(self):
+            if isinstance(self.data, Exception):
+                raise self.data
+            return self.data
+
+    requests = []
+    responses = []
+    def fetch(headers):
+        requests.append(headers)
+        resp = responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    url = 'https://auth.myproject.com/auth/realms/master/.well-known/openid-configuration'
+    fname = str(tmpdir.join('well-known.json'))
+    cache = oidcat.discovery.DiscoveryCache(fname, ttl=60)
+    responses.append(Response(200, {'issuer': 'a'}, {'ETag': '"v1"', 'Cache-Control': 'max-age=0'}))
+    assert cache.get(url, fetch) == {'issuer': 'a'}
+    assert requests == [{}]
+
+    # it's stale right away (max-age=0), so we revalidate
+    responses.append(Response(304, headers={'Cache-Control': 'max-age=100'}))
+    assert cache.get(url, fetch) == {'issuer': 'a'}
+    assert requests[-1] == {'If-None-Match': '"v1"'}
+
+    # now it's fresh - even in another process
+    cache2 = oidcat.discovery.DiscoveryCache(fname)
+    assert cache2.get(url, fetch) == {'issuer': 'a'}
+    assert len(requests) == 2
+    assert cache.stats() == {'hits': 0, 'revalidated': 1, 'fetches': 1, 'stale': 0}
+
+    # serve the stale copy if the auth server is down
+    cache = oidcat.discovery.DiscoveryCache(fname, ttl=0)
+    cache.clear()
+    responses.append(Response(200, {'issuer': 'b'}))
+    assert cache.get(url, fetch) == {'issuer': 'b'}
+    responses.append(ConnectionError())
+    assert cache.get(url, fetch) == {'issuer': 'b'}
+    assert cache.stats()['stale'] == 1
+
+    # same if it's returning server errors (e.g. an html page from the proxy)
+    responses.append(Response(502, ValueError('<html>Bad Gateway</html>')))
+    assert cache.get(url, fetch) == {'issuer': 'b'}
+    responses.append(Response(503, {'error': 'unavailable'}))
+    assert cache.get(url, fetch) == {'issuer': 'b'}
+    assert cache.stats()['stale'] == 3
+
+    # no-store and errors aren't cached
+    cache = oidcat.discovery.DiscoveryCache(None)
+    responses.append(Response(200, {'issuer': 'c'}, {'Cache-Control': 'no-store'}))
+    responses.append(Response(200, {'error': 'nope'}))
+    assert cache.get(url, fetch) == {'issuer': 'c'}
+    assert cache.get(url, fetch) == {'error': 'nope'}
+    assert not responses
+
+    assert oidcat.discovery._cache_control('public, Max-Age="30", no-cache') == {
+        'public': True, 'max-age': 30, 'no-cache': True}
+
+
+def test_default_discovery_cache(tmpdir, monkeypatch):
+    import os
+    import warnings
+    monkeypatch.setattr(oidcat.discovery, '_default', None)
+    monkeypatch.setattr(oidcat.discovery, '_disk', None)
+    monkeypatch.setattr(oidcat.discovery, 'CACHE_DIR', str(tmpdir.join('default')))
+    monkeypatch.delenv('OIDCAT_CACHE_DIR', raising=False)
+
+    # in memory unless you opt in
+    assert oidcat.discovery.get_cache() is oidcat.discovery.default_cache()
+    assert oidcat.discovery.default_cache().fname is None
+    assert oidcat.discovery.get_cache(True).fname == str(tmpdir.join('default', 'well-known.json'))
+    assert oidcat.discovery.get_cache(False) is None
+    cache = oidcat.discovery.DiscoveryCache(None)
+    assert oidcat.discovery.get_cache(cache) is cache
+
+    monkeypatch.setattr(oidcat.discovery, '_default', None)
+    monkeypatch.setattr(oidcat.discovery, '_disk', None)
+    monkeypatch.setenv('OIDCAT_CACHE_DIR', str(tmpdir.join('env')))
+    assert oidcat.discovery.default_cache().fname == str(tmpdir.join('env', 'well-known.json'))
+
+    # an unwritable directory warns (once) and keeps working in memory
+    class Response:
+        status_code, headers = 200, {}
+        def json(self):
+            return {'issuer': 'a'}
+    blocker = tmpdir.join('file')
+    blocker.write('')
+    cache = oidcat.discovery.DiscoveryCache(str(blocker.join('well-known.json')))
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        for url in 'ab':
+            assert cache.get(url, lambda headers: Response()) == {'issuer': 'a'}
+    assert [w.category for w in caught] == [RuntimeWarning]
+    assert cache.get('a', None) == {'issuer': 'a'}  # from memory
+    assert not os.path.exists(str(blocker.join('well-known.json')))
@@ -0,0 +1,155 @@
+import io
+import json
+import asyncio
+import pytest
+import oidcat
+import oidcat.middleware
+
+
+def introspect(token):
+    if token == 'good':
+        return {'active': True, 'aud': 'my-client', 'scope': 'profile'}
+    return {'active': False}
+
+
+def make_validator():
+    return oidcat.validation.TokenValidator(
+        oidcat.WellKnown({}, 'my-client'), introspect_func=introspect,
+        async_introspect_func=lambda token: asyncio.sleep(0, introspect(token)))
+
+
+def wsgi_app(environ, start_response):
+    start_response('200 OK', [])
+    return [json.dumps({
+        'token': environ['oidcat.token'].token,
+        'validity': environ['oidcat.validity'],
+        'body': environ['wsgi.input'].read().decode(),
+    }).encode()]
+
+
+def call_wsgi(app, **environ):
+    environ = dict({'wsgi.input': io.BytesIO(), 'QUERY_STRING': ''}, **environ)
+    status = []
+    body = b''.join(app(environ, lambda s, h: status.append(s)))
+    return status[0], json.loads(body)
+
+
+def test_wsgi_middleware():
+    app = oidcat.middleware.WSGIMiddleware(wsgi_app, make_validator())
+    status, data = call_wsgi(app, HTTP_AUTHORIZATION='Bearer good')
+    assert status == '200 OK'
+    assert data['token'] == 'good' and data['validity'] is True
+
+    status, data = call_wsgi(app, QUERY_STRING='access_token=good')
+    assert data['token'] == 'good'
+
+    # the form body is still readable by the app
+    body = b'access_token=good&x=1'
+    status, data = call_wsgi(
+        app, CONTENT_TYPE='application/x-www-form-urlencoded',
+        CONTENT_LENGTH=str(len(body)), **{'wsgi.input': io.BytesIO(body)})
+    assert data['token'] == 'good' and data['body'] == body.decode()
+
+    # the query comes before the form, and uploads/large bodies are never read
+    class Body(io.BytesIO):
+        def read(self, *a):
+            assert not a, 'the middleware should not read the body'
+            return super().read()
+    status, data = call_wsgi(
+        app, QUERY_STRING='access_token=good', CONTENT_TYPE='application/x-www-form-urlencoded',
+        CONTENT_LENGTH='17', **{'wsgi.input': Body(b'access_token=good')})
+    assert data['token'] == 'good'
+    for content_type, length in [('multipart/form-data; boundary=x', '17'),
+                                 ('application/x-www-form-urlencoded', str(10**9)),
+                                 ('application/x-www-form-urlencoded', None)]:
+        status, data = call_wsgi(app, CONTENT_TYPE=content_type, CONTENT_LENGTH=length, **{
+            'wsgi.input': Body(b'access_token=good')})
+        assert data['token'] is None and data['validity'] == 'Missing token'
+
+    status, data = call_wsgi(app, HTTP_AUTHORIZATION='Bearer bad')
+    assert status == '200 OK'
+    assert data['token'] is None and data['validity'] == 'Token is not active.'
+
+    app.required = True
+    status, data = call_wsgi(app)
+    assert status == '401 Unauthorized'
+    assert data['type'] == 'Unauthorized' and data['message'] == 'Missing token'
+
+    # only look where we're told to
+    app = oidcat.middleware.WSGIMiddleware(wsgi_app, make_validator(), sources=['header'])
+    status, data = call_wsgi(app, QUERY_STRING='access_token=good')
+    assert data['token'] is None
+    with pytest.raises(ValueError):
+        oidcat.middleware.WSGIMiddleware(wsgi_app, make_validator(), sources=['cookie'])
+
+
+def test_asgi_middleware():
+    async def asgi_app(scope, receive, send):
+        message = await receive()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': json.dumps({
+            'token': scope['oidcat.token'].token,
+            'validity': scope['oidcat.validity'],
+            'body': message.get('body', b'').decode(),
+        }).encode()})
+
+    async def call(app, headers=(), query=b'', body=b''):
+        sent = []
+        async def receive():
+            return {'type': 'http.request', 'body': body}
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'headers': list(headers), 'query_string': query}
+        await app(scope, receive, send)
+        assert 'oidcat.token' not in scope  # the original scope isn't modified
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    app = oidcat.middleware.ASGIMiddleware(asgi_app, make_validator())
+    async def main():
+        status, data = await call(app, [(b'authorization', b'Bearer good')])
+        assert status == 200 and data['token'] == 'good' and data['validity'] is True
+
+        status, data = await call(app, query=b'access_token=good')
+        assert data['token'] == 'good'
+
+        status, data = await call(app, [
+            (b'content-type', b'application/x-www-form-urlencoded'), (b'content-length', b'17'),
+        ], body=b'access_token=good')
+        assert data['token'] == 'good' and data['body'] == 'access_token=good'
+
+        # streaming bodies (no content-length) aren't read
+        status, data = await call(
+            app, [(b'content-type', b'application/x-www-form-urlencoded')], body=b'access_token=good')
+        assert data['token'] is None and data['validity'] == 'Missing token'
+
+        app.required = True
+        status, data = await call(app, [(b'authorization', b'Bearer bad')])
+        assert status == 401 and data['message'] == 'Token is not active.'
+    asyncio.run(main())
+
+
+def test_asgi_middleware_lifespan():
+    closed = []
+    validator = make_validator()
+    async def aclose():
+        closed.append(True)
+    validator.aclose = aclose
+
+    async def asgi_app(scope, receive, send):
+        assert scope['type'] == 'lifespan'
+        while True:
+            message = await receive()
+            await send({'type': message['type'] + '.complete'})
+            if message['type'] == 'lifespan.shutdown':
+                return
+
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        sent.append(message['type'])
+    app = oidcat.middleware.ASGIMiddleware(asgi_app, validator)
+    asyncio.run(app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert closed == [True]  # the introspection client is closed on shutdown
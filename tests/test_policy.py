@@ -0,0 +1,97 @@
+import time
+import functools
+import pytest
+import oidcat
+from oidcat.policy import Policy, PolicyRegistry
+
+
+TOKEN = oidcat.Token(oidcat.token.jwt_encode({'alg': 'none'}, {
+    'exp': time.time() + 300, 'aud': ['account', 'my-client'], 'scope': 'email profile',
+    'realm_access': {'roles': ['offline_access', 'participant']},
+    'resource_access': {'my-client': {'roles': ['read-data']}, 'account': {'roles': ['view-profile']}},
+}, 'x'))
+
+
+def test_policy_roles():
+    assert Policy().evaluate(TOKEN) is True
+    assert Policy('participant', 'admin').evaluate(TOKEN) is True
+    assert Policy('participant', 'admin', require=all).evaluate(TOKEN) == "Insufficient privileges. unable to: ['admin']"
+    assert Policy(['participant', 'read-data'], require=all).evaluate(TOKEN) is True
+    assert Policy(realm_roles='participant', client_roles='read-data').evaluate(TOKEN) is True
+    assert Policy(realm_roles='read-data').evaluate(TOKEN) is not True
+    assert Policy(client_roles='participant').evaluate(TOKEN) is not True
+
+    # client roles
+    assert Policy('view-profile').evaluate(TOKEN) is True  # all clients
+    assert Policy('view-profile').evaluate(TOKEN, 'my-client') is not True
+    assert Policy('view-profile', client_id=None).evaluate(TOKEN, 'my-client') is True
+    assert Policy('view-profile', client_id='account').evaluate(TOKEN, 'my-client') is True
+    assert Policy('read-data', client_id=False).evaluate(TOKEN) is not True
+
+    # glob patterns
+    assert Policy('read-*', 'admin').evaluate(TOKEN) is True
+    assert Policy(realm_roles='read-*').evaluate(TOKEN) == "Insufficient privileges. unable to: ['read-*']"
+    assert Policy('read-*', 'part*', require=all).evaluate(TOKEN) is True
+
+    with pytest.raises(oidcat.Unauthorized):
+        Policy('admin').check(TOKEN)
+    assert Policy('participant').check(TOKEN) is TOKEN
+
+
+def test_policy_scopes_audience_checks():
+    assert Policy(scopes='email profile').evaluate(TOKEN) is True
+    assert Policy(scopes=['email', 'openid']).evaluate(TOKEN) == 'Token does not have required scopes'
+    assert Policy(scopes='openid').evaluate(TOKEN, scopes=False) is True
+    assert Policy(audience=['my-client', 'other']).evaluate(TOKEN) is True
+    assert Policy(audience='other').evaluate(TOKEN) == 'Refused token because of invalid audience'
+
+    calls = []
+    def is_participant(token):
+        calls.append(token)
+        return 'participant' in token.realm_roles
+    assert Policy(checks=is_participant).evaluate(TOKEN) is True
+    assert Policy(checks=[is_participant, lambda t: False]).evaluate(TOKEN) == 'Insufficient privileges.'
+    assert Policy('admin', checks=is_participant).evaluate(TOKEN) is not True
+    assert len(calls) == 2  # not called when the roles fail
+
+    p = Policy('admin', 'admin', scopes='profile', checks=is_participant)
+    assert p.roles == ('admin',)
+    assert p.describe() == "roles=any of ['admin'] scopes=['profile'] checks=['is_participant']"
+    assert p.as_dict()['require'] == 'any'
+
+
+def test_policy_registry():
+    flask = pytest.importorskip('flask')
+    registry = PolicyRegistry()
+    admin = Policy('admin', scopes='profile')
+
+    def protect(policy):
+        def outer(func):
+            @functools.wraps(func)
+            def inner(*a, **kw):
+                policy.check(TOKEN)
+                return func(*a, **kw)
+            return registry.register(inner, policy)
+        return outer
+
+    app = flask.Flask(__name__)
+
+    @app.route('/')
+    def index():
+        return 'hi'
+
+    @app.route('/admin', methods=['GET', 'POST'])
+    @protect(admin)
+    def admin_view():
+        return 'hi admin'
+
+    assert registry.get(admin_view) is admin
+    assert registry.get(index) is None
+    routes = {rule: (methods, policy) for rule, methods, _, policy in registry.routes(app)}
+    assert routes['/admin'] == (['GET', 'POST'], admin)
+    assert routes['/'] == (['GET'], None)
+
+    report = registry.report(app)
+    assert "roles=any of ['admin'] scopes=['profile']" in report
+    assert '(unprotected)' in report
+    assert '(unprotected)' not in registry.report(app, unprotected=False)
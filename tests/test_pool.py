@@ -0,0 +1,63 @@
+import oidcat
+
+
+def test_pooled_session():
+    import requests
+    sess = oidcat.pool.PooledSession(pool_maxsize=3, timeout=5, keep_alive=False)
+    assert sess.get_adapter('https://auth.myproject.com')._pool_maxsize == 3
+    assert sess.headers['Connection'] == 'close'
+
+    # the default timeout is passed to each request
+    sent = []
+    class Adapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kw):
+            sent.append(kw['timeout'])
+            resp = requests.Response()
+            resp.status_code, resp._content = 200, b'{}'
+            return resp
+    sess.mount('https://', Adapter())
+    sess.get('https://auth.myproject.com')
+    sess.get('https://auth.myproject.com', timeout=1)
+    assert sent == [5, 1]
+
+    # WellKnown shares a pool by default
+    assert oidcat.WellKnown({}).sess is oidcat.pool.shared_session()
+    assert oidcat.WellKnown({}, sess=sess).sess is sess
+
+
+def test_shared_session_cookies_and_fork():
+    import os
+    import http.client
+    import requests
+    class Adapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kw):
+            msg = http.client.HTTPMessage()
+            msg['Set-Cookie'] = 'AUTH_SESSION_ID=abc; Path=/'
+            resp = requests.Response()
+            resp.status_code, resp._content, resp.url, resp.request = 200, b'{}', request.url, request
+            resp.raw = type('Raw', (), {'_original_response': type('Orig', (), {'msg': msg})()})()
+            return resp
+
+    def cookies(sess):
+        sess.mount('https://', Adapter())
+        sess.get('https://auth.myproject.com/')
+        return dict(sess.cookies)
+    assert cookies(oidcat.pool.PooledSession()) == {'AUTH_SESSION_ID': 'abc'}
+    # the shared session talks to unrelated auth servers, so it doesn't keep cookies
+    assert cookies(oidcat.pool.PooledSession(cookies=False)) == {}
+    assert oidcat.pool.shared_session().cookies.get_policy().allowed_domains() == ()
+
+    if not hasattr(os, 'fork'):
+        return
+    sess = oidcat.pool.shared_session()
+    wk = oidcat.WellKnown({})
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # the child gets its own shared session
+        os.write(w, b'1' if wk.sess is not sess and wk.sess is oidcat.pool.shared_session() else b'0')
+        os._exit(0)
+    os.waitpid(pid, 0)
+    result = os.read(r, 1)
+    os.close(r), os.close(w)
+    assert result == b'1'
+    assert wk.sess is sess
@@ -0,0 +1,220 @@
+import io
+import time
+import asyncio
+import contextlib
+import pytest
+import oidcat
+
+flask = pytest.importorskip('flask')
+pytest.importorskip('flask_oidc')
+import oidcat.server
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:  # py<3.8
+    import importlib_metadata
+
+CLIENT_ID = 'my-client'
+SECRETS = {'web': {
+    'client_id': CLIENT_ID, 'client_secret': 'secret',
+    'issuer': 'https://auth.myproject.com/auth/realms/master',
+    'auth_uri': 'https://auth.myproject.com/auth', 'token_uri': 'https://auth.myproject.com/token',
+    'userinfo_uri': 'https://auth.myproject.com/userinfo',
+    'token_introspection_uri': 'https://auth.myproject.com/introspect',
+    'redirect_uris': ['http://localhost/oidc_callback'],
+}}
+
+
+def make_token(**kw):
+    return oidcat.token.jwt_encode({'alg': 'none'}, dict({
+        'exp': time.time() + 300, 'aud': CLIENT_ID, 'scope': 'email profile',
+        'realm_access': {'roles': ['participant']},
+        'resource_access': {CLIENT_ID: {'roles': ['read-data']}, 'account': {'roles': ['view-profile']}},
+    }, **kw), 'x')
+
+
+@pytest.fixture
+def app():
+    if not importlib_metadata.version('flask-oidc').startswith('1.'):
+        pytest.skip('oidcat.server is built on flask_oidc 1.x')
+    app = flask.Flask(__name__)
+    app.config.update(SECRET_KEY='x', OIDC_CLIENT_SECRETS=SECRETS)
+    return app
+
+
+@pytest.fixture
+def oidc(app):
+    oidc = oidcat.server.OpenIDConnect(app)
+    # don't talk to an auth server - trust the token's claims
+    jwt_decode = oidcat.token.jwt_decode
+    oidc._well_known = oidcat.WellKnown({}, client_id=CLIENT_ID)
+    oidc._validator = oidcat.validation.TokenValidator(
+        oidc._well_known, CLIENT_ID,
+        introspect_func=lambda t: dict(jwt_decode(t)[1], active=True))
+    return oidc
+
+
+@contextlib.contextmanager
+def request_context(app, *a, **kw):
+    with app.test_request_context(*a, **kw):
+        app.preprocess_request()  # flask_oidc sets g.oidc_id_token
+        yield
+
+
+async def deny(resource):
+    raise oidcat.Unauthorized('nope')
+
+
+def test_async_permission_on_sync_view():
+    check = oidcat.server.protection(deny)
+
+    # an async check can't protect a sync view - it would never be awaited
+    with pytest.raises(TypeError):
+        @check('data')
+        def view(permissions):
+            return 'SECRET DATA'
+
+    # and calling it synchronously never counts as a pass
+    protected = oidcat.server._Protection(deny, 'data')
+    with pytest.raises(TypeError):
+        protected.require_permissions()
+    with pytest.raises(TypeError):
+        protected.has_permissions()
+    with pytest.raises(oidcat.Unauthorized):
+        asyncio.run(protected.require_permissions_async())
+    assert asyncio.run(protected.has_permissions_async()) is False
+
+
+def test_token_sources(app, oidc, monkeypatch):
+    H, Q, F = (make_token(sub=x) for x in 'HQF')
+    with request_context(app, '/', headers={'Authorization': 'Bearer ' + H}, query_string={'access_token': Q}):
+        assert oidc.token.token == H
+    # the query is checked before the form
+    with request_context(app, '/', method='POST', query_string={'access_token': Q}, data={'access_token': F}):
+        assert oidc.token.token == Q
+    with request_context(app, '/', method='POST', data={'access_token': F}):
+        assert oidc.token.token == F
+
+    # uploads without a token are never parsed
+    def load_form_data(self):
+        raise AssertionError('the form was parsed')
+    monkeypatch.setattr(app.request_class, '_load_form_data', load_form_data)
+    upload = {'file': (io.BytesIO(b'x' * 1024), 'data.bin'), 'access_token': F}
+    with request_context(app, '/', method='POST', data=upload, content_type='multipart/form-data'):
+        assert not oidc.token.token
+    monkeypatch.undo()
+
+    # only look where we're told to
+    app.config['OIDC_TOKEN_SOURCES'] = ['header']
+    with request_context(app, '/', query_string={'access_token': Q}):
+        assert not oidc.token.token
+    app.config['OIDC_TOKEN_SOURCES'] = ['header', 'cookie']
+    with request_context(app, '/', headers={'Authorization': 'Bearer ' + H}):
+        with pytest.raises(ValueError):
+            oidc.token
+
+
+def test_accept_token_roles(app, oidc):
+    routes = {
+        '/role': dict(role='read-data'),
+        '/realm': dict(realm_role='participant'),
+        '/client': dict(client_role='read-data'),
+        '/other-client': dict(role='view-profile'),  # account's role, not ours
+        '/realm-not-client': dict(realm_role='read-data'),
+        '/client-not-realm': dict(client_role='participant'),
+        '/scopes': dict(scopes='profile'),
+        '/missing-scopes': dict(scopes='openid'),
+    }
+    for path, kw in routes.items():
+        app.add_url_rule(path, path, oidc.accept_token(**kw)(lambda: 'ok'))
+
+    @app.route('/any-client')
+    @oidc.protect_roles('view-profile')
+    def any_client(permissions):
+        token, (has_role,) = permissions
+        return 'ok' if has_role else 'nope'
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + make_token()}
+    status = {path: client.get(path, headers=headers).status_code for path in list(routes) + ['/any-client']}
+    assert status == {
+        '/role': 200, '/realm': 200, '/client': 200, '/other-client': 401,
+        '/realm-not-client': 401, '/client-not-realm': 401, '/scopes': 200, '/missing-scopes': 401,
+        '/any-client': 200,
+    }
+    assert client.get('/any-client', headers=headers).data == b'ok'
+    assert client.get('/role').status_code == 401
+    report = {line.split()[1]: line for line in oidc.policy_report(app).splitlines()}
+    assert report['/other-client'].endswith("roles=any of ['view-profile']")
+    assert report['/any-client'].endswith("roles=any of ['view-profile'] client_id=None")
+
+
+def test_decoded_tokens_are_reused(app, oidc, monkeypatch):
+    decoded = []
+    jwt_decode = oidcat.token.jwt_decode
+    monkeypatch.setattr(oidcat.token, 'jwt_decode', lambda t: decoded.append(t) or jwt_decode(t))
+
+    @app.route('/')
+    @oidc.accept_token(role='read-data')
+    def index():
+        return oidc.token.preferred_username
+
+    client = app.test_client()
+    token = make_token(preferred_username='bob')
+    for _ in range(3):
+        resp = client.get('/', headers={'Authorization': 'Bearer ' + token})
+        assert resp.status_code == 200 and resp.data == b'bob'
+    assert decoded == [token]
+
+    # each request gets its own copy, so a rejection doesn't stick
+    with request_context(app, headers={'Authorization': 'Bearer ' + token}):
+        with pytest.raises(oidcat.Unauthorized):
+            oidc.valid_token('admin')
+        assert not oidc.token.valid
+    with request_context(app, headers={'Authorization': 'Bearer ' + token}):
+        assert oidc.valid_token('read-data').valid
+
+
+def test_request_cached():
+    app = flask.Flask(__name__)
+    calls = []
+    def validate(token):
+        calls.append(token)
+        return True, {'active': True}
+    async def avalidate(token):
+        return validate(token)
+
+    with app.test_request_context('/'):
+        for _ in range(3):
+            assert oidcat.server.request_cached(('validate', 'abc'), validate, 'abc') == (True, {'active': True})
+        assert asyncio.run(oidcat.server.request_cached_async(('validate', 'abc'), avalidate, 'abc'))[0] is True
+        assert len(calls) == 1
+        oidcat.server.request_cached(('validate', 'xyz'), validate, 'xyz')
+        assert len(calls) == 2
+
+    with app.test_request_context('/'):  # a new request starts fresh
+        oidcat.server.request_cached(('validate', 'abc'), validate, 'abc')
+        assert len(calls) == 3
+    oidcat.server.request_cached(('validate', 'abc'), validate, 'abc')  # no app context
+    assert len(calls) == 4
+
+
+def test_nested_protections_validate_once(app, oidc):
+    calls = []
+    introspect = oidc.validator.introspect_func
+    oidc.validator.introspect_func = lambda t: calls.append(t) or introspect(t)
+
+    @app.route('/')
+    @oidc.accept_token(scopes='profile')
+    @oidc.protect_roles('read-data')
+    def index(permissions):
+        # different scopes are checked against the same validation
+        assert oidc.validate_token(oidc.token.token, ['email', 'profile']) is True
+        assert oidc.validate_token(oidc.token.token, 'openid') != True
+        return 'ok'
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + make_token()}
+    assert client.get('/', headers=headers).status_code == 200
+    assert len(calls) == 1
+    assert client.get('/', headers=headers).status_code == 200
+    assert len(calls) == 2  # once per request
@@ -0,0 +1,34 @@
+import os
+import time
+import oidcat
+
+
+def test_token_store(tmpdir):
+    fname = str(tmpdir.join('tokens.json'))
+    store = oidcat.store.TokenStore(fname)
+    assert store.load() == (None, None)
+
+    store.save('access', 'refresh')
+    assert oct(os.stat(fname).st_mode & 0o777) == '0o600'
+    other = oidcat.store.TokenStore(fname)  # e.g. another process
+    assert other.load() == ('access', 'refresh')
+    assert other.load() == ('access', 'refresh')
+    assert other.stats() == {'reads': 1, 'writes': 0}  # only re-read when it changes
+
+    store.save('access2')
+    assert other.load() == ('access2', None)
+    store.clear()
+    assert other.load() == (None, None)
+    assert other.reads == 3 and store.writes == 3
+
+
+def test_token_store_buffered_tokens(tmpdir):
+    store = oidcat.store.TokenStore(str(tmpdir.join('tokens.json')))
+    now = time.time()
+    token = oidcat.Token(oidcat.token.jwt_encode({'alg': 'none'}, {'exp': now + 10}, 'x'), buffer=60)
+    refresh = oidcat.Token(oidcat.token.jwt_encode({'alg': 'none'}, {'exp': now + 30}, 'x'), buffer=60)
+    assert not token and not refresh  # inside their buffers, but still usable
+    store.save(token, refresh)
+    assert store.load() == (str(token), str(refresh))
+    store.save(oidcat.Token(), None)
+    assert store.load() == (None, None)
@@ -1,4 +1,5 @@
 import pytest
+import sys
 import time
 import datetime
 import oidcat
@@ -119,3 +120,135 @@ def test_token_roles():
         assert t.check_roles(*realm, client_only=True, required=True)
     with pytest.raises(oidcat.Unauthorized):
         assert t.check_roles(GIBBERISH, required=True)
+
+
+def test_token_role_index():
+    t = oidcat.Token(EXAMPLE_TOKEN)
+    realm = TOKEN_DATA['realm_access']['roles']
+    client = TOKEN_DATA['resource_access']['account']['roles']
+    # built once and reused
+    assert isinstance(t.roles, frozenset) and t.roles is t.roles
+    assert t.realm_roles is t.realm_roles
+    assert t.client_roles() is t.client_roles(True)
+    assert t.client_roles('account') is t.client_roles('account')
+    assert t.client_roles(GIBBERISH) == set()
+    assert t.client_roles('account', GIBBERISH) == set(client)
+    with pytest.raises(ValueError):
+        t.client_roles(GIBBERISH, allow_missing=False)
+    assert all(r is sys.intern(r) for r in t.roles)
+
+    assert t.has_role(realm[0], realm=realm[0], client=client[0], client_id='account')
+    assert not t.has_role(realm[0], realm=realm[0], client=GIBBERISH, client_id='account')
+    assert t.has_role(client=[GIBBERISH, client[0]], realm=False)
+    assert not t.has_role(realm[0], realm=False)
+    assert not t.has_role(client[0], client_id=False)
+
+    # the index follows changes to the token data
+    t['realm_access'] = {'roles': ['new-role']}
+    assert t.realm_roles == {'new-role'} and t.has_role('new-role')
+    t.pop('resource_access')
+    assert t.roles == {'new-role'}
+    assert oidcat.Token().roles == set()
+
+
+def test_token_role_patterns():
+    t = oidcat.Token(oidcat.token.mod_token(EXAMPLE_TOKEN, realm_access={
+        'roles': ['data-read-audio', 'data-read-spl', 'data-write-meta']}))
+    assert t.has_role('data-read-*')
+    assert t.has_role('nope', 'data-?rite-*')
+    assert not t.has_role('data-delete-*')
+    assert t.has_role(realm='data-*-spl', client='manage-*')
+    assert not t.has_role(client='data-*')
+    assert t.check_roles('data-read-*', 'data-delete-*', 'manage-account') == [True, False, True]
+    assert t.check_roles('data-read-[as]*', realm_only=True, asdict=True) == {'data-read-[as]*': True}
+    with pytest.raises(oidcat.Unauthorized):
+        t.check_roles('data-delete-*', 'admin', required=True)
+
+    # compiled once and cached per role set
+    matcher = oidcat.token.compile_roles(('admin', 'data-read-*', 'data-write-*'))
+    assert matcher is oidcat.token.compile_roles(('admin', 'data-read-*', 'data-write-*'))
+    assert matcher.exact == {'admin'} and len(matcher.patterns) == 2
+    assert matcher.matching(t.roles) == {'data-read-audio', 'data-read-spl', 'data-write-meta'}
+    assert matcher.matching(t.roles) is matcher.matching(t.roles)
+    assert matcher.has('data-write-*', t.roles) and not matcher.has('admin', t.roles)
+    assert matcher.any(t.roles) and matcher.any.cache_info().currsize == 1
+    # exact roles are a set lookup, no regex needed
+    exact = oidcat.token.compile_roles(('admin', 'data-read-spl'))
+    assert exact.any(t.roles) and exact.matching(t.roles) == set()
+    assert not oidcat.token.compile_roles(('admin',)).any(t.roles)
+
+    r = oidcat.util.Role('data')
+    assert r.read('*') == ['data-read-*']
+    assert (r.read + r.write)('*').matches('data-write-meta')
+    assert not r.read('*').matches('data-write-meta', 'admin')
+
+
+def test_lazy_token():
+    t = oidcat.Token(EXAMPLE_TOKEN, lazy=True)
+    assert str(t) == EXAMPLE_TOKEN
+    assert not t._decoded
+    assert t['sub'] == TOKEN_DATA['sub']
+    assert t._decoded
+
+    # anything that looks at the data decodes the token
+    for check in (
+            lambda t: dict(t) == TOKEN_DATA,
+            lambda t: 'exp' in t,
+            lambda t: len(t) == len(TOKEN_DATA),
+            lambda t: t.get('exp') == TOKEN_DATA['exp'],
+            lambda t: t == TOKEN_DATA,
+            lambda t: t.header['alg'] == 'RS256',
+            lambda t: t.given_name == TOKEN_DATA['given_name'],
+            lambda t: t.expires.timestamp() == TOKEN_DATA['exp'],
+            lambda t: not t,
+            lambda t: t.realm_roles == set(TOKEN_DATA['realm_access']['roles'])):
+        assert check(oidcat.Token(EXAMPLE_TOKEN, lazy=True))
+
+    # garbage isn't noticed until it's decoded
+    t = oidcat.Token(GIBBERISH, lazy=True)
+    assert str(t) == GIBBERISH
+    with pytest.raises(ValueError):
+        t.get('exp')
+
+
+def test_token_buffer():
+    exp = time.time() + 10
+    t = oidcat.Token(oidcat.token.mod_token(EXAMPLE_TOKEN, exp=exp), buffer=5)
+    assert t.expires == datetime.datetime.fromtimestamp(exp)
+    assert t.buffer == datetime.timedelta(seconds=5)
+    assert 9 < t.seconds_left <= 10
+    assert t
+    t.buffer = datetime.timedelta(seconds=11)
+    assert not t
+    assert t.valid
+    # default buffer is 5% of the time left
+    t = oidcat.Token(oidcat.token.mod_token(EXAMPLE_TOKEN, exp=exp))
+    assert round(t.buffer.total_seconds(), 1) == 0.5
+    assert oidcat.Token().seconds_left == 0
+
+
+def test_token_copy():
+    import copy
+    t = oidcat.Token(EXAMPLE_TOKEN)
+    c = copy.copy(t)
+    assert type(c) is oidcat.Token and c is not t
+    assert c == t == TOKEN_DATA and str(c) == EXAMPLE_TOKEN
+    assert c.realm_roles is t.realm_roles and c.header is t.header  # not decoded again
+    c.valid = False
+    assert c.validity == 'Token invalid' and t.validity == 'Token expired'
+    assert not copy.copy(oidcat.Token(EXAMPLE_TOKEN, lazy=True))._decoded
+
+
+def test_token_deepcopy_and_pickle():
+    import copy
+    import pickle
+    for lazy in (False, True):
+        t = oidcat.Token(EXAMPLE_TOKEN, lazy=lazy)
+        for c in (copy.deepcopy(t), pickle.loads(pickle.dumps(t))):
+            assert type(c) is oidcat.Token and c is not t
+            assert str(c) == EXAMPLE_TOKEN
+            assert c == TOKEN_DATA and c.realm_roles == set(TOKEN_DATA['realm_access']['roles'])
+            assert c.expires == t.expires and c.validity == 'Token expired'
+    assert pickle.loads(pickle.dumps(oidcat.Token())).token is None
+    with pytest.raises(AttributeError):
+        oidcat.Token(EXAMPLE_TOKEN).not_a_claim
@@ -113,3 +113,72 @@ def test_exceptions():
     out, code, headers = oidcat.exc2response(oidcat.Unauthorized(), asresponse=False)
     err = oidcat.RequestError.from_response(out)
     assert 'Unauthorized: Insufficient privileges' in str(err)
+
+
+def test_lazy_import():
+    import sys
+    import subprocess
+    code = (
+        'import sys, oidcat; from oidcat import Token; '
+        'assert "requests" not in sys.modules, "requests was imported"; '
+        'oidcat.Session; assert "requests" in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    namespace = {}
+    exec('from oidcat import *', namespace)
+    assert namespace['Session'] is oidcat.core.Session and namespace['WellKnown'] is oidcat.WellKnown
+    assert {'Access', 'response_json', 'Token', 'Unauthorized', 'util', 'role'} <= set(namespace)
+    assert oidcat.WellKnown is oidcat.well_known.WellKnown
+    assert 'Session' in dir(oidcat)
+    with pytest.raises(AttributeError):
+        oidcat.not_a_thing
+
+
+def test_atomic_write_and_lock(tmpdir):
+    import threading
+    fname = str(tmpdir.join('sub', 'data.json'))
+    oidcat.util.atomic_write(fname, '{"a": 1}')
+    oidcat.util.atomic_write(fname, b'{"a": 2}')
+    with open(fname) as f:
+        assert f.read() == '{"a": 2}'
+    assert os.listdir(os.path.dirname(fname)) == ['data.json']
+
+    held = threading.Event()
+    def hold():
+        with oidcat.util.file_lock(fname):
+            held.set()
+            time.sleep(0.2)
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait()
+    start = time.time()
+    with oidcat.util.file_lock(fname):
+        assert time.time() - start >= 0.15
+    t.join()
+
+
+def test_saveddict(tmpdir):
+    import base64, json
+    fname = str(tmpdir.join('cfg.json'))
+    with oidcat.util.saveddict(fname) as cfg:
+        assert cfg == {}
+    assert not os.path.exists(fname)  # nothing to write
+
+    with oidcat.util.saveddict(fname, lock=True) as cfg:
+        cfg['a'] = {'b': 1}
+    with open(fname, 'rb') as f:
+        assert json.loads(base64.b64decode(f.read())) == {'a': {'b': 1}}
+
+    # unchanged - don't touch the file
+    mtime = os.stat(fname).st_mtime_ns
+    time.sleep(0.01)
+    with oidcat.util.saveddict(fname) as cfg:
+        assert cfg == {'a': {'b': 1}}
+    assert os.stat(fname).st_mtime_ns == mtime
+
+    # plain json, and either format can be read
+    with oidcat.util.saveddict(fname, plain=True) as cfg:
+        cfg['a']['b'] = 2
+    with open(fname) as f:
+        assert json.load(f) == {'a': {'b': 2}}
+    with oidcat.util.saveddict(fname) as cfg:
+        assert cfg == {'a': {'b': 2}}
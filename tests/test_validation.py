@@ -0,0 +1,285 @@
+import time
+import json
+import pytest
+import oidcat
+
+jwt = pytest.importorskip('jwt')
+pytest.importorskip('cryptography')
+
+ISSUER = 'https://auth.myproject.com/auth/realms/master'
+CLIENT_ID = 'my-client'
+
+
+@pytest.fixture(scope='module')
+def keypair():
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update(kid='key1', alg='RS256', use='sig')
+    return key, jwk
+
+
+class FakeSession:
+    '''Pretends to be the auth server's JWKS endpoint.'''
+    def __init__(self, keys):
+        self.keys = keys
+        self.calls = 0
+
+    def get(self, url, **kw):
+        self.calls += 1
+        return FakeResponse({'keys': list(self.keys)})
+
+
+class FakeResponse:
+    status_code = 200
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def wk(keypair):
+    return oidcat.WellKnown(
+        {'issuer': ISSUER, 'jwks_uri': 'https://auth.myproject.com/certs'}, CLIENT_ID,
+        sess=FakeSession([keypair[1], {'kid': 'enc1', 'kty': 'RSA', 'use': 'enc', 'alg': 'RSA-OAEP'}]))
+
+
+def make_token(key, kid='key1', **kw):
+    data = dict({
+        'exp': time.time() + 60, 'iat': time.time(), 'iss': ISSUER,
+        'aud': CLIENT_ID, 'scope': 'email profile',
+    }, **kw)
+    return jwt.encode(data, key, algorithm='RS256', headers={'kid': kid})
+
+
+def test_verify_token(keypair, wk):
+    key, _ = keypair
+    data = wk.verify_token(make_token(key))
+    assert data['iss'] == ISSUER
+    assert wk.verify_token(make_token(key), audience=CLIENT_ID)['aud'] == CLIENT_ID
+
+    with pytest.raises(oidcat.Unauthorized):
+        wk.verify_token(make_token(key), audience='someone-else')
+    with pytest.raises(oidcat.Unauthorized):
+        wk.verify_token(make_token(key, exp=time.time() - 10))
+    with pytest.raises(oidcat.Unauthorized):
+        wk.verify_token(make_token(key, iss='https://evil.com'))
+    with pytest.raises(oidcat.Unauthorized):
+        wk.verify_token(make_token(key, kid='unknown'))
+    with pytest.raises(oidcat.Unauthorized):
+        wk.verify_token(oidcat.token.mod_token(make_token(key), sub='admin'))
+
+
+def test_key_store(keypair, wk):
+    key, jwk = keypair
+    wk.verify_token(make_token(key))
+    wk.verify_token(make_token(key))
+    assert wk.sess.calls == 1
+    assert wk.key_store.stats() == {'hits': 2, 'misses': 0, 'fetches': 1, 'keys': 1}
+    assert 'jwks_uri' in wk.keys() and dict(wk)['jwks_uri'] == wk['jwks_uri']  # still a dict
+
+    # unknown key ids only trigger a refetch once per interval
+    for _ in range(3):
+        with pytest.raises(oidcat.Unauthorized):
+            wk.verify_token(make_token(key, kid='rotated'))
+    assert wk.sess.calls == 1
+    assert wk.key_store.misses == 3
+
+    # key rotation
+    wk.key_store.refetch_interval = 0
+    wk.sess.keys.append(dict(jwk, kid='rotated'))
+    wk.verify_token(make_token(key, kid='rotated'))
+    assert wk.sess.calls == 2
+    assert 'rotated' in wk.key_store
+
+    # expired keys
+    wk.key_store.ttl = 0
+    wk.verify_token(make_token(key))
+    assert wk.sess.calls == 3
+
+
+def test_validator_local(keypair, wk):
+    key, _ = keypair
+    introspected = []
+    def introspect(token):
+        introspected.append(token)
+        return {'active': False}
+
+    validator = oidcat.validation.TokenValidator(
+        wk, local=True, introspect=False, introspect_func=introspect)
+    validity, info = validator.validate(make_token(key))
+    assert validity is True and info['active']
+    assert validator.validate(make_token(key), ['email'])[0] is True
+    assert validator.validate(make_token(key), ['openid'])[0] == 'Token does not have required scopes'
+    assert validator.validate(make_token(key, aud='account'))[0] == 'Refused token because of invalid audience'
+    assert validator.validate(make_token(key, exp=time.time() - 10))[0] is not True
+    assert validator.validate('')[0] == 'Missing token'
+    assert not introspected
+
+    # fall back to introspection
+    validator.introspect = True
+    assert validator.validate(make_token(key, kid='unknown'))[0] == 'Token is not active.'
+    assert len(introspected) == 1
+
+
+def test_validator_cache(keypair, wk):
+    key, _ = keypair
+    validator = oidcat.validation.TokenValidator(wk, local=True, introspect=False, negative_ttl=60)
+    token = make_token(key)
+    assert validator.validate(token)[0] is True
+    assert validator.validate(token)[0] is True
+    assert validator.cache.stats()['hits'] == 1
+    assert wk.key_store.hits == 1  # the signature was only verified once
+
+    # tokens are only cached until they expire
+    exp = int(time.time()) + 30
+    short = make_token(key, exp=exp)
+    validator.validate(short)
+    assert validator.cache._data[oidcat.cache.token_key(short)][1] == exp
+
+    # rejected tokens are remembered
+    bad = oidcat.token.mod_token(token, sub='admin')
+    assert validator.validate(bad)[0] is not True
+    assert validator.validate(bad)[0] is not True
+    assert validator.rejected.stats()['hits'] == 1
+
+
+def test_validator_introspection_cache(keypair, wk):
+    key, _ = keypair
+    calls = []
+    def introspect(token):
+        calls.append(token)
+        return dict(oidcat.token.jwt_decode(token)[1], active=True)
+
+    validator = oidcat.validation.TokenValidator(wk, introspect_func=introspect)
+    token = make_token(key)
+    assert validator.validate(token)[0] is True
+    assert validator.validate(token)[0] is True
+    assert len(calls) == 2  # disabled by default
+
+    validator.introspection_ttl = 60
+    for _ in range(3):
+        assert validator.validate(token)[0] is True
+    assert len(calls) == 3
+    stats = validator.stats()
+    assert stats['introspection_cache']['hits'] == 2
+    assert stats['introspection_latency']['count'] == 3
+
+    # never outlive the token
+    exp = int(time.time()) + 5
+    short = make_token(key, exp=exp)
+    validator.validate(short)
+    assert validator.introspection_cache._data[oidcat.cache.token_key(short)][1] == exp
+
+
+def test_validator_async(keypair, wk):
+    import asyncio
+    key, _ = keypair
+    calls = []
+    async def introspect(token):
+        calls.append(token)
+        await asyncio.sleep(0.05)
+        return dict(oidcat.token.jwt_decode(token)[1], active=True)
+
+    validator = oidcat.validation.TokenValidator(wk, async_introspect_func=introspect)
+    token = make_token(key)
+
+    async def main():
+        # concurrent requests with the same token share one introspection
+        return await asyncio.gather(*(validator.avalidate(token) for _ in range(5)))
+    results = asyncio.run(main())
+    assert all(validity is True for validity, _ in results)
+    assert len(calls) == 1
+    assert validator.stats()['async_introspection_flight'] == {'calls': 1, 'shared': 4, 'in_flight': 0}
+
+    assert asyncio.run(validator.avalidate(make_token(key, aud='someone-else')))[0] == (
+        'Refused token because of invalid audience')
+    assert asyncio.run(validator.avalidate(''))[0] == 'Missing token'
+
+    # local verification - fetching the keys (first use or an unknown kid) happens in a thread
+    import threading
+    threads = []
+    get = wk.sess.get
+    wk.sess.get = lambda *a, **kw: threads.append(threading.current_thread()) or get(*a, **kw)
+    validator = oidcat.validation.TokenValidator(wk, local=True, introspect=False)
+    assert asyncio.run(validator.avalidate(token))[0] is True
+    assert asyncio.run(validator.avalidate(make_token(key, kid='rotated')))[0] != True
+    assert asyncio.run(validator.avalidate(make_token(key, sub='other')))[0] is True
+    assert wk.sess.calls == 1 and len(threads) == 1  # the kid refetch is throttled by refetch_interval
+    assert threads[0] is not threading.main_thread()
+    wk.key_store.refetch_interval = 0
+    assert asyncio.run(validator.avalidate(make_token(key, kid='rotated')))[0] != True
+    assert len(threads) == 2 and threads[1] is not threading.main_thread()
+
+
+def test_validator_async_client(wk, monkeypatch):
+    import asyncio
+    httpx = pytest.importorskip('httpx')
+    requests, clients = [], []
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={'active': True, 'aud': CLIENT_ID})
+    class AsyncClient(httpx.AsyncClient):
+        def __init__(self, **kw):
+            clients.append(self)
+            super().__init__(transport=httpx.MockTransport(handler), **kw)
+    monkeypatch.setattr(httpx, 'AsyncClient', AsyncClient)
+
+    wk['token_introspection_endpoint'] = 'https://auth.myproject.com/introspect'
+    validator = oidcat.validation.TokenValidator(wk)
+    async def main():
+        for i in range(3):
+            assert (await validator.avalidate('token{}'.format(i)))[0] is True
+        await validator.aclose()
+    asyncio.run(main())
+    # one client (and its connection pool) for all of the introspections on the loop
+    assert len(requests) == 3 and len(clients) == 1 and clients[0].is_closed
+    assert not validator._async_clients
+
+    # a new loop gets a new client, and clients of closed loops are dropped
+    asyncio.run(validator.avalidate('token4'))
+    asyncio.run(validator.avalidate('token5'))
+    assert len(clients) == 3 and len(validator._async_clients) == 1
+
+
+def test_validator_stale_if_error(keypair, wk):
+    key, _ = keypair
+    down = []
+    def introspect(token):
+        if down:
+            raise oidcat.AuthServerUnavailable()
+        return dict(oidcat.token.jwt_decode(token)[1], active=True)
+
+    validator = oidcat.validation.TokenValidator(wk, introspect_func=introspect, stale_if_error=60)
+    token, other = make_token(key), make_token(key, sub='other')
+    assert validator.validate(token)[0] is True
+    down.append(True)
+    assert validator.validate(token)[0] is True  # served from the stale cache
+    assert 'unavailable' in validator.validate(other)[0]
+    assert validator.stats()['stale']['hits'] == 1
+
+
+def test_validator_validate_many(keypair, wk):
+    key, _ = keypair
+    calls = []
+    def introspect(token):
+        calls.append(token)
+        return {'active': False}
+
+    validator = oidcat.validation.TokenValidator(wk, local=True, introspect_func=introspect)
+    good, other, rotated = make_token(key), make_token(key, scope='email'), make_token(key, kid='unknown')
+    tokens = [good, rotated, '', good, other, rotated, good]
+    results = validator.validate_many(tokens, max_workers=4)
+    assert [v for v, _ in results] == [
+        True, 'Token is not active.', 'Missing token', True, True, 'Token is not active.', True]
+    assert results[0] == results[3] == results[6]
+    assert calls == [rotated]  # duplicates are only validated once
+    assert wk.sess.calls == 1  # the keys were only fetched once
+
+    # seen tokens come straight from the caches
+    results = validator.validate_many([other, good], ['profile'])
+    assert [v for v, _ in results] == ['Token does not have required scopes', True]
+    assert validator.cache.stats()['hits'] == 2
+    assert validator.validate_many([]) == []
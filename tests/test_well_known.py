@@ -0,0 +1,54 @@
+import pytest
+import oidcat
+
+
+def test_well_known_retries():
+    import requests
+
+    class FlakySession:
+        '''Fails the first n requests.'''
+        def __init__(self, n, error=None, status=200):
+            self.n, self.error, self.status = n, error, status
+            self.calls = []
+
+        def post(self, **kw):
+            self.calls.append(kw)
+            if len(self.calls) <= self.n:
+                if self.error:
+                    raise self.error
+                return Response(503, {})
+            return Response(200, {'active': True})
+        get = post
+
+    class Response:
+        def __init__(self, status_code, data):
+            self.status_code, self.data = status_code, data
+
+        def json(self):
+            return self.data
+
+    data = {'token_introspection_endpoint': 'x', 'token_endpoint': 'y', 'jwks_uri': 'z'}
+    sess = FlakySession(2, requests.ConnectionError())
+    wk = oidcat.WellKnown(data, sess=sess, retry_backoff=0.001)
+    assert wk.tokeninfo('abc') == {'active': True}
+    assert len(sess.calls) == 3
+    assert sess.calls[0]['timeout'] == 5  # tokeninfo uses the short timeout
+
+    # logins aren't retried
+    sess = FlakySession(1, requests.Timeout())
+    wk = oidcat.WellKnown(data, sess=sess, timeouts={'token': 3})
+    with pytest.raises(requests.Timeout):
+        wk.get_token('user', 'pass')
+    assert len(sess.calls) == 1 and sess.calls[0]['timeout'] == 3
+
+    # 5xx responses trip the breaker, then we fail fast
+    sess = FlakySession(100)
+    wk = oidcat.WellKnown(data, sess=sess, retries=1, retry_backoff=0.001,
+                          breaker=oidcat.breaker.CircuitBreaker(3, 60))
+    assert wk.tokeninfo('abc') == {}  # the error response is returned after the last retry
+    with pytest.raises(oidcat.AuthServerUnavailable):
+        wk.tokeninfo('abc')  # the first retry trips the breaker
+    assert len(sess.calls) == 3
+    with pytest.raises(oidcat.AuthServerUnavailable):
+        wk.tokeninfo('abc')
+    assert len(sess.calls) == 3